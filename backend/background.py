@@ -0,0 +1,78 @@
+"""
+Coalescing background passes: work an upload triggers but that runs off the request thread.
+
+Each BackgroundPass owns at most one daemon thread. request() starts it if needed; a
+request made while a pass is running schedules exactly one more pass, so a burst of
+uploads costs one or two passes rather than one each. A pass can also ask to run again
+after a delay (e.g. the next outbox retry); a request cuts that wait short. The thread
+exits once a pass asks for nothing more and no request came in meanwhile.
+"""
+import logging
+import threading
+from typing import Callable, Optional
+from database import db
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundPass:
+    """
+    Runs `run` on a background thread inside the app context. `run` returns None when it
+    is done, or the seconds to wait before the next pass. A pass that raises is rolled back,
+    logged, and retried after `error_delay` seconds (None: on the next request only).
+    """
+
+    def __init__(self, name: str, run: Callable[[], Optional[float]], error_delay: Optional[float] = None):
+        self.name = name
+        self.run = run
+        self.error_delay = error_delay
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._wake = threading.Event()
+        self._stopping = False
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def request(self, app):
+        """Run a pass soon: start the thread, or have the running one go again."""
+        with self._lock:
+            if self._stopping:
+                return
+            self._wake.set()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, args=(app,), name=self.name, daemon=True)
+                self._thread.start()
+
+    def _worker(self, app):
+        while True:
+            self._wake.clear()
+            with app.app_context():
+                try:
+                    delay = self.run()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Background {self.name} pass failed: {e}")
+                    delay = self.error_delay
+            with self._lock:
+                if self._stopping or (delay is None and not self._wake.is_set()):
+                    self._thread = None
+                    return
+            self._wake.wait(delay)
+
+    def wait(self, timeout: float) -> bool:
+        """Wait up to `timeout` seconds for the thread to finish; False if it is still running."""
+        with self._lock:
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+            return not thread.is_alive()
+        return True
+
+    def stop(self, timeout: float) -> bool:
+        """Let the current pass finish and ignore later requests; False if still busy after `timeout` seconds."""
+        with self._lock:
+            self._stopping = True
+        self._wake.set()
+        return self.wait(timeout)
@@ -0,0 +1 @@
+"""Benchmarks for the photos backend. Run modules from the backend directory, e.g. `python -m benchmarks.image_prep`."""
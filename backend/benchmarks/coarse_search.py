@@ -0,0 +1,132 @@
+"""
+Coarse-to-fine search benchmark: 128-d scan + 512-d re-rank vs a full 512-d scan.
+
+The model produces both sizes from the same underlying representation. To mimic
+that, both synthetic embeddings are noisy projections of one shared latent vector
+(--latent dimensions, clustered into topics) to 512 and 128 dimensions; --head-noise
+sets how much the two sizes disagree.
+
+--end-to-end times search_photo_ids itself with and without coarse-to-fine, against
+the fake vector index (benchmarks.fakes) at each --vector-ms round-trip latency:
+0 ms stands for the local index (VECTOR_BACKEND=ivf), tens of ms for Pinecone.
+
+Usage:
+    python -m benchmarks.coarse_search
+    python -m benchmarks.coarse_search --vectors 200000 --candidates 100 300 1000
+    python -m benchmarks.coarse_search --end-to-end --vectors 20000 --vector-ms 0 30
+"""
+import argparse
+import time
+import numpy as np
+from constants import COARSE_VECTOR_DIMENSION, VECTOR_DIMENSION
+from vector_index import normalize
+from benchmarks.vector_index import recall, synthetic_vectors
+
+
+def embed(latent: np.ndarray, dimension: int, noise: float, seed: int) -> np.ndarray:
+    """Similarity-preserving (orthonormal) projection of latent vectors to `dimension`, plus a little noise."""
+    rng = np.random.default_rng(seed)
+    projection = np.linalg.qr(rng.normal(size=(dimension, latent.shape[1])))[0].T.astype(np.float32)
+    return normalize(latent @ projection + rng.normal(scale=noise, size=(len(latent), dimension)).astype(np.float32))
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    best = np.argpartition(-scores, k - 1)[:k]
+    return best[np.argsort(-scores[best])]
+
+
+def bench_search_photo_ids(args, vectors: np.ndarray, coarse_vectors: np.ndarray):
+    """p50 of cold search_photo_ids calls, full search vs coarse-to-fine, per simulated vector latency."""
+    from benchmarks.fakes import Latencies, install_fakes, use_scratch_environment
+
+    workdir = use_scratch_environment()
+    fakes = install_fakes(Latencies(embedding_ms=args.embedding_ms), f"{workdir}/vectors")
+
+    import photo_service
+    from constants import LOCATION_NAMESPACE, PHOTOS_NAMESPACE
+    from database import db
+    from main import create_app
+    from search_cache import invalidate_search_cache
+
+    ids = [str(i) for i in range(len(vectors))]
+    for index, namespace, data in [
+        (fakes["vector_index"], PHOTOS_NAMESPACE, vectors),
+        (fakes["vector_index"], LOCATION_NAMESPACE, vectors),
+        (fakes["coarse_vector_index"], PHOTOS_NAMESPACE, coarse_vectors),
+    ]:
+        for start in range(0, len(ids), 1000):
+            index.upsert(vectors=list(zip(ids[start:start + 1000], data[start:start + 1000])), namespace=namespace)
+        index.wait_for_training()
+
+    queries = [f"benchmark query {i}" for i in range(min(args.queries, 50))]
+    print(f"\nsearch_photo_ids end to end, {len(vectors)} photos, {len(queries)} queries, "
+          f"{args.embedding_ms:g} ms per embedding\n")
+    print(f"{'vector ms':>9} {'search':<24} {'p50 ms':>8} {'vs full':>8}")
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        for vector_ms in args.vector_ms:
+            fakes["vector_index"].latency_ms = fakes["coarse_vector_index"].latency_ms = vector_ms
+            medians = {}
+            for coarse in (False, True):
+                photo_service.COARSE_SEARCH = coarse
+                latencies = []
+                for query in queries:
+                    invalidate_search_cache()
+                    started = time.perf_counter()
+                    photo_service.search_photo_ids(query, top_k=args.top_k)
+                    latencies.append((time.perf_counter() - started) * 1000)
+                medians[coarse] = np.median(latencies)
+            for coarse, label in [(False, f"full {VECTOR_DIMENSION}-d"), (True, f"coarse + re-rank {photo_service.COARSE_CANDIDATES}")]:
+                print(f"{vector_ms:>9g} {label:<24} {medians[coarse]:>8.2f} {medians[coarse] / medians[False]:>7.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark coarse-to-fine search against a full scan")
+    parser.add_argument("--vectors", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--clusters", type=int, default=500)
+    parser.add_argument("--latent", type=int, default=64, help="Dimensions of the shared latent representation")
+    parser.add_argument("--noise", type=float, default=2.0, help="Spread of each topic in latent space")
+    parser.add_argument("--head-noise", type=float, default=0.02, help="Noise added by each output projection")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--candidates", type=int, nargs="+", default=[100, 300, 1000])
+    parser.add_argument("--end-to-end", action="store_true", help="Also time search_photo_ids against the fake index")
+    parser.add_argument("--vector-ms", type=float, nargs="+", default=[0.0, 30.0], help="Simulated vector call latencies (--end-to-end)")
+    parser.add_argument("--embedding-ms", type=float, default=0.0, help="Simulated embedding latency (--end-to-end)")
+    args = parser.parse_args()
+
+    latent = synthetic_vectors(args.vectors + args.queries, args.latent, args.clusters, args.noise)
+    data = embed(latent, VECTOR_DIMENSION, args.head_noise, seed=1)
+    coarse_data = embed(latent, COARSE_VECTOR_DIMENSION, args.head_noise, seed=2)
+    vectors, queries = data[:args.vectors], data[args.vectors:]
+    coarse_vectors, coarse_queries = coarse_data[:args.vectors], coarse_data[args.vectors:]
+
+    truth, full_ms = [], []
+    for query in queries:
+        started = time.perf_counter()
+        truth.append(top_k(vectors @ query, args.top_k).tolist())
+        full_ms.append((time.perf_counter() - started) * 1000)
+
+    print(f"{args.vectors} vectors, {args.queries} queries, recall@{args.top_k}\n")
+    print(f"{'search':<24} {'recall':>7} {'p50 ms':>8} {'speedup':>8} {'RAM MB':>8}")
+    print(f"{f'full {VECTOR_DIMENSION}-d scan':<24} {1.0:>7.3f} {np.median(full_ms):>8.2f} {1.0:>7.1f}x "
+          f"{vectors.nbytes / 2**20:>8.1f}")
+
+    for candidates in args.candidates:
+        results, latencies = [], []
+        for query, coarse_query in zip(queries, coarse_queries):
+            started = time.perf_counter()
+            shortlist = top_k(coarse_vectors @ coarse_query, candidates)
+            results.append(shortlist[top_k(vectors[shortlist] @ query, args.top_k)].tolist())
+            latencies.append((time.perf_counter() - started) * 1000)
+        label = f"{COARSE_VECTOR_DIMENSION}-d + re-rank {candidates}"
+        print(f"{label:<24} {recall(results, truth):>7.3f} {np.median(latencies):>8.2f} "
+              f"{np.median(full_ms) / np.median(latencies):>7.1f}x {coarse_vectors.nbytes / 2**20:>8.1f}")
+
+    if args.end_to_end:
+        bench_search_photo_ids(args, vectors, coarse_vectors)
+
+
+if __name__ == "__main__":
+    main()
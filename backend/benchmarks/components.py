@@ -0,0 +1,274 @@
+"""
+Component benchmarks against offline stand-ins for the cloud services (see benchmarks.fakes).
+
+Measures image preparation, the /upload_photos handler, the uploader's batch ingest,
+search_photos (cold and cached) and run_chat turns. Everything runs in-process on a
+throwaway SQLite database and local vector index, with a simulated latency for each
+remote call. Results are printed as a table and written as JSON (--output). --compare
+prints the change against an earlier results file, so two commits can be compared.
+
+Usage:
+    python -m benchmarks.components --output before.json
+    python -m benchmarks.components --embedding-ms 80 --vector-ms 30 --llm-ms 600 --compare before.json
+"""
+import argparse
+import base64
+import json
+import subprocess
+import time
+from datetime import datetime, timedelta, timezone
+from io import BytesIO
+import numpy as np
+from PIL import Image as PILImage
+from benchmarks.fakes import Latencies, install_fakes, use_scratch_environment
+
+# Words the search and chat queries are built from
+QUERY_WORDS = [
+    "beach", "sunset", "dog", "birthday", "mountains", "forest", "city", "dinner",
+    "snow", "concert", "family", "museum", "lake", "garden", "street", "bridge",
+]
+
+
+def summarize(latencies_ms: list, items: int = None) -> dict:
+    """Latency percentiles for a list of per-call milliseconds, plus throughput when `items` were processed."""
+    values = np.array(latencies_ms)
+    result = {
+        "n": len(values),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "mean_ms": round(float(values.mean()), 3),
+    }
+    if items is not None:
+        result["throughput_per_s"] = round(items / (values.sum() / 1000), 2)
+    return result
+
+
+def timed(fn, *args, **kwargs) -> tuple[float, object]:
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return (time.perf_counter() - started) * 1000, result
+
+
+_base_images = {}
+
+
+def synthetic_photo(index: int, width: int, height: int) -> bytes:
+    """
+    A camera-like JPEG: noisy content, a DateTime and GPS position in EXIF. Every
+    index gives different bytes, a different day and a point on a small grid of places.
+    """
+    variant = index % 4
+    if (variant, width, height) not in _base_images:
+        gradient = PILImage.linear_gradient('L').rotate(90 * variant).resize((width, height))
+        noise = PILImage.effect_noise((width, height), 30 + 10 * variant)
+        _base_images[variant, width, height] = PILImage.merge('RGB', (gradient, noise, PILImage.blend(gradient, noise, 0.5)))
+    img = _base_images[variant, width, height].copy()
+    img.paste((index * 37 % 256, index * 91 % 256, index * 53 % 256), (0, 0, width // 8, height // 8))
+
+    exif = PILImage.Exif()
+    taken = datetime(2024, 1, 1, 9) + timedelta(days=index // 8, hours=index % 8)
+    exif[306] = taken.strftime("%Y:%m:%d %H:%M:%S")
+    place = index // 8 % 5
+    exif.get_ifd(0x8825).update({
+        1: "N", 2: (37.0 + place, 46.0, float(index % 60)),
+        3: "W", 4: (122.0, 25.0 + place, 10.0),
+    })
+    buffer = BytesIO()
+    img.save(buffer, format="JPEG", quality=90, exif=exif)
+    return buffer.getvalue()
+
+
+def bench_image_prep(photos: list) -> dict:
+    from image_prep import EMBED_IMAGE_SIZE, prepare_image
+
+    return summarize([timed(prepare_image, photo, EMBED_IMAGE_SIZE)[0] for photo in photos], items=len(photos))
+
+
+def bench_api_upload(app, photos: list, batch_size: int) -> dict:
+    client = app.test_client()
+    latencies = []
+    for start in range(0, len(photos), batch_size):
+        batch = photos[start:start + batch_size]
+        body = {"photos": [
+            {
+                "data": base64.b64encode(photo).decode("utf-8"),
+                "location": f"Benchmark Street {(start + offset) % 5}, Testland",
+                "timestamp": (datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(hours=start + offset)).isoformat(),
+            }
+            for offset, photo in enumerate(batch)
+        ]}
+        elapsed, response = timed(client.post, "/upload_photos", json=body)
+        if response.status_code != 200 or response.json.get("vector_processing_error_count"):
+            raise RuntimeError(f"Upload failed: {response.status_code} {response.get_data(as_text=True)[:500]}")
+        latencies.append(elapsed)
+    result = summarize(latencies)
+    result["throughput_per_s"] = round(len(photos) / (sum(latencies) / 1000), 2)
+    result["batch_size"] = batch_size
+    # Vectors reach the index in the background (vector_outbox); time until the last one is written
+    from models import VectorOutbox
+
+    started = time.perf_counter()
+    while VectorOutbox.query.count():
+        time.sleep(0.005)
+    result["outbox_drained_ms"] = round((time.perf_counter() - started) * 1000, 3)
+    return result
+
+
+def bench_uploader_ingest(photos: list, batch_size: int) -> dict:
+    from ingest_pool import preprocess_bytes
+    from photo_uploader_script import upload_photo_batch
+
+    latencies = []
+    seen_hashes = set()
+    for start in range(0, len(photos), batch_size):
+        def ingest():
+            prepared = [preprocess_bytes(photo, f"bench/{start + offset}.jpg") for offset, photo in enumerate(photos[start:start + batch_size])]
+            upload_photo_batch(prepared, seen_hashes)
+
+        latencies.append(timed(ingest)[0])
+    result = summarize(latencies)
+    result["throughput_per_s"] = round(len(photos) / (sum(latencies) / 1000), 2)
+    result["batch_size"] = batch_size
+    return result
+
+
+def bench_search(queries: list) -> dict:
+    from photo_service import search_photos
+    from search_cache import invalidate_search_cache
+
+    cold = []
+    for query in queries:
+        invalidate_search_cache()
+        cold.append(timed(search_photos, query, top_k=5)[0])
+    for query in queries:
+        search_photos(query, top_k=5)
+    warm = [timed(search_photos, query, top_k=5)[0] for query in queries]
+    return {"cold": summarize(cold), "cached": summarize(warm)}
+
+
+def bench_chat(questions: list) -> dict:
+    from chat import Message, TextInput, run_chat
+    from search_cache import invalidate_search_cache
+
+    latencies = []
+    for question in questions:
+        invalidate_search_cache()
+        elapsed, response = timed(run_chat, [Message(role="user", content=[TextInput(text=question)])])
+        if response is None or not response.is_response():
+            raise RuntimeError(f"Chat turn did not finish: {response}")
+        latencies.append(elapsed)
+    return summarize(latencies)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def flatten(results: dict, prefix: str = "") -> dict:
+    """{"search": {"cold": {...}}} -> {"search.cold": {...}}"""
+    flat = {}
+    for name, value in results.items():
+        if "p50_ms" in value:
+            flat[prefix + name] = value
+        else:
+            flat.update(flatten(value, f"{prefix}{name}."))
+    return flat
+
+
+def print_table(results: dict, baseline: dict = None):
+    current = flatten(results)
+    previous = flatten(baseline["results"]) if baseline else {}
+    header = f"{'benchmark':<20} {'n':>5} {'p50 ms':>9} {'p95 ms':>9} {'items/s':>9}"
+    if baseline:
+        header += f" {'p50 before':>11} {'change':>8}"
+    print(header)
+    for name, stats in current.items():
+        throughput = f"{stats['throughput_per_s']:>9.1f}" if "throughput_per_s" in stats else f"{'-':>9}"
+        line = f"{name:<20} {stats['n']:>5} {stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} {throughput}"
+        if name in previous:
+            before = previous[name]["p50_ms"]
+            line += f" {before:>11.2f} {(stats['p50_ms'] - before) / before * 100 if before else 0.0:>+7.1f}%"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark backend components against offline stand-ins")
+    parser.add_argument("--photos", type=int, default=128, help="Photos uploaded through the API (and again through the uploader)")
+    parser.add_argument("--photo-size", type=int, nargs=2, default=[1600, 1200], metavar=("WIDTH", "HEIGHT"))
+    parser.add_argument("--batch-size", type=int, default=16, help="Photos per upload request / uploader batch")
+    parser.add_argument("--queries", type=int, default=100, help="Search queries")
+    parser.add_argument("--chat-turns", type=int, default=20, help="run_chat calls")
+    parser.add_argument("--embedding-ms", type=float, default=0.0, help="Simulated latency per embedding call")
+    parser.add_argument("--vector-ms", type=float, default=0.0, help="Simulated latency per vector index call")
+    parser.add_argument("--llm-ms", type=float, default=0.0, help="Simulated latency per LLM call")
+    parser.add_argument("--geocoder-ms", type=float, default=0.0, help="Simulated latency per reverse geocode")
+    parser.add_argument("--output", type=str, help="Write results as JSON to this file")
+    parser.add_argument("--compare", type=str, help="Earlier --output file to compare against")
+    args = parser.parse_args()
+
+    workdir = use_scratch_environment()
+    latencies = Latencies(args.embedding_ms, args.vector_ms, args.llm_ms, args.geocoder_ms)
+    fakes = install_fakes(latencies, f"{workdir}/vectors")
+
+    from main import create_app
+    from database import db
+
+    width, height = args.photo_size
+    api_photos = [synthetic_photo(index, width, height) for index in range(args.photos)]
+    uploader_photos = [synthetic_photo(index, width, height) for index in range(args.photos, 2 * args.photos)]
+    queries = [f"{QUERY_WORDS[i % len(QUERY_WORDS)]} {QUERY_WORDS[i * 7 % len(QUERY_WORDS)]} {i}" for i in range(args.queries)]
+    questions = [f"Do I have photos of {QUERY_WORDS[i % len(QUERY_WORDS)]}? ({i})" for i in range(args.chat_turns)]
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        results = {}
+        print("Benchmarking image preparation...")
+        results["image_prep"] = bench_image_prep(api_photos[:32])
+        print("Benchmarking /upload_photos...")
+        results["api_upload"] = bench_api_upload(app, api_photos, args.batch_size)
+        print("Benchmarking uploader ingest...")
+        results["uploader_ingest"] = bench_uploader_ingest(uploader_photos, args.batch_size)
+        print("Benchmarking search...")
+        results["search"] = bench_search(queries)
+        print("Benchmarking chat...")
+        results["chat"] = bench_chat(questions)
+
+    report = {
+        "commit": git_commit(),
+        "created": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            "photos": args.photos,
+            "photo_size": args.photo_size,
+            "batch_size": args.batch_size,
+            "queries": args.queries,
+            "chat_turns": args.chat_turns,
+            "latencies": latencies.to_dict(),
+        },
+        "calls": {
+            "embedding": fakes["embedding_model"].calls,
+            "llm": fakes["openai_client"].responses.calls,
+            "geocoder": fakes["geocoder"].calls,
+        },
+        "results": results,
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"\nCompared with {baseline.get('commit', 'unknown')} ({args.compare})")
+    print()
+    print_table(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
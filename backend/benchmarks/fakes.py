@@ -0,0 +1,214 @@
+"""
+Deterministic in-process stand-ins for Vertex AI, Pinecone, OpenAI and Nominatim.
+
+Every fake sleeps for a configurable simulated latency per call, so a benchmark
+measures our own code plus a known, fixed cost for each remote service. Outputs
+depend only on the inputs (embeddings are seeded by a hash of the image bytes or
+text), so two runs do the same work. install_fakes() swaps them in through the
+client getters in clients.py.
+"""
+import os
+import json
+import time
+import hashlib
+import re
+import sqlite3
+import tempfile
+from contextlib import closing
+from dataclasses import asdict, dataclass
+from types import SimpleNamespace
+from typing import Optional
+import numpy as np
+from constants import COARSE_VECTOR_DIMENSION, VECTOR_DIMENSION
+
+
+@dataclass
+class Latencies:
+    """Simulated milliseconds per call to each remote service."""
+    embedding_ms: float = 0.0
+    vector_ms: float = 0.0
+    llm_ms: float = 0.0
+    geocoder_ms: float = 0.0
+
+    def to_dict(self):
+        return asdict(self)
+
+
+def _sleep(milliseconds: float):
+    if milliseconds > 0:
+        time.sleep(milliseconds / 1000)
+
+
+# Fake embeddings share one of FAKE_TOPICS directions, so a text query is close
+# (cosine ~TOPIC_WEIGHT^2) to the photos and locations on its topic and unrelated to the rest
+FAKE_TOPICS = 16
+TOPIC_WEIGHT = 0.6
+
+
+def fake_embedding(content: bytes, dimension: int = VECTOR_DIMENSION) -> list[float]:
+    """Unit vector seeded by a hash of `content`: its topic's direction plus noise."""
+    seed = int.from_bytes(hashlib.sha256(content).digest()[:8], "little")
+    topic = np.random.default_rng(seed % FAKE_TOPICS).normal(size=dimension)
+    noise = np.random.default_rng(seed).normal(size=dimension)
+    vector = TOPIC_WEIGHT * topic / np.linalg.norm(topic) + np.sqrt(1 - TOPIC_WEIGHT ** 2) * noise / np.linalg.norm(noise)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+class FakeEmbeddingModel:
+    """MultiModalEmbeddingModel.get_embeddings for one image or one text."""
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self.calls = 0
+
+    def get_embeddings(self, image=None, contextual_text: Optional[str] = None, dimension: int = VECTOR_DIMENSION):
+        _sleep(self.latency_ms)
+        self.calls += 1
+        image_embedding = text_embedding = None
+        if image is not None:
+            image_embedding = fake_embedding(image._loaded_bytes or b"", dimension)
+        if contextual_text is not None:
+            text_embedding = fake_embedding(" ".join(contextual_text.lower().split()).encode(), dimension)
+        return SimpleNamespace(image_embedding=image_embedding, text_embedding=text_embedding)
+
+
+class FakeVectorIndex:
+    """The local vector index (exact search below its training size) behind a simulated round trip per call."""
+
+    def __init__(self, directory: str, dimension: int = VECTOR_DIMENSION, latency_ms: float = 0.0):
+        from vector_index import LocalVectorIndex
+
+        self.latency_ms = latency_ms
+        self._index = LocalVectorIndex(directory, dimension=dimension)
+
+    def __getattr__(self, name):
+        attribute = getattr(self._index, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            _sleep(self.latency_ms)
+            return attribute(*args, **kwargs)
+
+        return call
+
+
+class FakeResponses:
+    """
+    OpenAI responses.create for the chat loop and the captioner.
+
+    Chat: the first turn asks a query for the user's question, the next one answers
+    with the photos it was shown. Captioner: one caption per numbered photo.
+    """
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self.calls = 0
+
+    def create(self, model: str, input: list, **kwargs):
+        _sleep(self.latency_ms)
+        self.calls += 1
+        system = " ".join(item.get("text", "") for item in input[0]["content"]) if input else ""
+        if '{"captions":' in system:
+            output_text = self._captions(input[-1]["content"])
+        else:
+            output_text = self._chat(input[1:])
+        return SimpleNamespace(output_text=output_text, usage=self._usage(input, output_text))
+
+    @staticmethod
+    def _usage(input: list, output_text: str):
+        """Token counts like the real API reports: ~4 characters per text token, a flat 85 per image."""
+        text = sum(len(item.get("text", "")) for message in input for item in message["content"])
+        images = sum(1 for message in input for item in message["content"] if item.get("type") == "input_image")
+        input_tokens = text // 4 + 85 * images
+        return SimpleNamespace(input_tokens=input_tokens, output_tokens=len(output_text) // 4)
+
+    @staticmethod
+    def _captions(content: list) -> str:
+        count = sum(1 for item in content if item.get("type") == "input_image")
+        return json.dumps({"captions": [
+            {"photo": number, "caption": f"Benchmark photo number {number}.", "tags": ["benchmark"]}
+            for number in range(1, count + 1)
+        ]})
+
+    @staticmethod
+    def _chat(messages: list) -> str:
+        photo_ids = []
+        question = ""
+        for message in messages:
+            for item in message["content"]:
+                text = item.get("text", "")
+                if text.startswith("Here is photo "):
+                    photo_ids.append(int(re.match(r"Here is photo (\d+)", text).group(1)))
+                elif message["role"] == "user" and item.get("type") == "input_text":
+                    question = text
+        if not photo_ids:
+            return json.dumps({"type": "query", "payload": {"search_query": question or "photos"}})
+        return json.dumps({"type": "response", "payload": {
+            "message": f"Found {len(photo_ids)} photos.", "photo_ids": photo_ids,
+        }})
+
+
+class FakeOpenAI:
+    def __init__(self, latency_ms: float = 0.0):
+        self.responses = FakeResponses(latency_ms)
+
+
+class FakeGeocoder:
+    """Nominatim.reverse: a made-up address that depends only on the rounded coordinates."""
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self.calls = 0
+
+    def reverse(self, query):
+        _sleep(self.latency_ms)
+        self.calls += 1
+        if isinstance(query, str):
+            latitude, longitude = (float(part) for part in query.split(","))
+        else:
+            latitude, longitude = query
+        cell = f"{round(latitude, 1)}, {round(longitude, 1)}"
+        return SimpleNamespace(address=f"Benchmark Street {cell}, District {int(abs(latitude * 10)) % 7}, Testland")
+
+
+def use_scratch_environment(prefix: str = "photos-benchmark-") -> str:
+    """
+    Point the database and the search cache marker at a new temporary directory and
+    turn off background captioning. Call before importing the app modules. Returns the directory.
+
+    The SQLite database is created in WAL mode (a setting stored in the file), so reads
+    are not blocked while an upload is writing, as on PostgreSQL.
+    """
+    workdir = tempfile.mkdtemp(prefix=prefix)
+    with closing(sqlite3.connect(f"{workdir}/photos.db")) as connection:
+        connection.execute("PRAGMA journal_mode=WAL")
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{workdir}/photos.db",
+        "CAPTION_ON_UPLOAD": "false",
+        "SEARCH_CACHE_GENERATION_FILE": f"{workdir}/search-cache.generation",
+    })
+    return workdir
+
+
+def install_fakes(latencies: Latencies, vector_directory: str) -> dict:
+    """Route every client getter to a fake. Returns the fakes by name, e.g. to read call counts."""
+    import clients
+    from embedding_client import EmbeddingClient
+
+    model = FakeEmbeddingModel(latencies.embedding_ms)
+    fakes = {
+        "embedding_model": model,
+        # No QPS ceiling: the fake is not a shared quota, and the limiter would dominate the numbers
+        "embedding_client": EmbeddingClient(model=model, qps=1e9, max_concurrency=64),
+        "vector_index": FakeVectorIndex(f"{vector_directory}/photos", latency_ms=latencies.vector_ms),
+        "coarse_vector_index": FakeVectorIndex(
+            f"{vector_directory}/coarse", dimension=COARSE_VECTOR_DIMENSION, latency_ms=latencies.vector_ms
+        ),
+        "openai_client": FakeOpenAI(latencies.llm_ms),
+        "geocoder": FakeGeocoder(latencies.geocoder_ms),
+    }
+    for name, fake in fakes.items():
+        getattr(clients, f"get_{name}").override(fake)
+    return fakes
+
@@ -0,0 +1,92 @@
+"""
+Micro-benchmark for embedding image preparation.
+
+Compares the original path (full decode, LANCZOS straight to 512x512, PNG encode)
+with image_prep.prepare_image and reports per-image CPU time and output size.
+
+Usage:
+    python -m benchmarks.image_prep                     # synthetic 12 MP JPEG and PNG
+    python -m benchmarks.image_prep --dir ~/Pictures    # your own photos
+"""
+import argparse
+import os
+import time
+from io import BytesIO
+from pathlib import Path
+from PIL import Image as PILImage
+from image_prep import EMBED_IMAGE_SIZE, prepare_image
+
+
+def legacy_prepare_image(source: bytes) -> bytes:
+    """The preparation path used before image_prep existed."""
+    with PILImage.open(BytesIO(source)) as img:
+        resized = img.resize((EMBED_IMAGE_SIZE, EMBED_IMAGE_SIZE), PILImage.Resampling.LANCZOS)
+        buffer = BytesIO()
+        resized.save(buffer, format='PNG')
+        return buffer.getvalue()
+
+
+def synthetic_images(width: int = 4032, height: int = 3024) -> dict:
+    """A camera-sized noisy gradient (photo-like entropy) encoded as JPEG and PNG."""
+    gradient = PILImage.linear_gradient('L').resize((width, height))
+    noise = PILImage.effect_noise((width, height), 40)
+    img = PILImage.merge('RGB', (gradient, noise, PILImage.blend(gradient, noise, 0.5)))
+    images = {}
+    for fmt in ('JPEG', 'PNG'):
+        buffer = BytesIO()
+        img.save(buffer, format=fmt)
+        images[f"synthetic_{width}x{height}.{fmt.lower()}"] = buffer.getvalue()
+    return images
+
+
+def load_images(directory: str, limit: int) -> dict:
+    images = {}
+    for path in sorted(Path(directory).rglob('*')):
+        if path.suffix.lower() in ('.jpg', '.jpeg', '.png'):
+            images[path.name] = path.read_bytes()
+            if len(images) >= limit:
+                break
+    return images
+
+
+def measure(fn, source: bytes, repeat: int) -> tuple[float, int]:
+    """Median CPU milliseconds per call and output size in bytes."""
+    timings = []
+    output = b''
+    for _ in range(repeat):
+        started = time.process_time()
+        output = fn(source)
+        timings.append((time.process_time() - started) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2], len(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark embedding image preparation")
+    parser.add_argument("--dir", type=str, help="Directory of photos to benchmark (default: synthetic images)")
+    parser.add_argument("--limit", type=int, default=20, help="Maximum number of photos to load from --dir")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per image; the median is reported")
+    args = parser.parse_args()
+
+    images = load_images(os.path.expanduser(args.dir), args.limit) if args.dir else synthetic_images()
+    if not images:
+        print("No images found")
+        return
+
+    print(f"{'image':<36} {'legacy ms':>10} {'fast ms':>10} {'speedup':>8} {'legacy KB':>10} {'fast KB':>8}")
+    totals = [0.0, 0.0]
+    for name, source in images.items():
+        legacy_ms, legacy_size = measure(legacy_prepare_image, source, args.repeat)
+        fast_ms, fast_size = measure(prepare_image, source, args.repeat)
+        totals[0] += legacy_ms
+        totals[1] += fast_ms
+        print(f"{name[:36]:<36} {legacy_ms:>10.1f} {fast_ms:>10.1f} {legacy_ms / fast_ms:>7.1f}x "
+              f"{legacy_size / 1024:>10.0f} {fast_size / 1024:>8.0f}")
+
+    count = len(images)
+    print(f"\nMean CPU per image: legacy {totals[0] / count:.1f} ms, fast {totals[1] / count:.1f} ms "
+          f"({totals[0] / totals[1]:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
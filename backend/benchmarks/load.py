@@ -0,0 +1,343 @@
+"""
+HTTP load generator: open-loop /chat, /upload_photos and /photos traffic.
+
+By default it starts main.create_app in a child process on a local port, with a
+scratch SQLite database and the offline stand-ins from benchmarks.fakes, seeds it with
+photos over HTTP and then sends requests at Poisson-distributed arrival times for --duration seconds.
+The arrival rate does not slow down when the server does (open loop), and latency
+is measured from each request's scheduled start, so queueing shows up in the
+numbers. Reports p50/p95/p99 latency, throughput and error rate per endpoint.
+
+Usage:
+    python -m benchmarks.load --rps 20 --duration 60 --mix photos=8,chat=1,upload=1 --output load.json
+    python -m benchmarks.load --llm-ms 600 --embedding-ms 80 --compare load.json
+    python -m benchmarks.load --url http://localhost:8000 --seed-photos 0 --rps 5   # a server that is already running
+"""
+import argparse
+import base64
+import http.client
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit
+import numpy as np
+from benchmarks.components import QUERY_WORDS, git_commit, synthetic_photo
+from benchmarks.fakes import Latencies, install_fakes, use_scratch_environment
+
+DEFAULT_MIX = "photos=8,chat=1,upload=1"
+
+# Distinct photos the upload requests cycle through
+UPLOAD_POOL_SIZE = 64
+
+
+class Workload:
+    """Builds the request for each endpoint in the mix."""
+
+    def __init__(self, photos: list, upload_batch: int, seed_photos: int):
+        self.photos = [base64.b64encode(photo).decode("utf-8") for photo in photos]
+        self.upload_batch = upload_batch
+        self.seed_photos = seed_photos
+
+    def request(self, endpoint: str, rng: random.Random) -> tuple[str, str, dict]:
+        """(method, path, JSON body or None) for one request to `endpoint`."""
+        if endpoint == "photos":
+            offset = rng.randrange(0, max(self.seed_photos, 1))
+            return "GET", f"/photos?limit=50&offset={offset}", None
+        if endpoint == "chat":
+            words = rng.sample(QUERY_WORDS, 2)
+            question = f"Show me photos of the {words[0]} and the {words[1]}"
+            return "POST", "/chat", {"messages": [{"role": "user", "content": [{"type": "input_text", "text": question}]}]}
+        if endpoint == "upload":
+            return "POST", "/upload_photos", {"photos": [
+                {
+                    "data": rng.choice(self.photos),
+                    "location": f"Load Test Street {rng.randrange(20)}, Testland",
+                    "timestamp": photo_timestamp(rng.randrange(10_000)),
+                }
+                for _ in range(self.upload_batch)
+            ]}
+        raise ValueError(f"Unknown endpoint: {endpoint}")
+
+
+def photo_timestamp(index: int) -> str:
+    """A capture time for photo `index`: a few photos an hour, from 2024 on."""
+    return (datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=20 * index)).isoformat()
+
+
+def parse_mix(text: str) -> dict:
+    """'photos=8,chat=1' -> {'photos': 0.8, 'chat': 0.1, ...} (weights normalised to 1)."""
+    weights = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        weights[name.strip()] = float(weight or 1)
+    total = sum(weights.values())
+    if total <= 0:
+        raise ValueError(f"Mix has no weight: {text}")
+    return {name: weight / total for name, weight in weights.items() if weight > 0}
+
+
+def arrival_schedule(mix: dict, rps: float, duration: float, rng: random.Random) -> list[tuple[float, str]]:
+    """Poisson arrivals at `rps` for `duration` seconds, each assigned to an endpoint by weight."""
+    names, weights = list(mix), list(mix.values())
+    schedule = []
+    at = rng.expovariate(rps)
+    while at < duration:
+        schedule.append((at, rng.choices(names, weights)[0]))
+        at += rng.expovariate(rps)
+    return schedule
+
+
+def send(base_url: str, method: str, path: str, body: dict, timeout: float) -> tuple[int, bytes]:
+    """One request on a fresh connection. Returns (status code, response body)."""
+    url = urlsplit(base_url)
+    connection_class = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+    connection = connection_class(url.hostname, url.port, timeout=timeout)
+    try:
+        payload = json.dumps(body).encode("utf-8") if body is not None else None
+        headers = {"Content-Type": "application/json"} if payload is not None else {}
+        connection.request(method, url.path.rstrip("/") + path, body=payload, headers=headers)
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+
+def run_load(base_url: str, workload: Workload, schedule: list, concurrency: int, timeout: float, seed: int) -> list[dict]:
+    """Fire the schedule open-loop. Returns one record per request."""
+    records = []
+    lock = threading.Lock()
+    started = time.perf_counter()
+
+    def fire(index: int, at: float, endpoint: str):
+        rng = random.Random(seed * 1_000_003 + index)
+        method, path, body = workload.request(endpoint, rng)
+        error = None
+        try:
+            status, content = send(base_url, method, path, body, timeout)
+            if status >= 400:
+                error = f"HTTP {status}: {content[:200].decode('utf-8', 'replace')}"
+        except (OSError, http.client.HTTPException) as e:
+            status, error = None, f"{type(e).__name__}: {e}"
+        finished = time.perf_counter() - started
+        with lock:
+            records.append({
+                "endpoint": endpoint,
+                "scheduled_s": at,
+                "latency_ms": (finished - at) * 1000,
+                "status": status,
+                "error": error,
+            })
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for index, (at, endpoint) in enumerate(schedule):
+            delay = started + at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(fire, index, at, endpoint)
+    return records
+
+
+def summarize(records: list, window_s: float) -> dict:
+    """Latency percentiles, throughput and error rate for the records of one endpoint."""
+    latencies = np.array([record["latency_ms"] for record in records])
+    errors = [record for record in records if record["status"] is None or record["status"] >= 400]
+    statuses = {}
+    for record in records:
+        key = str(record["status"] or "error")
+        statuses[key] = statuses.get(key, 0) + 1
+    return {
+        "requests": len(records),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 2),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 2),
+        "max_ms": round(float(latencies.max()), 2),
+        "throughput_per_s": round((len(records) - len(errors)) / window_s, 2),
+        "error_rate": round(len(errors) / len(records), 4),
+        "statuses": statuses,
+        "sample_errors": sorted({record["error"] for record in errors if record["error"]})[:3],
+    }
+
+
+def print_table(results: dict, baseline: dict = None):
+    previous = baseline["results"] if baseline else {}
+    header = f"{'endpoint':<10} {'requests':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ok/s':>7} {'errors':>7}"
+    if baseline:
+        header += f" {'p95 before':>11} {'change':>8}"
+    print(header)
+    for name, stats in results.items():
+        line = (
+            f"{name:<10} {stats['requests']:>8} {stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} "
+            f"{stats['p99_ms']:>9.1f} {stats['throughput_per_s']:>7.2f} {stats['error_rate']:>7.1%}"
+        )
+        if name in previous:
+            before = previous[name]["p95_ms"]
+            line += f" {before:>11.1f} {(stats['p95_ms'] - before) / before * 100 if before else 0.0:>+7.1f}%"
+        print(line)
+
+
+def serve(latencies: Latencies, database_url: str, ports):
+    """
+    Child process: main.create_app on a free local port, backed by the stand-ins and a
+    scratch SQLite database (or `database_url`). Puts the port on `ports`, then serves.
+    """
+    from werkzeug.serving import make_server
+
+    workdir = use_scratch_environment("photos-load-")
+    if database_url:
+        os.environ["DATABASE_URL"] = database_url
+    install_fakes(latencies, f"{workdir}/vectors")
+
+    from main import create_app
+    from database import db
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    ports.put(server.server_port)
+    server.serve_forever()
+
+
+def start_local_server(latencies: Latencies, database_url: str = None) -> tuple[str, multiprocessing.Process]:
+    """
+    Run the app in its own process, so the load generator does not compete with it for
+    the GIL. Returns (base URL, process).
+    """
+    context = multiprocessing.get_context("spawn")
+    ports = context.Queue()
+    # Not a daemon: the upload handler may start its own ingest process pool
+    process = context.Process(target=serve, args=(latencies, database_url, ports), daemon=False)
+    process.start()
+    try:
+        port = ports.get(timeout=120)
+    except queue.Empty:
+        process.terminate()
+        raise RuntimeError("The app did not start within 120s")
+    return f"http://127.0.0.1:{port}", process
+
+
+def seed(base_url: str, workload: Workload, photos: int, timeout: float):
+    """Upload `photos` photos in batches so /photos and /chat have something to return."""
+    batch_size = 16
+    for start in range(0, photos, batch_size):
+        body = {"photos": [
+            {
+                "data": workload.photos[index % len(workload.photos)],
+                "location": f"Load Test Street {index % 20}, Testland",
+                "timestamp": photo_timestamp(index),
+            }
+            for index in range(start, min(start + batch_size, photos))
+        ]}
+        status, content = send(base_url, "POST", "/upload_photos", body, timeout)
+        if status != 200:
+            raise RuntimeError(f"Seeding failed with HTTP {status}: {content[:500].decode('utf-8', 'replace')}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Open-loop HTTP load test of the photo service")
+    parser.add_argument("--url", type=str, help="Base URL of a running server (default: start a local one with stand-ins)")
+    parser.add_argument("--database-url", type=str, help="Database for the local server (default: scratch SQLite)")
+    parser.add_argument("--rps", type=float, default=10.0, help="Offered requests per second, all endpoints together")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of traffic")
+    parser.add_argument("--warmup", type=float, default=5.0, help="Leading seconds left out of the report")
+    parser.add_argument("--mix", type=str, default=DEFAULT_MIX, help=f"Endpoint weights (default: {DEFAULT_MIX})")
+    parser.add_argument("--upload-batch", type=int, default=4, help="Photos per upload request")
+    parser.add_argument("--photo-size", type=int, nargs=2, default=[1024, 768], metavar=("WIDTH", "HEIGHT"))
+    parser.add_argument("--seed-photos", type=int, default=200, help="Photos uploaded before the run")
+    parser.add_argument("--concurrency", type=int, default=256, help="Most requests in flight at once")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for arrivals and payloads")
+    parser.add_argument("--embedding-ms", type=float, default=0.0, help="Simulated latency per embedding call (local server only)")
+    parser.add_argument("--vector-ms", type=float, default=0.0, help="Simulated latency per vector index call (local server only)")
+    parser.add_argument("--llm-ms", type=float, default=0.0, help="Simulated latency per LLM call (local server only)")
+    parser.add_argument("--geocoder-ms", type=float, default=0.0, help="Simulated latency per reverse geocode (local server only)")
+    parser.add_argument("--output", type=str, help="Write results as JSON to this file")
+    parser.add_argument("--compare", type=str, help="Earlier --output file to compare against")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    latencies = Latencies(args.embedding_ms, args.vector_ms, args.llm_ms, args.geocoder_ms)
+    width, height = args.photo_size
+    workload = Workload(
+        [synthetic_photo(index, width, height) for index in range(UPLOAD_POOL_SIZE)], args.upload_batch, args.seed_photos
+    )
+
+    server = None
+    base_url = args.url
+    if base_url is None:
+        base_url, server = start_local_server(latencies, args.database_url)
+        print(f"Started the app at {base_url}")
+
+    try:
+        if args.seed_photos:
+            print(f"Seeding {args.seed_photos} photos...")
+            seed(base_url, workload, args.seed_photos, args.timeout)
+
+        rng = random.Random(args.seed)
+        schedule = arrival_schedule(mix, args.rps, args.warmup + args.duration, rng)
+        print(f"Sending {len(schedule)} requests over {args.warmup + args.duration:.0f}s ({args.rps} req/s offered)...")
+        started = time.perf_counter()
+        records = run_load(base_url, workload, schedule, args.concurrency, args.timeout, args.seed)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.join()
+    elapsed = time.perf_counter() - started
+
+    measured = [record for record in records if record["scheduled_s"] >= args.warmup]
+    # Throughput over the measured window, including the tail of requests still finishing after the last arrival
+    window_s = max(elapsed - args.warmup, args.duration)
+    results = {}
+    for endpoint in mix:
+        endpoint_records = [record for record in measured if record["endpoint"] == endpoint]
+        if endpoint_records:
+            results[endpoint] = summarize(endpoint_records, window_s)
+    if measured:
+        results["all"] = summarize(measured, window_s)
+
+    report = {
+        "commit": git_commit(),
+        "created": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            "url": args.url or "local",
+            "database": "external" if args.url else ("scratch sqlite" if not args.database_url else urlsplit(args.database_url).scheme),
+            "rps": args.rps,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "mix": mix,
+            "upload_batch": args.upload_batch,
+            "photo_size": args.photo_size,
+            "seed_photos": args.seed_photos,
+            "concurrency": args.concurrency,
+            "latencies": latencies.to_dict() if args.url is None else None,
+        },
+        "results": results,
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"\nCompared with {baseline.get('commit', 'unknown')} ({args.compare})")
+    print()
+    print_table(results, baseline)
+    for name, stats in results.items():
+        for error in stats["sample_errors"]:
+            print(f"  {name}: {error}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
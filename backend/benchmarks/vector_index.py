@@ -0,0 +1,101 @@
+"""
+Recall@k vs latency benchmark for the local IVF vector index.
+
+Builds int8 and PQ IVF indexes over synthetic clustered unit vectors (embedding-like:
+many topics, each a noisy cloud), then sweeps nprobe and reports recall@k against
+exact brute-force search, per-query latency and index memory next to float32. Memory
+counts everything resident per vector: codes and lists, ids and the photo-like metadata
+each vector carries in the service.
+
+Usage:
+    python -m benchmarks.vector_index                      # 50k x 512-d
+    python -m benchmarks.vector_index --vectors 200000 --nprobe 4 8 16 32
+"""
+import argparse
+import time
+import numpy as np
+from constants import VECTOR_DIMENSION
+from vector_index import IVFIndex, normalize
+
+
+def synthetic_vectors(count: int, dimension: int, clusters: int, noise: float, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dimension)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=count)
+    noise = rng.normal(scale=noise, size=(count, dimension)).astype(np.float32)
+    return normalize(centers[labels] + noise)
+
+
+def photo_metadata(i: int) -> dict:
+    """Metadata shaped like photo_service.photo_vector_metadata."""
+    return {
+        "photo_id": str(i),
+        "timestamp": 1_600_000_000 + i * 600,
+        "location": f"{i % 997} Example Street, Springfield, Country",
+        "lat": 40.0 + (i % 1000) / 1000,
+        "lon": -73.0 - (i % 1000) / 1000,
+    }
+
+
+def timed_search(search, queries: np.ndarray, top_k: int) -> tuple[list, list]:
+    results, latencies = [], []
+    for query in queries:
+        started = time.perf_counter()
+        results.append([vector_id for vector_id, _ in search(query, top_k)])
+        latencies.append((time.perf_counter() - started) * 1000)
+    return results, latencies
+
+
+def recall(results: list, truth: list) -> float:
+    hits = sum(len(set(found) & set(expected)) for found, expected in zip(results, truth))
+    return hits / sum(len(expected) for expected in truth)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the IVF vector index against exact search")
+    parser.add_argument("--vectors", type=int, default=50000, help="Indexed vectors")
+    parser.add_argument("--queries", type=int, default=200, help="Queries per configuration")
+    parser.add_argument("--dimension", type=int, default=VECTOR_DIMENSION)
+    parser.add_argument("--clusters", type=int, default=500, help="Topics in the synthetic data")
+    parser.add_argument("--noise", type=float, default=2.0, help="Spread of each topic; larger is harder for IVF")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32, 64])
+    parser.add_argument("--quantization", nargs="+", default=["int8", "pq"], choices=["int8", "pq"])
+    args = parser.parse_args()
+
+    data = synthetic_vectors(args.vectors + args.queries, args.dimension, args.clusters, args.noise)
+    vectors, queries = data[:args.vectors], data[args.vectors:]
+    ids = [str(i) for i in range(args.vectors)]
+    metadata = [photo_metadata(i) for i in range(args.vectors)]
+
+    exact = IVFIndex(args.dimension, train_min=args.vectors + 1)
+    exact.upsert(ids, vectors, [None] * len(ids))
+    truth, exact_latencies = timed_search(exact.exact_search, queries, args.top_k)
+
+    print(f"{args.vectors} x {args.dimension}-d vectors, {args.queries} queries, recall@{args.top_k}\n")
+    print(f"{'index':<10} {'nprobe':>6} {'recall':>7} {'p50 ms':>8} {'p95 ms':>8} {'codes MB':>9} {'memory MB':>10} {'vs float32':>10}")
+    flat_mb = args.vectors * args.dimension * 4 / 2**20
+    print(f"{'exact':<10} {'-':>6} {1.0:>7.3f} {np.percentile(exact_latencies, 50):>8.2f} "
+          f"{np.percentile(exact_latencies, 95):>8.2f} {flat_mb:>9.1f} {flat_mb:>10.1f} {1.0:>9.1f}x")
+
+    for quantization in args.quantization:
+        index = IVFIndex(args.dimension, quantization=quantization, train_min=args.vectors)
+        started = time.monotonic()
+        index.upsert(ids, vectors, metadata)
+        index.train()
+        build_seconds = time.monotonic() - started
+        memory = index.memory_bytes()
+        ratio = memory["flat_float32_bytes"] / memory["index_bytes"]
+
+        for nprobe in args.nprobe:
+            results, latencies = timed_search(
+                lambda query, top_k: index.search(query, top_k, nprobe=nprobe), queries, args.top_k
+            )
+            print(f"{quantization:<10} {nprobe:>6} {recall(results, truth):>7.3f} {np.percentile(latencies, 50):>8.2f} "
+                  f"{np.percentile(latencies, 95):>8.2f} {memory['code_bytes'] / 2**20:>9.1f} "
+                  f"{memory['index_bytes'] / 2**20:>10.1f} {ratio:>9.1f}x")
+        print(f"{'':<10} built in {build_seconds:.1f}s ({len(index.centroids)} lists)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Selective bulk delete: remove the photos matching a filter (IDs, path prefix, time
+range, location, bbox) together with their vectors, queued vector writes and event
+index entries. The rest of the library is left as it is.
+
+The matching IDs are read first, as a single-column scan on a server-side cursor.
+They are then deleted DELETE_BATCH_SIZE at a time, one transaction per chunk: the
+chunk's queued vector writes are locked and deleted and its photo rows locked (so a
+drainer delivering them finishes first and none can start), then the vectors are
+deleted (in VECTOR_DELETE_BATCH_SIZE requests per namespace), then the events the
+photos belonged to are taken apart and the rows deleted. If the index fails, the
+chunk is rolled back and the run stops, so no vector is left behind for a deleted
+photo. The counts reported are those of the committed chunks.
+"""
+import os
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Iterator, List, Optional
+from database import db
+from events import lock_event_index, remove_from_event_index, update_event_index
+from metrics import stage
+from models import Photo, VectorOutbox
+from photo_service import SearchFilters, delete_vectors
+from search_cache import invalidate_search_cache
+
+logger = logging.getLogger(__name__)
+
+DELETE_BATCH_SIZE = int(os.getenv("DELETE_BATCH_SIZE", "1000"))
+
+# Matching IDs returned by a dry run
+PREVIEW_IDS = 20
+
+
+@dataclass(frozen=True)
+class DeleteFilter:
+    """
+    Which photos to delete; all given criteria must match. `search` carries the
+    time range, location substring and bbox, with the same meaning as in search_photos.
+    """
+    ids: Optional[List[int]] = None
+    path_prefix: Optional[str] = None
+    search: SearchFilters = field(default_factory=SearchFilters)
+
+    def is_empty(self) -> bool:
+        return self.ids is None and not self.path_prefix and self.search.is_empty()
+
+    def apply_sql(self, query):
+        if self.path_prefix:
+            query = query.filter(Photo.path.startswith(self.path_prefix, autoescape=True))
+        return self.search.apply_sql(query)
+
+
+@dataclass
+class DeleteResult:
+    matched: int = 0
+    deleted_photos: int = 0
+    # IDs sent to the vector index, per namespace
+    deleted_vectors: int = 0
+    events_rebuilt: int = 0
+    error: Optional[str] = None
+    preview_ids: List[int] = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        data = {
+            "matched": self.matched,
+            "deleted_photos": self.deleted_photos,
+            "deleted_vectors": self.deleted_vectors,
+            "events_rebuilt": self.events_rebuilt,
+        }
+        if self.preview_ids:
+            data["preview_ids"] = self.preview_ids
+        if self.error:
+            data["error"] = self.error
+        return data
+
+
+def _iso(value) -> Optional[datetime]:
+    if not value:
+        return None
+    if not isinstance(value, str):
+        raise ValueError("start and end must be ISO date strings")
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def filter_from_dict(data: dict) -> DeleteFilter:
+    """
+    Build a filter from a request body: ids (list of ints), path_prefix, start/end (ISO,
+    end exclusive), location (substring), bbox ([min_lat, min_lon, max_lat, max_lon]).
+    Raises ValueError on malformed values.
+    """
+    ids = data.get("ids")
+    if ids is not None:
+        if not isinstance(ids, list):
+            raise ValueError("ids must be a list of photo IDs")
+        ids = [int(photo_id) for photo_id in ids]
+    bbox = data.get("bbox")
+    if bbox is not None:
+        if not isinstance(bbox, list) or len(bbox) != 4:
+            raise ValueError("bbox must be [min_lat, min_lon, max_lat, max_lon]")
+        bbox = tuple(float(value) for value in bbox)
+    location = data.get("location")
+    path_prefix = data.get("path_prefix")
+    if not isinstance(location, (str, type(None))) or not isinstance(path_prefix, (str, type(None))):
+        raise ValueError("location and path_prefix must be strings")
+    search = SearchFilters(
+        start=_iso(data.get("start")),
+        end=_iso(data.get("end")),
+        location=location or None,
+        bbox=bbox,
+    )
+    return DeleteFilter(ids=ids, path_prefix=path_prefix or None, search=search)
+
+
+def matching_photo_ids(filters: DeleteFilter, batch_size: int = DELETE_BATCH_SIZE) -> Iterator[int]:
+    """IDs of the photos matching `filters`, in ID order, streamed `batch_size` rows at a time."""
+    if filters.ids is not None:
+        # Explicit IDs: look them up a chunk at a time (keeps IN lists bounded)
+        ids = sorted(set(filters.ids))
+        for start in range(0, len(ids), batch_size):
+            query = filters.apply_sql(db.session.query(Photo.id).filter(Photo.id.in_(ids[start:start + batch_size])))
+            yield from (photo_id for (photo_id,) in query.order_by(Photo.id))
+        return
+    statement = filters.apply_sql(db.session.query(Photo.id)).order_by(Photo.id).statement
+    result = db.session.execute(statement.execution_options(stream_results=True, yield_per=batch_size))
+    for partition in result.partitions():
+        yield from (photo_id for (photo_id,) in partition)
+
+
+@stage("photos.bulk_delete")
+def delete_photos(filters: DeleteFilter, dry_run: bool = False, batch_size: int = DELETE_BATCH_SIZE) -> DeleteResult:
+    """Delete the matching photos and everything derived from them. A dry run only counts them."""
+    if filters.is_empty():
+        raise ValueError("Refusing to delete without a filter; use delete_all_data to delete everything")
+
+    photo_ids = list(matching_photo_ids(filters, batch_size))
+    result = DeleteResult(matched=len(photo_ids))
+    if dry_run or not photo_ids:
+        result.preview_ids = photo_ids[:PREVIEW_IDS]
+        return result
+
+    for start in range(0, len(photo_ids), batch_size):
+        chunk = photo_ids[start:start + batch_size]
+        try:
+            # Event index lock first, in the same order as the indexer takes its locks
+            lock_event_index()
+            # Waits for a drainer that has claimed these outbox rows to finish its upserts, so
+            # they land before the vector delete below; later drains find no rows to deliver
+            db.session.query(VectorOutbox.id).filter(VectorOutbox.photo_id.in_(chunk)).with_for_update().all()
+            db.session.query(VectorOutbox).filter(VectorOutbox.photo_id.in_(chunk)).delete(synchronize_session=False)
+            db.session.query(Photo.id).filter(Photo.id.in_(chunk)).with_for_update().all()
+        except Exception as e:
+            db.session.rollback()
+            result.error = f"Database delete failed after {result.deleted_photos} photos: {e}"
+            logger.error(result.error)
+            break
+        try:
+            delete_vectors(chunk)
+        except Exception as e:
+            # Rolling back restores the chunk's outbox rows along with its photos
+            db.session.rollback()
+            result.error = f"Vector delete failed after {result.deleted_photos} photos: {e}"
+            logger.error(result.error)
+            break
+        try:
+            result.events_rebuilt += remove_from_event_index(chunk)
+            deleted = db.session.query(Photo).filter(Photo.id.in_(chunk)).delete(synchronize_session=False)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            # The chunk's vectors are gone but its rows are not: searches simply don't find them
+            result.error = f"Database delete failed after {result.deleted_photos} photos: {e}"
+            logger.error(result.error)
+            break
+        result.deleted_photos += deleted
+        result.deleted_vectors += len(chunk)
+        logger.info(f"Deleted {result.deleted_photos}/{len(photo_ids)} photos")
+
+    if result.deleted_photos:
+        invalidate_search_cache()
+    # Regroup the surviving photos of the events that were taken apart
+    if result.events_rebuilt:
+        try:
+            update_event_index()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Failed to update event index after delete: {e}")
+    return result
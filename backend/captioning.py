@@ -0,0 +1,289 @@
+"""
+Ingest-time captioning: a short text description and a few tags for every photo.
+
+Photos whose caption is still NULL form the captioning queue. caption_pending_photos
+drains it in batches: one column-projected query, one captioner call and one bulk
+UPDATE per batch. Each batch is claimed first (FOR UPDATE SKIP LOCKED, then a lease of
+CAPTION_LEASE_SECONDS committed before the captioner is called), so several server
+processes never caption the same photo. A photo that fails waits CAPTION_RETRY_SECONDS
+and is given up on after CAPTION_MAX_ATTEMPTS. The chat loop sends these captions to the model first and only
+attaches images when the model asks to look at a photo.
+
+Captioners are pluggable: CAPTIONER=openai (default) describes images with an
+OpenAI vision model, CAPTIONER=local is a deterministic stand-in computed from the
+pixels (no network), for tests and benchmarks.
+"""
+import os
+import json
+import base64
+import colorsys
+import logging
+from dataclasses import dataclass, field
+from datetime import timedelta
+from io import BytesIO
+from typing import List, Optional
+from PIL import Image as PILImage
+from PIL import ImageStat
+from sqlalchemy import bindparam, or_, update
+from background import BackgroundPass
+from clients import cached_client, get_openai_client
+from database import db
+from image_prep import data_url, decode_base64_payload, prepare_image, prepared_file_type
+from metrics import register_collector, stage
+from models import Photo, utc_now
+from search_cache import invalidate_search_cache
+
+logger = logging.getLogger(__name__)
+
+CAPTIONER = os.getenv("CAPTIONER", "openai").lower()
+CAPTION_MODEL = os.getenv("CAPTION_MODEL", "gpt-4.1-mini")
+CAPTION_BATCH_SIZE = int(os.getenv("CAPTION_BATCH_SIZE", "8"))
+# Caption new photos on a background thread after each upload. Off by default: with
+# CAPTIONER=openai every photo is a paid vision call, so opt in with CAPTION_ON_UPLOAD=true
+CAPTION_ON_UPLOAD = os.getenv("CAPTION_ON_UPLOAD", "false").lower() == "true"
+
+# How long a pass keeps the photos it claimed, how long a failed photo waits, and how
+# many attempts a photo gets (each a paid call with CAPTIONER=openai)
+CAPTION_LEASE_SECONDS = float(os.getenv("CAPTION_LEASE_SECONDS", "600"))
+CAPTION_RETRY_SECONDS = float(os.getenv("CAPTION_RETRY_SECONDS", "3600"))
+CAPTION_MAX_ATTEMPTS = int(os.getenv("CAPTION_MAX_ATTEMPTS", "3"))
+
+# Square size of the images sent to the captioner; plenty for a one-sentence description
+CAPTION_IMAGE_SIZE = 384
+
+MAX_TAGS = 8
+
+
+@dataclass
+class Caption:
+    text: str
+    tags: List[str] = field(default_factory=list)
+
+
+class Captioner:
+    """Describes a batch of prepared images. Returns one Caption (or None on failure) per image."""
+
+    def caption_batch(self, images: List[bytes]) -> List[Optional[Caption]]:
+        raise NotImplementedError
+
+
+class LocalCaptioner(Captioner):
+    """Deterministic captions from simple pixel statistics (brightness, dominant hue, saturation)."""
+
+    HUES = [(15, "red"), (45, "orange"), (70, "yellow"), (160, "green"), (200, "cyan"), (260, "blue"), (320, "purple"), (360, "red")]
+
+    def caption_one(self, image_bytes: bytes) -> Caption:
+        with PILImage.open(BytesIO(image_bytes)) as img:
+            red, green, blue = ImageStat.Stat(img.convert("RGB")).mean
+        hue, lightness, saturation = colorsys.rgb_to_hls(red / 255, green / 255, blue / 255)
+
+        brightness = "bright" if lightness > 0.6 else "dark" if lightness < 0.3 else "evenly lit"
+        if saturation < 0.15:
+            colour = "grey"
+        else:
+            colour = next(name for limit, name in self.HUES if hue * 360 <= limit)
+        mood = "colorful" if saturation > 0.5 else "muted"
+
+        article = "An" if brightness[0] in "aeiou" else "A"
+        return Caption(text=f"{article} {brightness}, {mood} photo with mostly {colour} tones.", tags=[colour, brightness, mood])
+
+    def caption_batch(self, images: List[bytes]) -> List[Optional[Caption]]:
+        return [self.caption_one(image_bytes) for image_bytes in images]
+
+
+class OpenAICaptioner(Captioner):
+    """Captions a whole batch with one vision-model request."""
+
+    PROMPT = (
+        "You write captions for a personal photo library. For each numbered photo, write one factual "
+        "sentence describing what it shows (people, objects, activity, setting) and up to "
+        f"{MAX_TAGS} short lowercase tags. Respond with JSON only, in the form "
+        '{"captions": [{"photo": 1, "caption": "...", "tags": ["...", "..."]}]}'
+    )
+
+    def __init__(self, model: str = CAPTION_MODEL):
+        self.model = model
+
+    def caption_batch(self, images: List[bytes]) -> List[Optional[Caption]]:
+        content = []
+        for number, image_bytes in enumerate(images, start=1):
+            content.append({"type": "input_text", "text": f"Photo {number}:"})
+            content.append({
+                "type": "input_image",
+                "image_url": data_url(base64.b64encode(image_bytes).decode('utf-8'), prepared_file_type()),
+            })
+        response = get_openai_client().responses.create(
+            model=self.model,
+            input=[
+                {"role": "system", "content": [{"type": "input_text", "text": self.PROMPT}]},
+                {"role": "user", "content": content},
+            ],
+        )
+        return self.parse(response.output_text, len(images))
+
+    @staticmethod
+    def parse(raw: str, count: int) -> List[Optional[Caption]]:
+        captions: List[Optional[Caption]] = [None] * count
+        try:
+            items = json.loads(raw).get("captions", [])
+        except (ValueError, AttributeError):
+            logger.error(f"Could not parse captioner response: {raw[:200]}")
+            return captions
+        for item in items:
+            try:
+                index = int(item["photo"]) - 1
+                text = str(item["caption"]).strip()
+            except (KeyError, TypeError, ValueError):
+                continue
+            if 0 <= index < count and text:
+                tags = [str(tag).strip().lower() for tag in item.get("tags") or [] if str(tag).strip()]
+                captions[index] = Caption(text=text, tags=tags[:MAX_TAGS])
+        return captions
+
+
+@cached_client
+def get_captioner() -> Captioner:
+    """Captioner selected by CAPTIONER."""
+    if CAPTIONER == "local":
+        return LocalCaptioner()
+    if CAPTIONER == "openai":
+        return OpenAICaptioner()
+    raise ValueError(f"Unknown captioner '{CAPTIONER}' (expected 'openai' or 'local')")
+
+
+def _pending():
+    """Uncaptioned photos that are due and have attempts left."""
+    return (
+        Photo.caption.is_(None),
+        Photo.caption_attempts < CAPTION_MAX_ATTEMPTS,
+        or_(Photo.caption_retry_at.is_(None), Photo.caption_retry_at <= utc_now()),
+    )
+
+
+def _claim_batch(size: int):
+    """Claim up to `size` pending photos for this pass; returns their (id, data) rows."""
+    rows = (
+        db.session.query(Photo.id, Photo.data)
+        .filter(*_pending())
+        .order_by(Photo.id)
+        .limit(size)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    if rows:
+        # The attempt is counted up front, so a photo that takes the process down is given up on too
+        db.session.execute(
+            update(Photo)
+            .where(Photo.id.in_([photo_id for photo_id, _ in rows]))
+            .values(
+                caption_attempts=Photo.caption_attempts + 1,
+                caption_retry_at=utc_now() + timedelta(seconds=CAPTION_LEASE_SECONDS),
+            ),
+            execution_options={"synchronize_session": False},
+        )
+    # Release the row locks before the captioner is called
+    db.session.commit()
+    return rows
+
+
+def caption_pending_photos(
+    batch_size: int = CAPTION_BATCH_SIZE,
+    limit: Optional[int] = None,
+    captioner: Optional[Captioner] = None,
+) -> int:
+    """
+    Caption photos that have no caption yet, oldest first. Returns how many were captioned.
+
+    Photos that fail (bad image data, captioner error, left out of the reply) are
+    retried after CAPTION_RETRY_SECONDS, up to CAPTION_MAX_ATTEMPTS attempts in all.
+    """
+    captioner = captioner or get_captioner()
+    captioned = 0
+    while limit is None or captioned < limit:
+        rows = _claim_batch(batch_size if limit is None else min(batch_size, limit - captioned))
+        if not rows:
+            break
+
+        photo_ids, images, failed = [], [], []
+        for photo_id, data in rows:
+            try:
+                images.append(prepare_image(decode_base64_payload(data), CAPTION_IMAGE_SIZE))
+                photo_ids.append(photo_id)
+            except Exception as e:
+                logger.warning(f"Could not prepare photo ID {photo_id} for captioning: {e}")
+                failed.append(photo_id)
+
+        captions: List[Optional[Caption]] = [None] * len(images)
+        if images:
+            try:
+                with stage("caption.batch"):
+                    captions = captioner.caption_batch(images)
+            except Exception as e:
+                logger.error(f"Captioning batch of {len(images)} photos failed: {e}")
+
+        updates = []
+        for photo_id, caption in zip(photo_ids, captions):
+            if caption is None:
+                failed.append(photo_id)
+            else:
+                updates.append({"photo_id": photo_id, "caption": caption.text, "tags": caption.tags})
+        if updates:
+            # One executemany for the batch; photos deleted since are simply not matched
+            table = Photo.__table__
+            db.session.execute(
+                table.update()
+                .where(table.c.id == bindparam("photo_id"))
+                .values(caption=bindparam("caption"), tags=bindparam("tags"), caption_retry_at=None),
+                updates,
+            )
+        if failed:
+            db.session.execute(
+                update(Photo)
+                .where(Photo.id.in_(failed))
+                .values(caption_retry_at=utc_now() + timedelta(seconds=CAPTION_RETRY_SECONDS)),
+                execution_options={"synchronize_session": False},
+            )
+            logger.warning(f"{len(failed)} photos could not be captioned; retrying in {CAPTION_RETRY_SECONDS:.0f}s")
+        db.session.commit()
+        if updates:
+            # Captions are searchable by keyword
+            invalidate_search_cache()
+            captioned += len(updates)
+    return captioned
+
+
+def _captioning_pass():
+    count = caption_pending_photos()
+    if count:
+        logger.info(f"Captioned {count} photos")
+
+
+_captioning = BackgroundPass("captioning", _captioning_pass)
+
+
+def request_captioning(app):
+    """Caption pending photos on a background thread. Calls made while it runs schedule one more pass."""
+    _captioning.request(app)
+
+
+def wait_for_captioning(timeout: float) -> bool:
+    """Wait up to `timeout` seconds for the background captioning thread; False if it is still running."""
+    return _captioning.wait(timeout)
+
+
+def _caption_queue_metrics():
+    # Read at scrape time, inside the /metrics request's app context
+    uncaptioned = Photo.query.filter(Photo.caption.is_(None))
+    yield ("lyfe_caption_queue_photos", "gauge", "Photos waiting for a caption",
+           [({}, uncaptioned.filter(Photo.caption_attempts < CAPTION_MAX_ATTEMPTS).count())])
+    yield ("lyfe_caption_failed_photos", "gauge", "Photos given up on after CAPTION_MAX_ATTEMPTS captioning attempts",
+           [({}, uncaptioned.filter(Photo.caption_attempts >= CAPTION_MAX_ATTEMPTS).count())])
+
+
+def _captioning_metrics():
+    yield ("lyfe_captioning_running", "gauge", "1 while the background captioning thread is working",
+           [({}, int(_captioning.running))])
+
+
+register_collector(_caption_queue_metrics, shared=True)
+register_collector(_captioning_metrics)
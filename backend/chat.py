@@ -2,21 +2,99 @@ import os
 import json
 from dataclasses import asdict, dataclass
 from typing import List, Union, Optional
-from photo_service import search_photos
-from openai import OpenAI
+from datetime import datetime, timedelta
+from geo import MAX_DISTANCE_KM, haversine_km, radius_bbox
+from events import find_events
+from photo_service import SearchFilters, SearchHit, get_photo_hits, load_images, nearest_photos, search_photo_hits, search_photo_ids
+from clients import get_openai_client
+from metrics import Counter, stage
+from tracing import span
 import logging
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Image rendition attached to chat turns (see photo_service.IMAGE_RENDITIONS)
+CHAT_IMAGE_RENDITION = os.getenv("CHAT_IMAGE_RENDITION", "preview")
+
+# Send search results as captions and attach images only when the model asks to view them
+CHAT_CAPTIONS_FIRST = os.getenv("CHAT_CAPTIONS_FIRST", "true").lower() == "true"
+
+# Radius for coordinate queries that don't give one, and how many photos a place-only query returns
+CHAT_DEFAULT_RADIUS_KM = float(os.getenv("CHAT_DEFAULT_RADIUS_KM", "25"))
+CHAT_NEARBY_RESULTS = int(os.getenv("CHAT_NEARBY_RESULTS", "10"))
+
+# Events listed per events request, and photos searched to find the events matching a subject
+CHAT_EVENT_RESULTS = int(os.getenv("CHAT_EVENT_RESULTS", "20"))
+CHAT_EVENT_SEARCH_PHOTOS = int(os.getenv("CHAT_EVENT_SEARCH_PHOTOS", "50"))
+
+# What the model asked for on each chat round: query, view, events, response (or invalid, or exhausted)
+CHAT_ROUNDS = Counter("lyfe_chat_rounds", "Chat model replies by type", ("type",))
+
+# Upper bound on query/view round trips before the model must answer
+MAX_CHAT_ROUNDS = 8
+
+# Reply sent when the model still won't answer after MAX_CHAT_ROUNDS and a final prompt
+CHAT_ROUNDS_EXHAUSTED_MESSAGE = (
+    "Sorry, I couldn't find an answer to that in your photos. Try asking a more specific question."
+)
+
 
 @dataclass
 class QueryPayload:
     search_query: str
+    start_date: Optional[str] = None
+    end_date: Optional[str] = None
+    location: Optional[str] = None
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    radius_km: Optional[float] = None
     
     def to_dict(self):
-        return {"search_query": self.search_query}
+        data = {"search_query": self.search_query}
+        for key in ("start_date", "end_date", "location", "latitude", "longitude", "radius_km"):
+            if getattr(self, key) is not None and getattr(self, key) != "":
+                data[key] = getattr(self, key)
+        return data
+    
+    def has_coordinates(self) -> bool:
+        return self.latitude is not None and self.longitude is not None
+    
+    def search_radius_km(self) -> float:
+        return self.radius_km or CHAT_DEFAULT_RADIUS_KM
+    
+    def to_filters(self) -> Optional[SearchFilters]:
+        """Convert the optional date range and place into search filters"""
+        start = _parse_date(self.start_date)
+        end = _parse_date(self.end_date)
+        # A bare end date means "through the end of that day"
+        if end is not None and self.end_date and len(self.end_date.strip()) <= 10:
+            end += timedelta(days=1)
+        # A radius search is narrowed to the circle's bounding box here and to the circle itself afterwards
+        bbox = radius_bbox(self.latitude, self.longitude, self.search_radius_km()) if self.has_coordinates() else None
+        filters = SearchFilters(start=start, end=end, location=self.location or None, bbox=bbox)
+        return None if filters.is_empty() else filters
+
+
+def _parse_float(payload_data: dict, key: str) -> Optional[float]:
+    value = payload_data.get(key)
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Query payload '{key}' must be a number")
+
+
+def _parse_date(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    except ValueError:
+        logger.warning(f"Ignoring invalid date in search query: {value}")
+        return None
 
 
 @dataclass
@@ -28,10 +106,18 @@ class ResponsePayload:
         return {"message": self.message, "photo_ids": self.photo_ids}
 
 
+@dataclass
+class ViewPayload:
+    photo_ids: List[int]
+    
+    def to_dict(self):
+        return {"photo_ids": self.photo_ids}
+
+
 @dataclass
 class LLMResponse:
     type: str
-    payload: Union[QueryPayload, ResponsePayload]
+    payload: Union[QueryPayload, ResponsePayload, ViewPayload]
     
     def to_dict(self):
         return {
@@ -62,12 +148,30 @@ class LLMResponse:
             response_type = data['type']
             payload_data = data['payload']
             
-            payload: Union[QueryPayload, ResponsePayload]
+            payload: Union[QueryPayload, ResponsePayload, ViewPayload]
             
             if response_type == "query":
-                if 'search_query' not in payload_data:
+                payload = QueryPayload(
+                    search_query=payload_data.get('search_query') or "",
+                    start_date=payload_data.get('start_date'),
+                    end_date=payload_data.get('end_date'),
+                    location=payload_data.get('location'),
+                    latitude=_parse_float(payload_data, 'latitude'),
+                    longitude=_parse_float(payload_data, 'longitude'),
+                    radius_km=_parse_float(payload_data, 'radius_km')
+                )
+                # A query with coordinates may leave search_query empty to ask for the photos nearest a place
+                if not payload.search_query.strip() and not payload.has_coordinates():
                     raise ValueError("Query payload missing 'search_query'")
-                payload = QueryPayload(search_query=payload_data['search_query'])
+                
+            elif response_type == "events":
+                # Every field is optional: no fields lists all events
+                payload = QueryPayload(
+                    search_query=payload_data.get('search_query') or "",
+                    start_date=payload_data.get('start_date'),
+                    end_date=payload_data.get('end_date'),
+                    location=payload_data.get('location')
+                )
                 
             elif response_type == "response":
                 if 'message' not in payload_data or 'photo_ids' not in payload_data:
@@ -89,6 +193,16 @@ class LLMResponse:
                     photo_ids=photo_ids
                 )
                 
+            elif response_type == "view":
+                photo_ids = payload_data.get('photo_ids')
+                if not isinstance(photo_ids, list) or not photo_ids:
+                    raise ValueError("View payload needs a non-empty 'photo_ids' list")
+                try:
+                    photo_ids = [int(id) for id in photo_ids]
+                except (ValueError, TypeError):
+                    raise ValueError("All photo_ids must be integers")
+                payload = ViewPayload(photo_ids=photo_ids)
+                
             else:
                 raise ValueError(f"Unknown response type: {response_type}")
             
@@ -101,6 +215,14 @@ class LLMResponse:
         """Check if this is a query response"""
         return self.type == "query"
     
+    def is_events(self) -> bool:
+        """Check if this is a request for trip/event summaries"""
+        return self.type == "events"
+    
+    def is_view(self) -> bool:
+        """Check if this is a request to look at specific photos"""
+        return self.type == "view"
+    
     def is_response(self) -> bool:
         """Check if this is a final response"""
         return self.type == "response"
@@ -111,6 +233,18 @@ class LLMResponse:
             return self.payload.search_query
         return None
     
+    def get_query_payload(self) -> Optional[QueryPayload]:
+        """Get the whole query payload if this is a query or events response"""
+        if (self.is_query() or self.is_events()) and isinstance(self.payload, QueryPayload):
+            return self.payload
+        return None
+    
+    def get_search_filters(self) -> Optional[SearchFilters]:
+        """Get structured search filters if this is a query response"""
+        if self.is_query() and isinstance(self.payload, QueryPayload):
+            return self.payload.to_filters()
+        return None
+    
     def get_message(self) -> Optional[str]:
         """Get message if this is a response"""
         if self.is_response() and isinstance(self.payload, ResponsePayload):
@@ -118,8 +252,8 @@ class LLMResponse:
         return None
     
     def get_photo_ids(self) -> List[int]:
-        """Get photo IDs if this is a response"""
-        if self.is_response() and isinstance(self.payload, ResponsePayload):
+        """Get photo IDs if this is a response or a view request"""
+        if isinstance(self.payload, (ResponsePayload, ViewPayload)):
             return self.payload.photo_ids
         return []
 
@@ -174,13 +308,6 @@ class Message:
 
 
 
-# Initialize the OpenAI client
-# The API key should be set in the environment variable OPENAI_API_KEY
-client = OpenAI(
-    api_key=os.getenv("OPENAI_API_KEY")
-)
-
-
 def chat(messages: list[Message]) -> Optional[LLMResponse]:
     """
     Simple chat function that takes a single prompt and returns the parsed response
@@ -196,17 +323,42 @@ def chat(messages: list[Message]) -> Optional[LLMResponse]:
         Message(role="system", content=[TextInput(type="input_text", text="""You are an AI assistant that has access to the user's photo collection and can answer questions about them. Your goal is to provide helpful, accurate responses about the user's photos and life experiences captured in those images.
 
 RESPONSE FORMATS:
-You must respond in one of two JSON formats depending on whether you need additional photo context:
+You must respond in one of four JSON formats depending on whether you need additional photo context:
 
 1. QUERY FORMAT - Use when you need to see photos to answer the question:
 {
     "type": "query",
     "payload": {
-        "search_query": "specific search terms"
+        "search_query": "specific search terms",
+        "start_date": "optional ISO date, e.g. 2023-06-01",
+        "end_date": "optional ISO date (inclusive), e.g. 2023-06-30",
+        "location": "optional place name that appears in the photo's address, e.g. Lisbon",
+        "latitude": "optional number, with longitude: only photos taken near this point",
+        "longitude": "optional number",
+        "radius_km": "optional number, how far from the point (default 25)"
     }
 }
 
-2. RESPONSE FORMAT - Use when you can answer without additional photos or when providing a final answer:
+2. VIEW FORMAT - Use when the captions of photos you have found are not enough and you need to look at them:
+{
+    "type": "view",
+    "payload": {
+        "photo_ids": [IDs of the photos you need to see]
+    }
+}
+
+3. EVENTS FORMAT - Use for "when" / "how often" / "how many trips" questions. Returns one line per trip or event (dates, photo count, places) instead of photos:
+{
+    "type": "events",
+    "payload": {
+        "search_query": "optional subject; only events containing matching photos, e.g. forest",
+        "start_date": "optional ISO date",
+        "end_date": "optional ISO date (inclusive)",
+        "location": "optional place name, e.g. Japan"
+    }
+}
+
+4. RESPONSE FORMAT - Use when you can answer without additional photos or when providing a final answer:
 {
     "type": "response",
     "payload": {
@@ -215,9 +367,11 @@ You must respond in one of two JSON formats depending on whether you need additi
     }
 }
 
-WHEN TO QUERY vs RESPOND:
+WHEN TO QUERY vs VIEW vs RESPOND:
 - QUERY when: The user asks about specific objects, people, places, or events that would require seeing photos to answer accurately
 - QUERY when: You need visual confirmation or additional context from photos
+- Search results arrive as a caption and tags per photo. VIEW only the photos whose captions don't settle the question (e.g. colors, counts, small details)
+- EVENTS when: The user asks when something happened, how many times, or how many trips; answer from the event list and QUERY or VIEW only if you need details
 - RESPOND when: You can answer based on general knowledge or previous photo context provided
 - RESPOND when: The user asks general questions that don't require specific photo analysis
 
@@ -225,6 +379,8 @@ QUERY GUIDELINES:
 - Use specific, descriptive search terms (e.g., "dogs", "vacation beach", "birthday cake", "family dinner")
 - Be concise but descriptive enough to find relevant photos
 - Focus on key visual elements or concepts the user is asking about
+- When the user names a time period ("June 2023", "last summer") set start_date/end_date; when they name a place set location. Omit these fields otherwise
+- When the user asks about photos near a specific point or landmark ("near the Eiffel Tower", "within 5 km of home"), set latitude/longitude (and radius_km if they give a distance). To get the photos nearest a point regardless of subject, leave search_query empty
 
 RESPONSE GUIDELINES:
 - Provide helpful, detailed answers based on the available information
@@ -232,18 +388,26 @@ RESPONSE GUIDELINES:
 - Be conversational and engaging
 - If you mention photos in your response, always include their IDs in the photo_ids array
 
-IMPORTANT: Always respond with valid JSON in one of the two formats above. Do not include any text outside the JSON structure.""")]),
+IMPORTANT: Always respond with valid JSON in one of the four formats above. Do not include any text outside the JSON structure.""")]),
         *messages,
     ]
 
     
     response = None
     try:
-        response = client.responses.create(
-            model="gpt-4.1-mini",
-            input=[asdict(message) for message in messages],
-            # temperature=0.3
-        )
+        with stage("llm.chat") as llm_call:
+            response = get_openai_client().responses.create(
+                model="gpt-4.1-mini",
+                input=[asdict(message) for message in messages],
+                # temperature=0.3
+            )
+            usage = getattr(response, "usage", None)
+            llm_call.set(
+                model="gpt-4.1-mini",
+                messages=len(messages),
+                input_tokens=getattr(usage, "input_tokens", None),
+                output_tokens=getattr(usage, "output_tokens", None),
+            )
     except Exception as e:
         logger.error(f"Error calling OpenAI API: {e}")
 
@@ -251,8 +415,11 @@ IMPORTANT: Always respond with valid JSON in one of the two formats above. Do no
     if response and response.output_text:
         try:
             raw_response = response.output_text
-            return LLMResponse.from_json(raw_response)
+            parsed = LLMResponse.from_json(raw_response)
+            CHAT_ROUNDS.labels(parsed.type).inc()
+            return parsed
         except ValueError as e:
+            CHAT_ROUNDS.labels("invalid").inc()
             logger.error(f"Error parsing LLM response: {e}")
             logger.error(f"Raw response: {response.output_text}")
             return None
@@ -261,20 +428,106 @@ IMPORTANT: Always respond with valid JSON in one of the two formats above. Do no
         return None
 
 
+def photo_message(hit: SearchHit, include_image: bool) -> Optional[Message]:
+    """User message describing one photo: its caption and tags, plus the image if asked for (or no caption exists)."""
+    text = f"Here is photo {hit.id}, taken in {hit.location} on {hit.timestamp}"
+    if hit.distance_km is not None:
+        text += f", {hit.distance_km:.1f} km from the requested point"
+    if hit.caption:
+        text += f". Caption: {hit.caption}"
+        if hit.tags:
+            text += f" Tags: {', '.join(hit.tags)}"
+    content: list[ImageInput | TextInput] = [TextInput(text=text)]
+    if include_image or not hit.caption:
+        image_url = hit.image_data_url(CHAT_IMAGE_RENDITION)
+        if not image_url:
+            return None
+        content.append(ImageInput(image_url=image_url))
+    return Message(role="user", content=content)
+
+
+@stage("chat.search")
+def query_hits(query: QueryPayload) -> List[SearchHit]:
+    """Photos for a query: nearest to a point when only coordinates are given, otherwise a (filtered) search."""
+    if not query.search_query.strip():
+        return nearest_photos(
+            query.latitude, query.longitude, k=CHAT_NEARBY_RESULTS, max_radius_km=query.radius_km or MAX_DISTANCE_KM
+        )
+    # Best match first
+    hits = search_photo_hits(query.search_query, filters=query.to_filters())
+    if query.has_coordinates():
+        # The search filtered on the bounding box; keep the photos inside the circle
+        radius_km = query.search_radius_km()
+        for hit in hits:
+            if hit.latitude is not None and hit.longitude is not None:
+                hit.distance_km = haversine_km(query.latitude, query.longitude, hit.latitude, hit.longitude)
+        hits = [hit for hit in hits if hit.distance_km is None or hit.distance_km <= radius_km]
+    return hits
+
+
+@stage("chat.events")
+def events_message(query: QueryPayload) -> Message:
+    """User message with compact summaries of the events matching an events request."""
+    filters = query.to_filters()
+    start = filters.start if filters else None
+    end = filters.end if filters else None
+    photo_ids = None
+    if query.search_query.strip():
+        photo_ids = [photo_id for photo_id, _ in search_photo_ids(query.search_query, CHAT_EVENT_SEARCH_PHOTOS, filters=filters)]
+    total, events = find_events(start, end, query.location or None, photo_ids, limit=CHAT_EVENT_RESULTS)
+    
+    lines = [f"Events matching {json.dumps(query.to_dict())}: {total}"]
+    if total > len(events):
+        lines[0] += f" (showing the first {len(events)})"
+    lines.extend(event.describe() for event in events)
+    return Message(role="user", content=[TextInput(text="\n".join(lines))])
+
+
 def run_chat(messages: list[Message]):
     response = chat(messages)
-    while response and response.is_query():
-        # Add the previous response to the messages
-        # messages.append(Message(role="assistant", content=response.get_message()))
-        # Get the search query
-        search_query = response.get_search_query()
-        logger.info(f"Query: {search_query}")
-        assert search_query is not None
-        # Get the photos
-        photos = search_photos(search_query)
-        for photo in photos:
-            messages.append(Message(role="user", content=[TextInput(text=f"Here is a photo that was taken in {photo.location} on {photo.timestamp}"), ImageInput(image_url=f"data:image/png;base64,{photo.data}")]))
+    rounds = 0
+    while response and (response.is_query() or response.is_view() or response.is_events()) and rounds < MAX_CHAT_ROUNDS:
+        rounds += 1
+        # One span per round: the retrieval the model asked for and the model's next reply
+        with span("chat.round", round=rounds, action=response.type) as chat_round:
+            if response.is_events():
+                # Aggregate questions are answered from the event index, without photos
+                query = response.get_query_payload()
+                logger.info(f"Events: {query.to_dict()}")
+                messages.append(events_message(query))
+                hits = []
+                include_images = False
+            elif response.is_view():
+                # The model wants to see specific photos it already has captions for
+                logger.info(f"Viewing photos: {response.get_photo_ids()}")
+                hits = load_images(get_photo_hits(response.get_photo_ids()), CHAT_IMAGE_RENDITION)
+                include_images = True
+            else:
+                query = response.get_query_payload()
+                assert query is not None
+                logger.info(f"Query: {query.to_dict()}")
+                hits = query_hits(query)
+                # Images in one query, only for the photos that need them
+                include_images = not CHAT_CAPTIONS_FIRST
+                load_images([hit for hit in hits if include_images or not hit.caption], CHAT_IMAGE_RENDITION)
+            for hit in hits:
+                message = photo_message(hit, include_images)
+                if message:
+                    messages.append(message)
+            chat_round.set(photos=len(hits), images=sum(1 for hit in hits if include_images or not hit.caption))
+            response = chat(messages)
+
+    if response and not response.is_response():
+        # Out of rounds: ask once more for an answer from what was retrieved, then fall back
+        logger.warning(f"Chat still asking for {response.type} after {MAX_CHAT_ROUNDS} rounds")
+        messages.append(Message(role="user", content=[TextInput(text=(
+            "You have no searches left. Answer now with a \"response\" using only the photos "
+            "and events above; say so if they are not enough."
+        ))]))
         response = chat(messages)
+        if response and not response.is_response():
+            CHAT_ROUNDS.labels("exhausted").inc()
+            response = LLMResponse(type="response", payload=ResponsePayload(message=CHAT_ROUNDS_EXHAUSTED_MESSAGE, photo_ids=[]))
 
     return response
 
@@ -0,0 +1,206 @@
+"""
+Lazily created, cached clients for the cloud services used by the backend.
+
+Nothing here touches an SDK at import time, so the API server and the admin
+scripts only pay for Vertex AI, Pinecone (or the local vector index), OpenAI or
+Nominatim when they actually use them.
+"""
+import os
+import time
+import threading
+import logging
+from functools import wraps
+from metrics import register_collector
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.RLock()
+
+# Keep-alive connections the shared Pinecone index handle holds open. Requests beyond
+# this open a connection that is thrown away afterwards, so it should cover the
+# threads that query at once: the search executor (8) plus the server's request threads.
+VECTOR_POOL_SIZE = int(os.getenv("VECTOR_POOL_SIZE", "16"))
+# Seconds to connect and to wait for a response on each vector call
+VECTOR_CONNECT_TIMEOUT = float(os.getenv("VECTOR_CONNECT_TIMEOUT", "3"))
+VECTOR_READ_TIMEOUT = float(os.getenv("VECTOR_READ_TIMEOUT", "10"))
+
+
+def local_vector_backend() -> bool:
+    """True when VECTOR_BACKEND=ivf selects the in-process vector index instead of Pinecone."""
+    return os.getenv("VECTOR_BACKEND", "pinecone").lower() == "ivf"
+
+
+def cached_client(factory):
+    """Build the client on first use and reuse it afterwards (thread-safe)."""
+    instance = []
+
+    @wraps(factory)
+    def getter():
+        if not instance:
+            with _lock:
+                if not instance:
+                    instance.append(factory())
+        return instance[0]
+
+    def override(client):
+        """Use `client` instead of building one (benchmarks and local stand-ins)."""
+        with _lock:
+            instance[:] = [client]
+
+    getter.reset = instance.clear
+    getter.override = override
+    getter.is_initialized = lambda: bool(instance)
+    return getter
+
+
+@cached_client
+def get_embedding_model():
+    """Vertex AI multimodal embedding model."""
+    import vertexai
+    from vertexai.vision_models import MultiModalEmbeddingModel
+
+    vertexai.init(project=os.getenv("GCP_PROJECT_ID"), location="us-central1")
+    return MultiModalEmbeddingModel.from_pretrained("multimodalembedding@001")
+
+
+@cached_client
+def get_embedding_client():
+    """Shared rate-limited embedding client; the model itself is loaded on the first call."""
+    from embedding_client import EmbeddingClient
+
+    return EmbeddingClient(model_factory=get_embedding_model)
+
+
+@cached_client
+def get_pinecone():
+    """Pinecone control-plane client."""
+    from pinecone import Pinecone
+
+    return Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+
+
+@cached_client
+def get_vector_index():
+    """
+    Index handle for photo vectors, shared by the API, chat and the scripts.
+
+    Pinecone by default (pooled, with timeouts: see TimeoutIndex); VECTOR_BACKEND=ivf selects the local compressed IVF index
+    (vector_index.LocalVectorIndex), which implements the same calls.
+    """
+    if local_vector_backend():
+        from vector_index import LocalVectorIndex
+
+        return LocalVectorIndex()
+
+    from constants import PHOTOS_INDEX_NAME
+
+    index = get_pinecone().Index(PHOTOS_INDEX_NAME, connection_pool_maxsize=VECTOR_POOL_SIZE)
+    return TimeoutIndex(index, (VECTOR_CONNECT_TIMEOUT, VECTOR_READ_TIMEOUT))
+
+
+class TimeoutIndex:
+    """
+    Pinecone index handle that gives every data-plane call a default timeout.
+
+    One handle is shared by all threads: its urllib3 pool is thread-safe and reuses
+    keep-alive TLS connections, so no call pays for a handshake once the pool is warm.
+    A call can still pass its own `_request_timeout`.
+    """
+    CALLS = {"upsert", "query", "fetch", "update", "delete", "describe_index_stats", "list_paginated"}
+
+    def __init__(self, index, timeout):
+        self._index = index
+        self._timeout = timeout
+
+    def __getattr__(self, name):
+        attribute = getattr(self._index, name)
+        if name not in self.CALLS:
+            return attribute
+
+        @wraps(attribute)
+        def call(*args, **kwargs):
+            kwargs.setdefault("_request_timeout", self._timeout)
+            return attribute(*args, **kwargs)
+
+        return call
+
+
+@cached_client
+def get_coarse_vector_index():
+    """Local index of COARSE_VECTOR_DIMENSION photo vectors, scanned first by coarse-to-fine search."""
+    from constants import COARSE_VECTOR_DIMENSION
+    from vector_index import COARSE_VECTOR_INDEX_DIR, LocalVectorIndex
+
+    return LocalVectorIndex(COARSE_VECTOR_INDEX_DIR, dimension=COARSE_VECTOR_DIMENSION)
+
+
+@cached_client
+def get_openai_client():
+    """OpenAI client. The API key is read from OPENAI_API_KEY."""
+    from openai import OpenAI
+
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+
+@cached_client
+def get_geocoder():
+    """Nominatim reverse geocoder (OpenStreetMap)."""
+    from geopy.geocoders import Nominatim
+
+    return Nominatim(user_agent="abhi-agent")
+
+
+def _embedding_client_metrics():
+    # Only once the client exists: a scrape must not load the Vertex AI SDK
+    if not get_embedding_client.is_initialized():
+        return
+    stats = get_embedding_client().stats()
+    yield ("lyfe_embedding_calls_total", "counter", "Vertex AI embedding calls by result",
+           [({"result": result}, stats[result]) for result in ("succeeded", "failed", "throttled")])
+    yield ("lyfe_embedding_retries_total", "counter", "Vertex AI embedding calls retried after 429/503",
+           [({}, stats["retries"])])
+    yield ("lyfe_embedding_in_flight", "gauge", "Embedding calls in flight", [({}, stats["in_flight"])])
+    yield ("lyfe_embedding_concurrency_limit", "gauge", "Current adaptive concurrency limit for embedding calls",
+           [({}, stats["concurrency_limit"])])
+
+
+register_collector(_embedding_client_metrics)
+
+
+def warm_up_clients():
+    """Create every client now so the first request doesn't pay for SDK imports and handshakes."""
+    for getter in (get_embedding_model, get_vector_index, get_openai_client):
+        started = time.monotonic()
+        try:
+            getter()
+            logger.info(f"Warmed up {getter.__name__} in {time.monotonic() - started:.2f}s")
+        except Exception as e:
+            logger.warning(f"Warm-up of {getter.__name__} failed: {e}")
+
+
+def preload_client_libraries():
+    """
+    Import the SDKs without creating any client. Run in a pre-forking server's master process,
+    the import cost (seconds for Vertex AI) is paid once and the modules are shared by the
+    workers. Clients themselves hold sockets, gRPC channels and threads that don't survive
+    a fork, so each worker still builds its own (warm_up_clients).
+    """
+    modules = ["vertexai.vision_models", "openai", "geopy.geocoders"]
+    if local_vector_backend():
+        modules.append("vector_index")
+    else:
+        modules.append("pinecone")
+    for module in modules:
+        started = time.monotonic()
+        try:
+            __import__(module)
+            logger.info(f"Preloaded {module} in {time.monotonic() - started:.2f}s")
+        except Exception as e:
+            logger.warning(f"Preloading {module} failed: {e}")
+
+
+def start_background_warm_up() -> threading.Thread:
+    """Warm up clients on a daemon thread without blocking server start."""
+    thread = threading.Thread(target=warm_up_clients, name="client-warm-up", daemon=True)
+    thread.start()
+    return thread
@@ -8,4 +8,7 @@ PHOTOS_NAMESPACE = "abhivel-photos"
 LOCATION_NAMESPACE = "abhivel-location"
 
 
-VECTOR_DIMENSION = 512
\ No newline at end of file
+VECTOR_DIMENSION = 512
+
+# Low-dimensional embeddings used for the first stage of coarse-to-fine search
+COARSE_VECTOR_DIMENSION = 128
\ No newline at end of file
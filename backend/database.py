@@ -1,11 +1,36 @@
 import os
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
+from metrics import register_collector
+
+# Connections per process. The production server runs WEB_THREADS request threads per
+# worker, so the default keeps one connection per thread plus a few for background work
+# (captioning, metrics scrapes). Across workers: WEB_WORKERS * (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+# must stay under the database's max_connections.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", os.getenv("WEB_THREADS", "4")))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "4"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "10"))
+# Reconnect before the server or a proxy drops idle connections
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
 
 # Initialize SQLAlchemy and Migrate
 db = SQLAlchemy()
 migrate = Migrate()
 
+
+def engine_options(database_url: str) -> dict:
+    """Pool settings for the engine; SQLite keeps Flask-SQLAlchemy's defaults."""
+    if database_url.startswith("sqlite"):
+        return {}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        # A connection dropped while idle (database restart, failover) is replaced instead of failing a request
+        "pool_pre_ping": True,
+    }
+
 def init_db(app):
     """Initialize database with Flask app"""
     
@@ -17,9 +42,23 @@ def init_db(app):
     
     app.config['SQLALCHEMY_DATABASE_URI'] = database_url
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(database_url)
     
     # Initialize extensions
     db.init_app(app)
     migrate.init_app(app, db)
     
-    return db 
\ No newline at end of file
+    return db 
+
+
+def _pool_metrics():
+    # QueuePool only (PostgreSQL, file SQLite); read inside the /metrics request's app context
+    pool = db.engine.pool
+    if not hasattr(pool, "checkedout"):
+        return
+    yield ("lyfe_db_pool_checked_out", "gauge", "Database connections in use", [({}, pool.checkedout())])
+    yield ("lyfe_db_pool_size", "gauge", "Database connection pool size", [({}, pool.size())])
+    yield ("lyfe_db_pool_overflow", "gauge", "Database connections opened beyond the pool size", [({}, max(pool.overflow(), 0))])
+
+
+register_collector(_pool_metrics)
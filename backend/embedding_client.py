@@ -0,0 +1,185 @@
+"""
+Shared client for Vertex AI embedding calls with rate limiting and adaptive concurrency.
+
+Every call goes through a token bucket (hard QPS ceiling) and an AIMD concurrency
+limiter: the number of in-flight requests grows by one per window of successful
+calls and is halved whenever Vertex answers 429/503. Throttled calls are retried
+with jittered exponential backoff.
+"""
+import os
+import random
+import threading
+import time
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# HTTP status codes returned by Vertex when we are over quota or it is overloaded
+THROTTLE_STATUS_CODES = {429, 503}
+THROTTLE_GRPC_CODES = {"RESOURCE_EXHAUSTED", "UNAVAILABLE"}
+
+# Window used for the live throughput numbers in stats()
+THROUGHPUT_WINDOW_SECONDS = 60.0
+
+
+def is_throttle_error(error: Exception) -> bool:
+    """Check whether an exception from the embedding API means we should back off."""
+    code = getattr(error, "code", None)
+    if isinstance(code, int) and code in THROTTLE_STATUS_CODES:
+        return True
+    grpc_code = getattr(error, "grpc_status_code", None)
+    if grpc_code is not None and getattr(grpc_code, "name", None) in THROTTLE_GRPC_CODES:
+        return True
+    return False
+
+
+class TokenBucket:
+    """Thread-safe token bucket enforcing a maximum request rate."""
+
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available and take it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class AIMDLimiter:
+    """Concurrency limit with additive increase and multiplicative decrease."""
+
+    def __init__(self, initial: int, minimum: int = 1, maximum: int = 32, decrease_factor: float = 0.5):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease_factor = decrease_factor
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, throttled: bool = False):
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.minimum, self.limit * self.decrease_factor)
+            else:
+                # +1 slot after roughly `limit` consecutive successes
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+
+class EmbeddingClient:
+    """Wraps a MultiModalEmbeddingModel with QPS limiting, AIMD concurrency and retries."""
+
+    def __init__(
+        self,
+        model=None,
+        model_factory=None,
+        qps: float = None,
+        max_concurrency: int = None,
+        max_retries: int = None,
+        base_delay: float = 0.5,
+        max_delay: float = 30.0,
+    ):
+        qps = qps if qps is not None else float(os.getenv("EMBEDDING_QPS", "5"))
+        max_concurrency = max_concurrency if max_concurrency is not None else int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "16"))
+
+        self._model = model
+        self._model_factory = model_factory
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("EMBEDDING_MAX_RETRIES", "5"))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.bucket = TokenBucket(qps)
+        self.limiter = AIMDLimiter(initial=min(4, max_concurrency), maximum=max_concurrency)
+
+        self._stats_lock = threading.Lock()
+        self._completed = deque()
+        self._counters = {"requests": 0, "succeeded": 0, "failed": 0, "throttled": 0, "retries": 0}
+        self._total_latency = 0.0
+
+    @property
+    def model(self):
+        """The wrapped model, created by model_factory on first use."""
+        if self._model is None:
+            self._model = self._model_factory()
+        return self._model
+
+    def get_embeddings(self, **kwargs):
+        """Call model.get_embeddings, retrying throttled calls with jittered backoff."""
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            self.limiter.acquire()
+            started = time.monotonic()
+            try:
+                result = self.model.get_embeddings(**kwargs)
+            except Exception as e:
+                throttled = is_throttle_error(e)
+                self.limiter.release(throttled=throttled)
+                self._record(time.monotonic() - started, succeeded=False, throttled=throttled)
+
+                if not throttled or attempt >= self.max_retries:
+                    with self._stats_lock:
+                        self._counters["failed"] += 1
+                    raise
+
+                # Full jitter: spread retries so throttled callers don't stampede together
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                logger.warning(f"Embedding request throttled ({e}); retrying in {delay:.2f}s")
+                attempt += 1
+                with self._stats_lock:
+                    self._counters["retries"] += 1
+                time.sleep(delay)
+                continue
+
+            self.limiter.release(throttled=False)
+            self._record(time.monotonic() - started, succeeded=True, throttled=False)
+            return result
+
+    def _record(self, latency: float, succeeded: bool, throttled: bool):
+        now = time.monotonic()
+        with self._stats_lock:
+            self._counters["requests"] += 1
+            self._total_latency += latency
+            if throttled:
+                self._counters["throttled"] += 1
+            if succeeded:
+                self._counters["succeeded"] += 1
+                self._completed.append(now)
+            while self._completed and now - self._completed[0] > THROUGHPUT_WINDOW_SECONDS:
+                self._completed.popleft()
+
+    def stats(self) -> dict:
+        """Live counters, current concurrency limit and recent throughput."""
+        now = time.monotonic()
+        with self._stats_lock:
+            while self._completed and now - self._completed[0] > THROUGHPUT_WINDOW_SECONDS:
+                self._completed.popleft()
+            window = min(THROUGHPUT_WINDOW_SECONDS, now - self._completed[0]) if self._completed else 0.0
+            requests = self._counters["requests"]
+            return {
+                **self._counters,
+                "concurrency_limit": int(self.limiter.limit),
+                "in_flight": self.limiter.in_flight,
+                "qps_limit": self.bucket.rate,
+                "throughput_per_second": len(self._completed) / window if window > 0 else 0.0,
+                "avg_latency_seconds": self._total_latency / requests if requests else 0.0,
+            }
@@ -0,0 +1,397 @@
+"""
+Event index: photos grouped into trips/events, plus per-day and per-place counts.
+
+A photo joins an event when it was taken within EVENT_GAP_HOURS of the event's time
+span and, if both have coordinates, within EVENT_MAX_DISTANCE_KM of its centroid.
+A photo that fits several events merges them. update_event_index assigns the photos
+that have no event yet in timestamp order, a batch at a time. Each batch costs one
+query for the unassigned photos, one for the events around them, and one bulk update.
+So running it after every upload keeps the index current. The same pass keeps the
+daily_photo_counts table current.
+
+Every transaction that changes the index first takes a transaction-scoped advisory lock
+(PostgreSQL), so concurrent uploads, workers and bulk deletes never group the same photos
+twice. Daily counts are changed with atomic upserts. Uploads don't index on the request
+thread; they wake a background indexer (request_event_indexing).
+
+Aggregate questions ("when did I go to the forest", "how many trips to Japan") are
+answered from these tables: find_events, day_counts and place_counts.
+"""
+import os
+import logging
+from collections import Counter
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+from sqlalchemy import delete, func, select, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from background import BackgroundPass
+from database import db
+from geo import haversine_km
+from models import DailyPhotoCount, Event, Photo
+
+logger = logging.getLogger(__name__)
+
+EVENT_GAP_HOURS = float(os.getenv("EVENT_GAP_HOURS", "8"))
+EVENT_MAX_DISTANCE_KM = float(os.getenv("EVENT_MAX_DISTANCE_KM", "100"))
+EVENT_BATCH_SIZE = int(os.getenv("EVENT_BATCH_SIZE", "1000"))
+
+# pg_advisory_xact_lock key serialising event index changes across processes
+EVENT_INDEX_LOCK_KEY = 0x6C7966650001
+
+# A place is the last few comma-separated parts of a location ("Shibuya, Tokyo, Japan")
+PLACE_PARTS = 3
+
+# Photo IDs listed per event in a summary line
+MAX_DESCRIBED_PHOTOS = 5
+
+
+def place_label(location: Optional[str]) -> str:
+    """Coarse place name for a location string: its last PLACE_PARTS parts, without postcodes. '' if unknown."""
+    if not location:
+        return ''
+    parts = [part.strip() for part in location.split(',')]
+    parts = [part for part in parts if part and not any(char.isdigit() for char in part)]
+    return ', '.join(parts[-PLACE_PARTS:])[:500]
+
+
+def lock_event_index():
+    """
+    Serialise event index changes until the current transaction ends: an advisory lock on
+    PostgreSQL, the database write lock (taken by an empty UPDATE) on SQLite.
+    """
+    if db.engine.dialect.name == "postgresql":
+        db.session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": EVENT_INDEX_LOCK_KEY})
+    else:
+        db.session.execute(update(Event).where(text("0")).values(photo_count=Event.photo_count))
+
+
+def update_event_index(batch_size: int = EVENT_BATCH_SIZE) -> int:
+    """Add photos that are not in an event yet to the event index. Returns how many were added."""
+    added = 0
+    while True:
+        # Taken before reading the unassigned photos, so no other writer is grouping them
+        lock_event_index()
+        rows = (
+            db.session.query(Photo.id, Photo.timestamp, Photo.location, Photo.latitude, Photo.longitude)
+            .filter(Photo.event_id.is_(None), Photo.timestamp.isnot(None))
+            .order_by(Photo.timestamp, Photo.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            break
+        _index_batch(rows)
+        db.session.commit()
+        added += len(rows)
+    return added
+
+
+def clear_event_index():
+    """Drop all events and counts (photos keep nothing pointing at them). The caller commits."""
+    lock_event_index()
+    db.session.execute(update(Photo).where(Photo.event_id.isnot(None)).values(event_id=None))
+    db.session.query(Event).delete()
+    db.session.query(DailyPhotoCount).delete()
+
+
+def remove_from_event_index(photo_ids: List[int]) -> int:
+    """
+    Take apart the events of photos that are about to be deleted. All their photos go back to
+    unassigned and leave the daily counts, and the next update_event_index regroups the rest:
+    a deleted photo may have been the one bridging two parts of an event. The caller commits.
+    Returns how many events were taken apart.
+    """
+    lock_event_index()
+    event_ids = [
+        event_id for (event_id,) in
+        db.session.query(Photo.event_id).filter(Photo.id.in_(photo_ids), Photo.event_id.isnot(None)).distinct()
+    ]
+    if not event_ids:
+        return 0
+    counts = Counter(
+        (timestamp.date(), place_label(location))
+        for timestamp, location in db.session.query(Photo.timestamp, Photo.location).filter(Photo.event_id.in_(event_ids))
+    )
+    _subtract_daily_counts(counts)
+    db.session.execute(update(Photo).where(Photo.event_id.in_(event_ids)).values(event_id=None))
+    db.session.query(Event).filter(Event.id.in_(event_ids)).delete(synchronize_session=False)
+    return len(event_ids)
+
+
+def rebuild_event_index() -> int:
+    """Recompute the whole index, e.g. after changing EVENT_GAP_HOURS. Returns how many photos were indexed."""
+    clear_event_index()
+    db.session.commit()
+    return update_event_index()
+
+
+def _indexing_pass():
+    # Failures are logged by BackgroundPass; the next upload (or --rebuild-events) picks these photos up
+    update_event_index()
+
+
+_indexer = BackgroundPass("event-index", _indexing_pass)
+
+
+def request_event_indexing(app):
+    """Index new photos on a background thread. Calls made while it runs schedule one more pass."""
+    _indexer.request(app)
+
+
+def wait_for_event_indexing(timeout: float) -> bool:
+    """Wait up to `timeout` seconds for the background indexer; False if it is still running."""
+    return _indexer.wait(timeout)
+
+
+def _index_batch(rows):
+    gap = timedelta(hours=EVENT_GAP_HOURS)
+    events = (
+        Event.query
+        .filter(Event.end_time >= rows[0].timestamp - gap, Event.start_time <= rows[-1].timestamp + gap)
+        .order_by(Event.start_time)
+        .all()
+    )
+
+    assignments = {}
+    merged_into = {}
+    for row in rows:
+        matches = [event for event in events if _fits(event, row, gap)]
+        if not matches:
+            event = Event(start_time=row.timestamp, end_time=row.timestamp, photo_count=0, located_count=0, places={})
+            db.session.add(event)
+            events.append(event)
+        else:
+            # The photo bridges the gap between these events: they become one
+            event = matches[0]
+            for other in matches[1:]:
+                _merge(event, other)
+                merged_into[other] = event
+                events.remove(other)
+                if other in db.session.new:
+                    db.session.expunge(other)
+        _add_photo(event, row)
+        assignments[row.id] = event
+
+    def survivor(event: Event) -> Event:
+        while event in merged_into:
+            event = merged_into[event]
+        return event
+
+    # New events need their IDs before photos can point at them
+    db.session.flush()
+    for other in merged_into:
+        if other.id is not None:
+            db.session.execute(update(Photo).where(Photo.event_id == other.id).values(event_id=survivor(other).id))
+            db.session.delete(other)
+    db.session.execute(update(Photo), [
+        {"id": photo_id, "event_id": survivor(event).id} for photo_id, event in assignments.items()
+    ])
+
+    _add_daily_counts(Counter((row.timestamp.date(), place_label(row.location)) for row in rows))
+
+
+def _fits(event: Event, row, gap: timedelta) -> bool:
+    if not (event.start_time - gap <= row.timestamp <= event.end_time + gap):
+        return False
+    if event.located_count and row.latitude is not None and row.longitude is not None:
+        return haversine_km(event.latitude, event.longitude, row.latitude, row.longitude) <= EVENT_MAX_DISTANCE_KM
+    return True
+
+
+def _add_photo(event: Event, row):
+    event.start_time = min(event.start_time, row.timestamp)
+    event.end_time = max(event.end_time, row.timestamp)
+    event.photo_count += 1
+    if event.cover_photo_id is None:
+        event.cover_photo_id = row.id
+    if row.latitude is not None and row.longitude is not None:
+        # Running mean of the located photos
+        event.located_count += 1
+        if event.located_count == 1:
+            event.latitude, event.longitude = row.latitude, row.longitude
+        else:
+            event.latitude += (row.latitude - event.latitude) / event.located_count
+            event.longitude += (row.longitude - event.longitude) / event.located_count
+    _count_places(event, {place_label(row.location): 1})
+
+
+def _merge(event: Event, other: Event):
+    """Fold `other` into `event`; the caller moves other's photos over and deletes it."""
+    event.start_time = min(event.start_time, other.start_time)
+    event.end_time = max(event.end_time, other.end_time)
+    event.photo_count += other.photo_count
+    if other.located_count:
+        if event.located_count:
+            total = event.located_count + other.located_count
+            event.latitude = (event.latitude * event.located_count + other.latitude * other.located_count) / total
+            event.longitude = (event.longitude * event.located_count + other.longitude * other.located_count) / total
+        else:
+            event.latitude, event.longitude = other.latitude, other.longitude
+        event.located_count += other.located_count
+    if event.cover_photo_id is None:
+        event.cover_photo_id = other.cover_photo_id
+    _count_places(event, other.places or {})
+
+
+def _count_places(event: Event, counts: Dict[str, int]):
+    # Assign a new dict so SQLAlchemy sees the JSON change
+    places = dict(event.places or {})
+    for place, count in counts.items():
+        places[place] = places.get(place, 0) + count
+    event.places = places
+    named = {place: count for place, count in places.items() if place}
+    event.place = max(named, key=named.get) if named else None
+
+
+def _add_daily_counts(counts: Counter):
+    # INSERT ... ON CONFLICT DO UPDATE: the increment happens in the database, not on a stale copy
+    insert = pg_insert if db.engine.dialect.name == "postgresql" else sqlite_insert
+    statement = insert(DailyPhotoCount)
+    statement = statement.on_conflict_do_update(
+        index_elements=[DailyPhotoCount.day, DailyPhotoCount.place],
+        set_={"photo_count": DailyPhotoCount.photo_count + statement.excluded.photo_count},
+    )
+    db.session.execute(statement, [
+        {"day": day, "place": place, "photo_count": count} for (day, place), count in counts.items()
+    ])
+
+
+def _subtract_daily_counts(counts: Counter):
+    for (day, place), count in counts.items():
+        db.session.execute(
+            update(DailyPhotoCount)
+            .where(DailyPhotoCount.day == day, DailyPhotoCount.place == place)
+            .values(photo_count=DailyPhotoCount.photo_count - count)
+        )
+    db.session.execute(delete(DailyPhotoCount).where(
+        DailyPhotoCount.day.in_({day for day, _ in counts}), DailyPhotoCount.photo_count <= 0
+    ))
+
+
+@dataclass
+class EventSummary:
+    """Compact description of one event, e.g. for the chat model."""
+    id: int
+    start_time: datetime
+    end_time: datetime
+    photo_count: int
+    place: Optional[str]
+    other_places: List[str]
+    cover_photo_id: Optional[int]
+    matching_photo_ids: Optional[List[int]] = None
+
+    @classmethod
+    def from_event(cls, event: Event, matching_photo_ids: Optional[List[int]] = None) -> 'EventSummary':
+        places = Counter({place: count for place, count in (event.places or {}).items() if place})
+        return cls(
+            id=event.id,
+            start_time=event.start_time,
+            end_time=event.end_time,
+            photo_count=event.photo_count,
+            place=event.place,
+            other_places=[place for place, _ in places.most_common(4) if place != event.place][:3],
+            cover_photo_id=event.cover_photo_id,
+            matching_photo_ids=matching_photo_ids,
+        )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'start_time': self.start_time.isoformat(),
+            'end_time': self.end_time.isoformat(),
+            'photo_count': self.photo_count,
+            'place': self.place,
+            'other_places': self.other_places,
+            'cover_photo_id': self.cover_photo_id,
+            'matching_photo_ids': self.matching_photo_ids,
+        }
+
+    def describe(self) -> str:
+        """One line: dates, size, places and photo IDs to look at."""
+        start, end = self.start_time.date(), self.end_time.date()
+        dates = start.isoformat() if start == end else f"{start.isoformat()} to {end.isoformat()}"
+        text = f"Event {self.id}: {dates}, {self.photo_count} photo{'' if self.photo_count == 1 else 's'}"
+        if self.place:
+            text += f", at {self.place}"
+        if self.other_places:
+            text += f" (also {'; '.join(self.other_places)})"
+        if self.matching_photo_ids:
+            shown = self.matching_photo_ids[:MAX_DESCRIBED_PHOTOS]
+            text += f". Matching photos: {', '.join(str(photo_id) for photo_id in shown)}"
+            if len(self.matching_photo_ids) > len(shown):
+                text += f" (+{len(self.matching_photo_ids) - len(shown)} more)"
+        elif self.cover_photo_id is not None:
+            text += f". Cover photo: {self.cover_photo_id}"
+        return text
+
+
+def find_events(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    location: Optional[str] = None,
+    photo_ids: Optional[List[int]] = None,
+    limit: Optional[int] = 20,
+) -> tuple[int, List[EventSummary]]:
+    """
+    Events overlapping [start, end) that contain a photo whose location contains
+    `location`, or one of photo_ids, in chronological order.
+
+    Returns (total matching events, summaries of the first `limit`). With photo_ids,
+    each summary lists which of those photos it contains.
+    """
+    query = Event.query
+    if start:
+        query = query.filter(Event.end_time >= start)
+    if end:
+        query = query.filter(Event.start_time < end)
+    if location:
+        escaped = location.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        query = query.filter(Event.id.in_(
+            select(Photo.event_id).where(Photo.location.ilike(f"%{escaped}%", escape='\\'))
+        ))
+
+    matching = None
+    if photo_ids is not None:
+        matching = {}
+        for photo_id, event_id in db.session.query(Photo.id, Photo.event_id).filter(Photo.id.in_(photo_ids)):
+            if event_id is not None:
+                matching.setdefault(event_id, []).append(photo_id)
+        query = query.filter(Event.id.in_(list(matching)))
+
+    total = query.count()
+    query = query.order_by(Event.start_time)
+    if limit is not None:
+        query = query.limit(limit)
+    return total, [
+        EventSummary.from_event(event, sorted(matching[event.id]) if matching is not None else None)
+        for event in query
+    ]
+
+
+def day_counts(start: Optional[date] = None, end: Optional[date] = None, place: Optional[str] = None) -> List[tuple[date, int]]:
+    """Photos per day in [start, end), optionally only where the place contains `place`."""
+    query = db.session.query(DailyPhotoCount.day, func.sum(DailyPhotoCount.photo_count))
+    if start:
+        query = query.filter(DailyPhotoCount.day >= start)
+    if end:
+        query = query.filter(DailyPhotoCount.day < end)
+    if place:
+        escaped = place.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        query = query.filter(DailyPhotoCount.place.ilike(f"%{escaped}%", escape='\\'))
+    return [(day, int(count)) for day, count in query.group_by(DailyPhotoCount.day).order_by(DailyPhotoCount.day)]
+
+
+def place_counts(start: Optional[date] = None, end: Optional[date] = None, limit: Optional[int] = 20) -> List[tuple[str, int]]:
+    """Photos per place in [start, end), most photographed first. Photos without a place are left out."""
+    total = func.sum(DailyPhotoCount.photo_count)
+    query = db.session.query(DailyPhotoCount.place, total).filter(DailyPhotoCount.place != '')
+    if start:
+        query = query.filter(DailyPhotoCount.day >= start)
+    if end:
+        query = query.filter(DailyPhotoCount.day < end)
+    query = query.group_by(DailyPhotoCount.place).order_by(total.desc(), DailyPhotoCount.place)
+    if limit is not None:
+        query = query.limit(limit)
+    return [(place, int(count)) for place, count in query]
@@ -0,0 +1,127 @@
+"""
+Geohash cells and distance helpers for coordinate queries.
+
+Every photo with GPS coordinates stores its geohash (photos.geohash, B-tree indexed).
+A geohash prefix is a lat/lon rectangle, and the photos inside it have geohashes in
+one contiguous key range, so a bbox or radius query becomes a handful of index range
+scans over the prefixes covering it (cover_bbox), followed by an exact check on
+photos.latitude / photos.longitude.
+"""
+import math
+from typing import List, Optional
+
+# Geohash alphabet, in ascending order (digits, then lowercase letters without a, i, l, o)
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+# Stored precision: 9 characters is a cell of about 5 x 5 m
+GEOHASH_PRECISION = 9
+
+# A covering uses at most this many cells (index range scans)
+MAX_COVER_CELLS = 16
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Half the earth's circumference; no two points are further apart
+MAX_DISTANCE_KM = math.pi * EARTH_RADIUS_KM
+
+
+def geohash_encode(lat: float, lon: float, precision: int = GEOHASH_PRECISION) -> str:
+    """Geohash of a point, `precision` characters long."""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars = []
+    bits, bit_count, even = 0, 0, True
+    while len(chars) < precision:
+        # Bits alternate between longitude (even) and latitude (odd)
+        value, bounds = (lon, lon_range) if even else (lat, lat_range)
+        middle = (bounds[0] + bounds[1]) / 2
+        if value >= middle:
+            bits = bits * 2 + 1
+            bounds[0] = middle
+        else:
+            bits = bits * 2
+            bounds[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits, bit_count = 0, 0
+    return "".join(chars)
+
+
+def cell_size(precision: int) -> tuple[float, float]:
+    """(height, width) in degrees of a geohash cell with `precision` characters."""
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def prefix_range(prefix: str) -> tuple[str, Optional[str]]:
+    """
+    Key range [low, high) of the geohashes starting with `prefix`.
+
+    high is the next prefix of the same length (None when there is none), so the
+    range is correct under any collation that orders digits before letters.
+    """
+    stripped = prefix.rstrip(BASE32[-1])
+    if not stripped:
+        return prefix, None
+    return prefix, stripped[:-1] + BASE32[BASE32.index(stripped[-1]) + 1]
+
+
+def cover_bbox(min_lat: float, min_lon: float, max_lat: float, max_lon: float, max_cells: int = MAX_COVER_CELLS) -> List[str]:
+    """
+    Geohash prefixes whose cells together cover the bbox, using the finest precision
+    that needs at most max_cells of them. The bbox must not cross the antimeridian
+    (split it first). Returns [""] (everything) for boxes too large to cover.
+    """
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        rows = math.floor((max_lat + 90) / height) - math.floor((min_lat + 90) / height) + 1
+        columns = math.floor((max_lon + 180) / width) - math.floor((min_lon + 180) / width) + 1
+        if rows * columns > max_cells:
+            continue
+        cells = set()
+        for row in range(rows):
+            lat = min(max_lat, (math.floor((min_lat + 90) / height) + row + 0.5) * height - 90)
+            for column in range(columns):
+                lon = min(max_lon, (math.floor((min_lon + 180) / width) + column + 0.5) * width - 180)
+                cells.add(geohash_encode(lat, lon, precision))
+        return sorted(cells)
+    return [""]
+
+
+def split_antimeridian(min_lon: float, max_lon: float) -> List[tuple[float, float]]:
+    """Longitude intervals of a bbox; min_lon > max_lon means it wraps across 180 degrees."""
+    if min_lon <= max_lon:
+        return [(min_lon, max_lon)]
+    return [(min_lon, 180.0), (-180.0, max_lon)]
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance between two points in kilometres."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def radius_bbox(lat: float, lon: float, radius_km: float) -> tuple[float, float, float, float]:
+    """
+    Smallest (min_lat, min_lon, max_lat, max_lon) box containing the circle.
+
+    min_lon > max_lon when the box wraps across the antimeridian.
+    """
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat, max_lat = lat - dlat, lat + dlat
+    if min_lat <= -90 or max_lat >= 90:
+        # The circle contains a pole: every longitude
+        return max(min_lat, -90.0), -180.0, min(max_lat, 90.0), 180.0
+
+    dlon = math.degrees(math.asin(min(1.0, math.sin(radius_km / EARTH_RADIUS_KM) / math.cos(math.radians(lat)))))
+    min_lon, max_lon = lon - dlon, lon + dlon
+    if min_lon < -180:
+        min_lon += 360
+    if max_lon > 180:
+        max_lon -= 360
+    return min_lat, min_lon, max_lat, max_lon
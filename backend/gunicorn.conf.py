@@ -0,0 +1,68 @@
+"""
+Production server settings.
+
+    gunicorn -c gunicorn.conf.py "main:create_production_app()"
+
+WEB_WORKERS processes (default: one per core) each run WEB_THREADS request threads.
+Requests mostly wait on Vertex AI, Pinecone and OpenAI, so threads keep a worker busy
+while processes spread the CPU work (image decoding, scoring) over the cores. The app
+is loaded once in the master (preload_app) and forked. Each worker then opens its own
+database pool (database.DB_POOL_SIZE, sized to WEB_THREADS), cloud clients and image
+preprocessing pool (API_INGEST_WORKERS, the cores left per worker). On
+SIGTERM a worker stops accepting requests, finishes the ones in flight within
+WEB_GRACEFUL_TIMEOUT, then waits for captioning and closes its pools (main.shutdown).
+
+Metrics, traces and profiling settings go through files shared by the workers
+(METRICS_DIR, TRACE_FILE, PROFILE_DIR), so /metrics and /admin answer for the whole
+server whichever worker receives the request.
+"""
+import os
+import tempfile
+import multiprocessing
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_WORKERS", str(multiprocessing.cpu_count())))
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", "4"))
+preload_app = True
+
+# Each worker has its own image preprocessing pool (ingest_pool.get_ingest_pool). Split the
+# cores between them rather than giving every worker one process per core (cores^2 in total);
+# with the default of one worker per core, uploads preprocess inline on the request thread.
+# Read by ingest_pool at import, which happens after this file because of preload_app.
+os.environ.setdefault("API_INGEST_WORKERS", str(max(1, multiprocessing.cpu_count() // workers)))
+
+# Per-worker metric snapshots summed at scrape time, and one trace file for every worker
+os.environ.setdefault("METRICS_DIR", os.path.join(tempfile.gettempdir(), "lyfe-metrics"))
+os.environ.setdefault("TRACE_FILE", os.path.join(tempfile.gettempdir(), "lyfe-traces.jsonl"))
+
+# A chat request can make several LLM calls in a row
+timeout = int(os.getenv("WEB_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+# Recycle workers after this many requests (0: never), staggered so they don't restart together
+max_requests = int(os.getenv("WEB_MAX_REQUESTS", "0"))
+max_requests_jitter = max_requests // 10
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("LOG_LEVEL", "info")
+
+
+def on_starting(server):
+    from metrics import clear_metrics_dir
+
+    # Counters restart from zero with the server, as Prometheus expects after a restart
+    clear_metrics_dir()
+
+
+def post_fork(server, worker):
+    from main import start_worker
+
+    start_worker(worker.app.wsgi())
+
+
+def worker_exit(server, worker):
+    from main import shutdown
+
+    shutdown(worker.app.wsgi(), timeout=graceful_timeout)
@@ -0,0 +1,165 @@
+"""
+Process-pool preprocessing stage for bulk ingest.
+
+Decoding, EXIF extraction, resizing and hashing are CPU-bound Pillow work that
+serialises under the GIL, so they run in worker processes. Workers read files
+themselves (only the path is pickled on the way in) and send back a small
+PreparedPhoto holding the ~50 KB prepared image plus a few scalars. Upload payloads
+are copied once into a shared memory block; workers get its name and an offset.
+
+The uploader script sizes its pool with INGEST_WORKERS (one per core). The API's
+pool is per server process, so it is sized with API_INGEST_WORKERS, which
+gunicorn.conf.py sets to the cores left per web worker.
+"""
+import os
+import hashlib
+import logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from dataclasses import dataclass
+from datetime import datetime
+from io import BytesIO
+from typing import Iterable, Iterator, List, Optional
+from PIL import Image as PILImage
+from clients import cached_client
+from image_prep import EMBED_IMAGE_SIZE, encode_image, exif_gps_coords, exif_timestamp, resize_for_embedding
+
+logger = logging.getLogger(__name__)
+
+# Worker processes; 0 or 1 disables the pool and processes inline
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 1)))
+
+# Worker processes of each API server process's pool (see gunicorn.conf.py)
+API_INGEST_WORKERS = int(os.getenv("API_INGEST_WORKERS", str(INGEST_WORKERS)))
+
+# Batches smaller than this are cheaper to process inline than to ship to workers
+INGEST_POOL_MIN_BATCH = int(os.getenv("INGEST_POOL_MIN_BATCH", "4"))
+
+# Tasks kept in flight per worker, bounds memory when the consumer is slower than the pool
+IN_FLIGHT_PER_WORKER = 4
+
+
+@dataclass
+class PreparedPhoto:
+    """Result of preprocessing one photo."""
+    source: str
+    image_bytes: Optional[bytes] = None
+    sha256: Optional[str] = None
+    gps_coords: Optional[tuple[float, float]] = None
+    timestamp: Optional[datetime] = None
+    error: Optional[str] = None
+
+
+def _prepare(source: str, raw: bytes, size: int) -> PreparedPhoto:
+    with PILImage.open(BytesIO(raw)) as img:
+        # EXIF has to be read before the pixel data is decoded in draft mode
+        exif = img._getexif() if hasattr(img, '_getexif') else None
+        image_bytes = encode_image(resize_for_embedding(img, size))
+    return PreparedPhoto(
+        source=source,
+        image_bytes=image_bytes,
+        sha256=hashlib.sha256(raw).hexdigest(),
+        gps_coords=exif_gps_coords(exif),
+        timestamp=exif_timestamp(exif),
+    )
+
+
+def preprocess_path(path: str, size: int = EMBED_IMAGE_SIZE) -> PreparedPhoto:
+    """Read, hash, extract EXIF from and resize one photo file (runs in a worker)."""
+    try:
+        with open(path, 'rb') as f:
+            raw = f.read()
+        return _prepare(path, raw, size)
+    except Exception as e:
+        return PreparedPhoto(source=path, error=str(e))
+
+
+def preprocess_bytes(raw: bytes, source: str = '', size: int = EMBED_IMAGE_SIZE) -> PreparedPhoto:
+    """Hash, extract EXIF from and resize one in-memory image (runs in a worker)."""
+    try:
+        return _prepare(source, raw, size)
+    except Exception as e:
+        return PreparedPhoto(source=source, error=str(e))
+
+
+def make_ingest_pool(workers: int = INGEST_WORKERS) -> ProcessPoolExecutor:
+    """Worker pool for preprocessing. Workers are spawned so they never inherit server threads or sockets."""
+    context = multiprocessing.get_context(os.getenv("INGEST_START_METHOD", "spawn"))
+    logger.info(f"Starting ingest pool with {workers} workers")
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context)
+
+
+@cached_client
+def get_ingest_pool() -> ProcessPoolExecutor:
+    """Pool shared by the API process, sized by API_INGEST_WORKERS."""
+    return make_ingest_pool(API_INGEST_WORKERS)
+
+
+def preprocess_paths(
+    paths: Iterable[str],
+    pool: Optional[ProcessPoolExecutor] = None,
+    workers: int = INGEST_WORKERS,
+) -> Iterator[PreparedPhoto]:
+    """
+    Preprocess photo files in parallel, yielding results in input order.
+
+    Pass `pool` to use a dedicated pool of `workers` processes; without one the
+    shared pool (get_ingest_pool, API_INGEST_WORKERS processes) is used. Either way
+    the window and the inline fallback are sized from the pool in use: at most
+    IN_FLIGHT_PER_WORKER tasks per worker are outstanding, so a slow consumer
+    (embedding, database) never makes results pile up in memory.
+    """
+    paths = list(paths)
+    if pool is None:
+        workers = API_INGEST_WORKERS
+    if workers <= 1 or len(paths) < INGEST_POOL_MIN_BATCH:
+        for path in paths:
+            yield preprocess_path(path)
+        return
+    pool = pool or get_ingest_pool()
+
+    window = IN_FLIGHT_PER_WORKER * workers
+    pending = deque()
+    for path in paths:
+        pending.append(pool.submit(preprocess_path, path))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def preprocess_shared(name: str, offset: int, length: int, source: str) -> PreparedPhoto:
+    """preprocess_bytes for a payload in a shared memory block (runs in a worker)."""
+    # The parent owns the block; attaching without tracking keeps this process from unlinking it
+    block = shared_memory.SharedMemory(name=name, track=False)
+    try:
+        raw = bytes(block.buf[offset:offset + length])
+    finally:
+        block.close()
+    return preprocess_bytes(raw, source)
+
+
+def preprocess_payloads(payloads: List[bytes]) -> List[PreparedPhoto]:
+    """Preprocess decoded upload payloads, in parallel when the batch is large enough."""
+    sources = [str(i) for i in range(len(payloads))]
+    if API_INGEST_WORKERS <= 1 or len(payloads) < INGEST_POOL_MIN_BATCH:
+        return [preprocess_bytes(raw, source) for raw, source in zip(payloads, sources)]
+
+    # One copy into shared memory instead of pickling every payload through the pool's pipe
+    offsets = []
+    total = 0
+    for raw in payloads:
+        offsets.append(total)
+        total += len(raw)
+    block = shared_memory.SharedMemory(create=True, size=max(total, 1))
+    try:
+        for raw, offset in zip(payloads, offsets):
+            block.buf[offset:offset + len(raw)] = raw
+        return list(get_ingest_pool().map(
+            preprocess_shared, [block.name] * len(payloads), offsets, [len(raw) for raw in payloads], sources
+        ))
+    finally:
+        block.close()
+        block.unlink()
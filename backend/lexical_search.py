@@ -0,0 +1,125 @@
+"""
+Keyword search over photo locations and captions.
+
+Exact names ("Yosemite", "Shibuya") appear verbatim in photos.location and captions
+but often embed poorly, so search_photo_ids fuses this ranking with the vector ones.
+
+PostgreSQL: an expression GIN index over to_tsvector(SEARCH_DOCUMENT_SQL) (created by
+migration 9d3a7c5e1f20), queried with to_tsquery and ranked with ts_rank_cd.
+SQLite (local runs): an external-content FTS5 table kept in sync by triggers, created
+with the photos table (or on first use for older databases) and ranked with bm25.
+
+Query words are OR-ed: a photo matching more of them ranks higher, one matching any
+of them is still a candidate.
+"""
+import os
+import re
+import logging
+import threading
+from typing import List, Optional
+from sqlalchemy import DDL, column, event, func, literal_column, table, text
+from database import db
+from metrics import stage
+from models import Photo
+
+logger = logging.getLogger(__name__)
+
+# Fuse keyword matches into search results
+LEXICAL_SEARCH = os.getenv("LEXICAL_SEARCH", "true").lower() == "true"
+
+# Text search configuration: English stemming, so "dogs" matches a "dog" caption
+TS_CONFIG = "english"
+
+# Must stay identical to the indexed expression (see the migration) for PostgreSQL to use the index
+SEARCH_DOCUMENT_SQL = f"to_tsvector('{TS_CONFIG}', coalesce(location, '') || ' ' || coalesce(caption, ''))"
+
+# Words longer than this are not real query terms
+MAX_TERM_LENGTH = 64
+
+_FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS photos_fts USING fts5("
+    "location, caption, content='photos', content_rowid='id', tokenize='porter unicode61')",
+    "CREATE TRIGGER IF NOT EXISTS photos_fts_insert AFTER INSERT ON photos BEGIN "
+    "INSERT INTO photos_fts(rowid, location, caption) VALUES (new.id, new.location, new.caption); END",
+    "CREATE TRIGGER IF NOT EXISTS photos_fts_delete AFTER DELETE ON photos BEGIN "
+    "INSERT INTO photos_fts(photos_fts, rowid, location, caption) VALUES ('delete', old.id, old.location, old.caption); END",
+    "CREATE TRIGGER IF NOT EXISTS photos_fts_update AFTER UPDATE OF location, caption ON photos BEGIN "
+    "INSERT INTO photos_fts(photos_fts, rowid, location, caption) VALUES ('delete', old.id, old.location, old.caption); "
+    "INSERT INTO photos_fts(rowid, location, caption) VALUES (new.id, new.location, new.caption); END",
+)
+
+photos_fts = table("photos_fts", column("rowid"))
+
+_fts_lock = threading.Lock()
+_fts_ready = set()
+
+for _statement in _FTS_DDL:
+    event.listen(Photo.__table__, "after_create", DDL(_statement).execute_if(dialect="sqlite"))
+
+
+def query_terms(query: str) -> List[str]:
+    """Lowercased words of a query, deduplicated, in order."""
+    terms = []
+    for term in re.findall(r"\w+", query.lower()):
+        if len(term) <= MAX_TERM_LENGTH and term not in terms:
+            terms.append(term)
+    return terms
+
+
+def ensure_fts_table():
+    """Create (and fill, the first time) the SQLite FTS5 table and its triggers."""
+    engine = db.engine
+    if engine.url in _fts_ready:
+        return
+    with _fts_lock:
+        if engine.url in _fts_ready:
+            return
+        with engine.begin() as connection:
+            exists = connection.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'photos_fts'")).first()
+            for statement in _FTS_DDL:
+                connection.execute(text(statement))
+            if not exists:
+                connection.execute(text("INSERT INTO photos_fts(photos_fts) VALUES ('rebuild')"))
+        _fts_ready.add(engine.url)
+
+
+@stage("search.lexical")
+def lexical_search(query: str, top_k: int, filters=None) -> List[tuple[int, float]]:
+    """
+    (photo_id, score) pairs for photos whose location or caption contains the query's
+    words, best first. filters (a photo_service.SearchFilters) are applied in SQL.
+    """
+    terms = query_terms(query)
+    if not terms:
+        return []
+
+    if db.engine.dialect.name == "sqlite":
+        ensure_fts_table()
+        # bm25 is lower for better matches
+        score = (-func.bm25(literal_column("photos_fts"))).label("score")
+        match = " OR ".join(f'"{term}"' for term in terms)
+        rows = (
+            db.session.query(Photo.id, score)
+            .join(photos_fts, photos_fts.c.rowid == Photo.id)
+            .filter(literal_column("photos_fts").op("MATCH")(match))
+        )
+    else:
+        document = literal_column(SEARCH_DOCUMENT_SQL)
+        tsquery = func.to_tsquery(literal_column(f"'{TS_CONFIG}'"), " | ".join(terms))
+        score = func.ts_rank_cd(document, tsquery).label("score")
+        rows = db.session.query(Photo.id, score).filter(document.op("@@")(tsquery))
+
+    if filters is not None:
+        rows = filters.apply_sql(rows)
+    rows = rows.order_by(score.desc(), Photo.id).limit(top_k)
+    return [(photo_id, float(rank)) for photo_id, rank in rows]
+
+
+def safe_lexical_search(query: str, top_k: int, filters=None) -> Optional[List[tuple[int, float]]]:
+    """lexical_search, or None (logged) if the keyword index is unavailable."""
+    try:
+        with db.session.begin_nested():
+            return lexical_search(query, top_k, filters)
+    except Exception as e:
+        logger.warning(f"Keyword search failed, using vector results only: {e}")
+        return None
@@ -1,10 +1,23 @@
 from flask import Flask
 from flask_cors import CORS
 import os
+import logging
 from public_api import register_routes
-from database import init_db
+from database import db, init_db
+from clients import preload_client_libraries, start_background_warm_up
+from ingest_pool import get_ingest_pool
+from captioning import wait_for_captioning
+from events import wait_for_event_indexing
+from vector_outbox import request_outbox_drain, stop_outbox_drainer
+from photo_service import shutdown_search_executor
+from metrics import REGISTRY, start_metrics_flusher
 from models import Photo  # Import models to register them
 
+logger = logging.getLogger(__name__)
+
+REQUIRED_ENV_VARS = ["GCP_PROJECT_ID", "PINECONE_API_KEY"]
+WARM_UP_CLIENTS = os.getenv("WARM_UP_CLIENTS", "true").lower() == "true"
+
 
 def create_app():
     """Create and configure the Flask application"""
@@ -20,10 +33,62 @@ def create_app():
     return app
 
 
+def missing_env_vars():
+    return [var for var in REQUIRED_ENV_VARS if not os.getenv(var)]
+
+
+def create_production_app():
+    """
+    App factory for the production server (gunicorn.conf.py), called once in the master
+    process before the workers are forked: tables are created and the SDKs imported there.
+    """
+    missing_vars = missing_env_vars()
+    if missing_vars:
+        raise RuntimeError(f"Missing required environment variables: {', '.join(missing_vars)}")
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        # Workers must not share the master's connections
+        db.engine.dispose()
+    preload_client_libraries()
+    return app
+
+
+def start_worker(app):
+    """Per-process setup in a freshly forked worker."""
+    with app.app_context():
+        # Forget any pooled connection inherited from the master without closing its socket
+        db.engine.dispose(close=False)
+    if WARM_UP_CLIENTS:
+        start_background_warm_up()
+    # Vector writes left over from before a restart
+    request_outbox_drain(app)
+    # Lets /metrics on any worker report this one (METRICS_DIR)
+    start_metrics_flusher(app)
+
+
+def shutdown(app, timeout: float = 10.0):
+    """Finish background work and release connections before the process exits."""
+    if not stop_outbox_drainer(timeout):
+        logger.warning("Vector outbox still draining at shutdown; the rest is delivered on the next start")
+    if not wait_for_event_indexing(timeout):
+        logger.warning("Event indexing still running at shutdown; the rest is indexed after the next upload")
+    if not wait_for_captioning(timeout):
+        logger.warning("Captioning still running at shutdown; remaining photos are captioned on the next start")
+    shutdown_search_executor()
+    if get_ingest_pool.is_initialized():
+        get_ingest_pool().shutdown(wait=True, cancel_futures=True)
+    with app.app_context():
+        # Final counts, so the totals don't drop once this worker is gone
+        REGISTRY.write_snapshot()
+        db.engine.dispose()
+    logger.info("Shut down cleanly")
+
+
 if __name__ == '__main__':
-    # Check required environment variables
-    required_env_vars = ["GCP_PROJECT_ID", "PINECONE_API_KEY"]
-    missing_vars = [var for var in required_env_vars if not os.getenv(var)]
+    # Development server; production runs under gunicorn (see gunicorn.conf.py)
+    missing_vars = missing_env_vars()
     
     if missing_vars:
         print(f"Error: Missing required environment variables: {', '.join(missing_vars)}")
@@ -33,8 +98,16 @@ if __name__ == '__main__':
     
     # Create database tables
     with app.app_context():
-        from database import db
         db.create_all()
         print("Database tables created successfully!")
     
-    app.run(debug=True, host='0.0.0.0', port=8000)
+    debug = os.getenv("FLASK_DEBUG", "true").lower() == "true"
+    
+    # Warm up cloud clients in the background so the first request doesn't pay for them.
+    # With the reloader on, only the child process that actually serves requests does this.
+    if not debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        if WARM_UP_CLIENTS:
+            start_background_warm_up()
+        request_outbox_drain(app)
+    
+    app.run(debug=debug, host='0.0.0.0', port=8000)
@@ -0,0 +1,346 @@
+"""
+Process-wide counters and latency histograms, served in the Prometheus text format at /metrics.
+
+Recording is cheap: a histogram observation is a bisect into fixed buckets and two
+additions under a lock, and the label lookup is done once per call site. Values that
+mirror existing state (cache counters, queue depths, connection pool usage) are read
+by collectors only when /metrics is scraped, so they cost nothing in between.
+METRICS_ENABLED=false turns recording off.
+
+Under gunicorn every worker has its own registry. With METRICS_DIR set (gunicorn.conf.py
+does), each worker writes a snapshot of its counters, histograms and per-process
+collectors there every METRICS_FLUSH_SECONDS, and a scrape answered by any worker
+sums the snapshots of all of them: counters and histograms across every worker that
+ran since the server started, gauges per live worker (with a `pid` label). Collectors
+registered as `shared` read state every worker sees (the database) and are only run
+by the scraped worker.
+
+    with stage("upload.prepare"):
+        ...
+
+    @stage("embedding.text")
+    def gen_text_embedding(...):
+        ...
+"""
+import os
+import json
+import glob
+import time
+import threading
+import logging
+from bisect import bisect_left
+from contextlib import ContextDecorator
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from tracing import enter_span, exit_span
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+# Shared by the server's processes; unset, /metrics reports this process only
+METRICS_DIR = os.getenv("METRICS_DIR")
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "10"))
+
+# Upper bounds in seconds, from a local cache hit to a slow LLM call
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# (name, type, help, [(labels, value), ...]) as returned by a collector
+Family = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+# (sample name, labels, value): one line of the exposition format
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.family_name = f"{name}_total" if self.type == "counter" else name
+        self._children = {}
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def labels(self, *values):
+        """The child for these label values (in labelnames order). Keep it around on hot paths."""
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _label_dict(self, values: tuple) -> Dict[str, str]:
+        return dict(zip(self.labelnames, values))
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        if METRICS_ENABLED:
+            with self._lock:
+                self.value += amount
+
+
+class Counter(_Metric):
+    """Monotonic count, e.g. photos uploaded."""
+    type = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def samples(self) -> Iterable[Sample]:
+        for values, child in list(self._children.items()):
+            yield self.family_name, self._label_dict(values), child.value
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "_lock")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        if not METRICS_ENABLED:
+            return
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class Histogram(_Metric):
+    """Distribution of observed values (seconds) in cumulative buckets."""
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def samples(self) -> Iterable[Sample]:
+        for values, child in list(self._children.items()):
+            labels = self._label_dict(values)
+            with child._lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Tuple[Callable[[], Iterable[Family]], bool]] = []
+        self._lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
+
+    def register(self, metric: _Metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def register_collector(self, collector: Callable[[], Iterable[Family]], shared: bool = False):
+        """
+        `collector()` is called on every scrape and yields (name, type, help, samples) families.
+        `shared` collectors read state that is the same in every process (the database).
+        """
+        with self._lock:
+            self._collectors.append((collector, shared))
+
+    def families(self, shared: bool) -> List[Tuple[str, str, str, List[Sample]]]:
+        """This process's metrics and per-process collectors, or the shared collectors."""
+        families = []
+        if not shared:
+            for metric in list(self._metrics):
+                families.append((metric.family_name, metric.type, metric.help, list(metric.samples())))
+        for collector, collector_shared in list(self._collectors):
+            if collector_shared != shared:
+                continue
+            try:
+                collected = list(collector())
+            except Exception as e:
+                # One broken source shouldn't take the whole endpoint down
+                logger.warning(f"Metrics collector {getattr(collector, '__name__', collector)} failed: {e}")
+                continue
+            for name, metric_type, help, samples in collected:
+                families.append((name, metric_type, help, [(name, labels, value) for labels, value in samples]))
+        return families
+
+    def write_snapshot(self):
+        """Store this process's families in METRICS_DIR for the other workers' scrapes."""
+        if not METRICS_DIR:
+            return
+        snapshot = {"pid": os.getpid(), "families": self.families(shared=False)}
+        path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+        with self._snapshot_lock:
+            try:
+                os.makedirs(METRICS_DIR, exist_ok=True)
+                with open(f"{path}.tmp", "w") as f:
+                    json.dump(snapshot, f)
+                os.replace(f"{path}.tmp", path)
+            except OSError as e:
+                logger.warning(f"Could not write metrics snapshot {path}: {e}")
+
+    def _merged_snapshots(self) -> List[Tuple[str, str, str, List[Sample]]]:
+        """Every worker's snapshot added up: counters and histograms summed, gauges per live pid."""
+        merged = {}
+        for path in glob.glob(os.path.join(METRICS_DIR, "*.json")):
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                # Replaced or removed while listing
+                continue
+            pid = snapshot["pid"]
+            live = _process_alive(pid)
+            for name, metric_type, help, samples in snapshot["families"]:
+                if metric_type == "gauge" and not live:
+                    continue
+                values = merged.setdefault(name, (metric_type, help, {}))[2]
+                for sample, labels, value in samples:
+                    if metric_type == "gauge":
+                        labels = {**labels, "pid": str(pid)}
+                    key = (sample, tuple(labels.items()))
+                    values[key] = values.get(key, 0) + value
+        return [
+            (name, metric_type, help, [(sample, dict(labels), value) for (sample, labels), value in values.items()])
+            for name, (metric_type, help, values) in merged.items()
+        ]
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        if METRICS_DIR:
+            # Our own snapshot first, so each worker's numbers only ever grow between scrapes
+            self.write_snapshot()
+            families = self._merged_snapshots()
+        else:
+            families = self.families(shared=False)
+        families += self.families(shared=True)
+        lines = []
+        for name, metric_type, help, samples in families:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.extend(f"{sample}{_format_labels(labels)} {_format_value(value)}" for sample, labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def clear_metrics_dir():
+    """Drop the snapshots of a previous server run (gunicorn master, before forking)."""
+    if METRICS_DIR:
+        for path in glob.glob(os.path.join(METRICS_DIR, "*.json")):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+_flusher: Optional[threading.Thread] = None
+
+
+def start_metrics_flusher(app):
+    """With METRICS_DIR, write this process's snapshot every METRICS_FLUSH_SECONDS (collectors may need the app)."""
+    global _flusher
+    if not METRICS_DIR or _flusher is not None:
+        return
+
+    def flush():
+        while True:
+            time.sleep(METRICS_FLUSH_SECONDS)
+            with app.app_context():
+                REGISTRY.write_snapshot()
+
+    _flusher = threading.Thread(target=flush, name="metrics-flusher", daemon=True)
+    _flusher.start()
+
+
+REGISTRY = Registry()
+register_collector = REGISTRY.register_collector
+
+STAGE_SECONDS = Histogram(
+    "lyfe_stage_seconds", "Time spent in each stage of the upload, search and chat paths", ("stage",)
+)
+STAGE_ERRORS = Counter("lyfe_stage_errors", "Stages that ended with an exception", ("stage",))
+HTTP_REQUEST_SECONDS = Histogram(
+    "lyfe_http_request_seconds", "HTTP request latency by endpoint and status", ("endpoint", "method", "status")
+)
+
+
+class stage(ContextDecorator):
+    """
+    Time a block, or every call of a function, into lyfe_stage_seconds{stage=name}.
+    Inside a request trace it is also a span (see tracing); set() adds span attributes.
+    """
+
+    def __init__(self, name: str, _child=None):
+        self.name = name
+        self._child = _child or STAGE_SECONDS.labels(name)
+        self._started = 0.0
+        self._span = None
+
+    def _recreate_cm(self):
+        # A fresh timer per call, so a decorated function can run on several threads at once
+        return stage(self.name, self._child)
+
+    def set(self, **attributes):
+        if self._span is not None:
+            self._span[0].set(**attributes)
+
+    def __enter__(self):
+        self._span = enter_span(self.name)
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._child.observe(time.perf_counter() - self._started)
+        exit_span(self._span, exc)
+        if exc_type is not None:
+            STAGE_ERRORS.labels(self.name).inc()
+        return False
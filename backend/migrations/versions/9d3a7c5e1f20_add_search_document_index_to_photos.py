@@ -0,0 +1,29 @@
+"""Add full-text search index over photo location and caption
+
+Revision ID: 9d3a7c5e1f20
+Revises: 8c1f4a6e2b95
+Create Date: 2026-10-19 17:40:51.902114
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '9d3a7c5e1f20'
+down_revision = '8c1f4a6e2b95'
+branch_labels = None
+depends_on = None
+
+# Must match lexical_search.SEARCH_DOCUMENT_SQL
+SEARCH_DOCUMENT_SQL = "to_tsvector('english', coalesce(location, '') || ' ' || coalesce(caption, ''))"
+
+
+def upgrade():
+    # PostgreSQL only; SQLite databases get an FTS5 table from lexical_search instead
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(f"CREATE INDEX ix_photos_search_document ON photos USING gin ({SEARCH_DOCUMENT_SQL})")
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("DROP INDEX ix_photos_search_document")
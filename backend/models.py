@@ -1,5 +1,14 @@
-from datetime import datetime
+from datetime import datetime, timezone
+from sqlalchemy import insert
+from sqlalchemy.exc import SQLAlchemyError
 from database import db
+from geo import geohash_encode
+
+
+def utc_now() -> datetime:
+    """Current UTC time as a naive datetime, like the DateTime columns store"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
 
 class Photo(db.Model):
     """Photo model for storing photo data and metadata"""
@@ -21,8 +30,24 @@ class Photo(db.Model):
     # Location as string
     location = db.Column(db.String(500), nullable=True)
     
-    # Timestamps for tracking
-    timestamp = db.Column(db.DateTime, nullable=True)
+    # Timestamps for tracking (B-tree indexed for time-range search filters)
+    timestamp = db.Column(db.DateTime, nullable=True, index=True)
+    
+    # Short text description and tags written by the captioning stage (NULL until captioned)
+    caption = db.Column(db.Text, nullable=True)
+    tags = db.Column(db.JSON, nullable=True)
+    # Captioning attempts so far, and when the photo may be tried again (claimed by a pass or
+    # backing off after a failure; NULL: now). See captioning.caption_pending_photos
+    caption_attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    caption_retry_at = db.Column(db.DateTime, nullable=True)
+    
+    # GPS coordinates from EXIF, and their geohash for index range scans (see geo.py)
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    geohash = db.Column(db.String(12), nullable=True, index=True)
+    
+    # Trip/event the photo belongs to (NULL until the event index has seen it, see events.py)
+    event_id = db.Column(db.Integer, db.ForeignKey('events.id'), nullable=True, index=True)
     
     def __repr__(self):
         return f'<Photo {self.id}: {self.file_type} at {self.location or "unknown location"}>'
@@ -35,23 +60,74 @@ class Photo(db.Model):
             'file_type': self.file_type,
             'path': self.path,
             'location': self.location,
-            'timestamp': self.timestamp.isoformat() if self.timestamp else None
+            'timestamp': self.timestamp.isoformat() if self.timestamp else None,
+            'caption': self.caption,
+            'tags': self.tags or [],
+            'latitude': self.latitude,
+            'longitude': self.longitude
         }
     
+    @staticmethod
+    def coordinate_columns(gps_coords):
+        """latitude/longitude/geohash column values for (lat, lon) coordinates, or all None"""
+        if not gps_coords:
+            return {'latitude': None, 'longitude': None, 'geohash': None}
+        latitude, longitude = gps_coords
+        return {'latitude': latitude, 'longitude': longitude, 'geohash': geohash_encode(latitude, longitude)}
+    
     @classmethod
-    def create_photo(cls, data, file_type, path=None, location=None, timestamp=None):
+    def create_photo(cls, data, file_type, path=None, location=None, timestamp=None, gps_coords=None):
         """Create a new photo record"""
         photo = cls(
             data=data,
             file_type=file_type,
             path=path,
             location=location,
-            timestamp=timestamp
+            timestamp=timestamp,
+            **cls.coordinate_columns(gps_coords)
         )
         db.session.add(photo)
         db.session.commit()
         return photo
     
+    @classmethod
+    def bulk_create(cls, rows):
+        """
+        Insert many photo records with a single multi-row INSERT ... RETURNING id.
+        
+        The batch insert runs inside a savepoint. If it fails, every row is retried
+        in its own savepoint so one bad photo does not throw away the rest of the
+        batch. The caller owns the surrounding transaction and must commit it.
+        
+        Args:
+            rows (list[dict]): Column values for each photo
+            
+        Returns:
+            tuple: (ids, errors) aligned with rows. ids[i] is None when errors[i] is set.
+        """
+        if not rows:
+            return [], []
+        
+        stmt = insert(cls).returning(cls.id, sort_by_parameter_order=True)
+        try:
+            with db.session.begin_nested():
+                ids = list(db.session.scalars(stmt, rows))
+            return ids, [None] * len(rows)
+        except SQLAlchemyError:
+            pass
+        
+        # Slow path: isolate the bad rows
+        ids, errors = [], []
+        for row in rows:
+            try:
+                with db.session.begin_nested():
+                    ids.append(db.session.scalars(stmt, [row]).one())
+                errors.append(None)
+            except SQLAlchemyError as e:
+                ids.append(None)
+                errors.append(str(e.orig) if getattr(e, 'orig', None) else str(e))
+        return ids, errors
+    
     def update_location(self, location):
         """Update the location of the photo"""
         self.location = location
@@ -61,4 +137,86 @@ class Photo(db.Model):
     def delete(self):
         """Delete the photo record"""
         db.session.delete(self)
-        db.session.commit() 
\ No newline at end of file
+        db.session.commit() 
+
+
+class Event(db.Model):
+    """A trip or event: photos close together in time (and place), maintained by events.py"""
+    
+    __tablename__ = 'events'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    
+    # Time span of the event's photos
+    start_time = db.Column(db.DateTime, nullable=False, index=True)
+    end_time = db.Column(db.DateTime, nullable=False, index=True)
+    
+    photo_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    # Centroid of the photos with coordinates, and how many there are
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    located_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    # Most common place, and photo counts for every place ({place: count})
+    place = db.Column(db.String(500), nullable=True)
+    places = db.Column(db.JSON, nullable=True)
+    
+    # First photo added, shown as the event's cover
+    cover_photo_id = db.Column(db.Integer, nullable=True)
+    
+    def __repr__(self):
+        return f'<Event {self.id}: {self.photo_count} photos from {self.start_time} at {self.place or "unknown place"}>'
+    
+    def to_dict(self):
+        """Convert Event object to dictionary for JSON serialization"""
+        return {
+            'id': self.id,
+            'start_time': self.start_time.isoformat() if self.start_time else None,
+            'end_time': self.end_time.isoformat() if self.end_time else None,
+            'photo_count': self.photo_count,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'place': self.place,
+            'places': self.places or {},
+            'cover_photo_id': self.cover_photo_id
+        }
+
+
+class DailyPhotoCount(db.Model):
+    """Photos taken per day and place, maintained alongside the event index"""
+    
+    __tablename__ = 'daily_photo_counts'
+    
+    day = db.Column(db.Date, primary_key=True)
+    
+    # Place label (see events.place_label); empty for photos without a location
+    place = db.Column(db.String(500), primary_key=True, default='')
+    
+    photo_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class VectorOutbox(db.Model):
+    """A vector write committed together with its photo, delivered to the index by vector_outbox.py"""
+    
+    __tablename__ = 'vector_outbox'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    
+    photo_id = db.Column(db.Integer, db.ForeignKey('photos.id', ondelete='CASCADE'), nullable=False, index=True)
+    
+    # Which vector: 'image', 'location' or 'coarse' (see vector_outbox.TARGETS)
+    kind = db.Column(db.String(20), nullable=False)
+    
+    # float32 values; NULL if embedding failed at upload and the drainer has to compute it
+    embedding = db.Column(db.LargeBinary, nullable=True)
+    vector_metadata = db.Column(db.JSON, nullable=True)
+    
+    # Delivery attempts so far, the last failure, and when the next attempt is due
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=utc_now)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=utc_now, index=True)
+    
+    def __repr__(self):
+        return f'<VectorOutbox {self.id}: {self.kind} vector of photo {self.photo_id}, {self.attempts} attempts>'
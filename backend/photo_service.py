@@ -1,34 +1,90 @@
 import os
+import base64
+import calendar
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from datetime import datetime, timezone
 from models import Photo
 from database import db
-import base64
 import logging
+import numpy as np
 from pathlib import Path
-from typing import List, Optional
+from typing import Callable, List, Optional
 from PIL import Image as PILImage
-from PIL.ExifTags import GPSTAGS
-from PIL.ExifTags import TAGS
-from io import BytesIO
-from tqdm import tqdm
-import vertexai
-from vertexai.vision_models import Image as VertexImage, MultiModalEmbeddingModel
-from pinecone import Pinecone
-from constants import LOCATION_NAMESPACE, PHOTOS_INDEX_NAME, PHOTOS_NAMESPACE, VECTOR_DIMENSION
+from sqlalchemy import and_, or_, update
+from clients import get_coarse_vector_index, get_embedding_client, get_geocoder, get_vector_index, local_vector_backend
+from search_cache import search_cache
+from lexical_search import LEXICAL_SEARCH, safe_lexical_search
+from metrics import register_collector, stage
+from tracing import propagate
+from image_prep import EMBED_IMAGE_SIZE, data_url, decode_base64_payload, exif_gps_coords, prepare_image, prepared_file_type
+from constants import COARSE_VECTOR_DIMENSION, LOCATION_NAMESPACE, PHOTOS_NAMESPACE, VECTOR_DIMENSION
+from geo import MAX_DISTANCE_KM, cover_bbox, haversine_km, prefix_range, radius_bbox, split_antimeridian
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
-# Initialize services
-vertexai.init(project=os.getenv("GCP_PROJECT_ID"), location="us-central1")
-model = MultiModalEmbeddingModel.from_pretrained("multimodalembedding@001")
-pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+# Cloud clients (Vertex AI, Pinecone) are created lazily on first use, see clients.py
+
+# File extensions picked up when scanning a directory for photos
+PHOTO_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+# IDs per vector fetch request when scoring candidates from Pinecone
+VECTOR_FETCH_BATCH_SIZE = 200
+
+# Filtered searches matching at most this many photos are scored exactly instead of scanning the
+# namespace. The default keeps that to one fetch per namespace: more would be serial round trips
+PREFILTER_MAX_CANDIDATES = int(os.getenv("PREFILTER_MAX_CANDIDATES", str(VECTOR_FETCH_BATCH_SIZE)))
+
+# Over-fetch factor for filtered vector queries whose results still need a SQL post-filter
+POSTFILTER_OVERSAMPLE = 4
+
+# Namespaces searched for every query: image vectors and location/caption text vectors
+SEARCH_NAMESPACES = (PHOTOS_NAMESPACE, LOCATION_NAMESPACE)
+
+# Coarse-to-fine search: store COARSE_VECTOR_DIMENSION image embeddings at ingest, scan
+# them for COARSE_CANDIDATES photos and re-rank those with the full vectors. The re-rank
+# reads the full vectors from the main index, which is only cheap when that index is local:
+# against Pinecone it turns one ANN query into fetches of COARSE_CANDIDATES x 512 floats
+COARSE_SEARCH = os.getenv("COARSE_SEARCH", "false").lower() == "true"
+if COARSE_SEARCH and not local_vector_backend():
+    logger.warning("COARSE_SEARCH needs VECTOR_BACKEND=ivf (the re-rank would fetch full vectors from Pinecone); ignoring it")
+    COARSE_SEARCH = False
+COARSE_CANDIDATES = int(os.getenv("COARSE_CANDIDATES", "300"))
+
+# Image renditions a search hit can load: square size, or None for the stored image as uploaded
+IMAGE_RENDITIONS = {"thumbnail": 256, "preview": EMBED_IMAGE_SIZE, "original": None}
+
+# Rank offset for reciprocal-rank fusion (the usual value from the RRF paper)
+RRF_K = 60
+
+# Nearest-photo search starts at this radius and widens it 4x per round until it finds enough photos
+NEAREST_START_RADIUS_KM = 1.0
+
+# Runs the per-namespace vector queries of one search concurrently
+_search_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="vector-search")
+
+
+def _search_executor_metrics():
+    # Tasks waiting for a free search thread
+    yield ("lyfe_search_executor_queued", "gauge", "Vector search tasks waiting for a thread",
+           [({}, _search_executor._work_queue.qsize())])
+
+
+register_collector(_search_executor_metrics)
+
+
+def shutdown_search_executor():
+    """Let running vector queries finish and stop the search threads (server shutdown)."""
+    _search_executor.shutdown(wait=True, cancel_futures=True)
 
 
 def find_photos_in_dir(dir: str) -> List[str]:
     photo_files = []
     for root, _, files in os.walk(dir):
         for file in files:
-            if file.lower().endswith("png"):
+            if file.lower().endswith(PHOTO_EXTENSIONS):
                 photo_files.append(str((Path(root) / file).absolute()))
     return photo_files
 
@@ -52,92 +108,44 @@ def resize_to_square(image: PILImage.Image, size: int = 512) -> PILImage.Image:
 
 def get_resized_image_bytes(path: str) -> bytes:
     """Resize image to 512x512 square format and return as bytes."""
-    with PILImage.open(path) as img:
-        # Resize to square format
-        resized_img = resize_to_square(img, 512)
-
-        # Convert to bytes
-        img_byte_arr = BytesIO()
-        resized_img.save(img_byte_arr, format=img.format)
-        return img_byte_arr.getvalue()
+    return prepare_image(path, EMBED_IMAGE_SIZE)
 
 
 def get_resized_image_bytes_from_base64(base64_data: str) -> bytes:
     """Resize image from base64 data to 512x512 square format and return as bytes."""
-    # Remove data URL prefix if present
-    if base64_data.startswith('data:'):
-        _, base64_data = base64_data.split(',', 1)
-    
-    # Decode base64 data
-    image_data = base64.b64decode(base64_data)
-    
-    # Open image from bytes
-    with PILImage.open(BytesIO(image_data)) as img:
-        # Resize to square format
-        resized_img = resize_to_square(img, 512)
+    return prepare_image(decode_base64_payload(base64_data), EMBED_IMAGE_SIZE)
 
-        # Convert to bytes
-        img_byte_arr = BytesIO()
-        # Use PNG format for consistency
-        resized_img.save(img_byte_arr, format='PNG')
-        return img_byte_arr.getvalue()
 
-
-def gen_image_embedding(path: str):
-    image = VertexImage(image_bytes=get_resized_image_bytes(path))
-    embeddings = model.get_embeddings(
+@stage("embedding.image")
+def gen_image_embedding_from_prepared(image_bytes: bytes, dimension: int = VECTOR_DIMENSION):
+    """Generate image embedding from bytes already produced by prepare_image."""
+    from vertexai.vision_models import Image as VertexImage
+    image = VertexImage(image_bytes=image_bytes)
+    embeddings = get_embedding_client().get_embeddings(
         image=image,
-        dimension=VECTOR_DIMENSION,
+        dimension=dimension,
     )
     return embeddings.image_embedding
 
 
+def gen_image_embedding(path: str):
+    return gen_image_embedding_from_prepared(get_resized_image_bytes(path))
+
+
+def gen_image_embedding_from_bytes(image_bytes: bytes):
+    """Generate image embedding from raw (already decoded) image bytes."""
+    return gen_image_embedding_from_prepared(prepare_image(image_bytes, EMBED_IMAGE_SIZE))
+
+
 def gen_image_embedding_from_base64(base64_data: str):
     """Generate image embedding from base64 encoded image data."""
-    image_bytes = get_resized_image_bytes_from_base64(base64_data)
-    image = VertexImage(image_bytes=image_bytes)
-    embeddings = model.get_embeddings(
-        image=image,
-        dimension=VECTOR_DIMENSION,
-    )
-    return embeddings.image_embedding
+    return gen_image_embedding_from_bytes(decode_base64_payload(base64_data))
 
 
 def get_gps_coords_from_image(path: str) -> Optional[tuple[float, float]]:
     try:
-        
         with PILImage.open(path) as img:
-            # Get EXIF data
-            exif = img._getexif()
-            if not exif:
-                return None
-                
-            # Get GPS info
-            for tag_id in exif:
-                tag = TAGS.get(tag_id, tag_id)
-                if tag == "GPSInfo":
-                    gps_data = {}
-                    for gps_tag in exif[tag_id]:
-                        gps_data[GPSTAGS.get(gps_tag, gps_tag)] = exif[tag_id][gps_tag]
-                    
-                    if "GPSLatitude" in gps_data and "GPSLongitude" in gps_data:
-                        # Get direction indicators
-                        lat_ref = gps_data.get("GPSLatitudeRef", "N")
-                        lon_ref = gps_data.get("GPSLongitudeRef", "E")
-                        
-                        # Calculate decimal degrees
-                        latitude = gps_data["GPSLatitude"][0] + gps_data["GPSLatitude"][1] / 60.0 + gps_data["GPSLatitude"][2] / 3600.0
-                        longitude = gps_data["GPSLongitude"][0] + gps_data["GPSLongitude"][1] / 60.0 + gps_data["GPSLongitude"][2] / 3600.0
-                        
-                        # Apply direction
-                        if lat_ref == "S":
-                            latitude = -latitude
-                        if lon_ref == "W":
-                            longitude = -longitude
-                            
-                        return (latitude, longitude)
-            
-            return None
+            return exif_gps_coords(img._getexif())
     except:
         return None
 
@@ -147,39 +155,39 @@ def get_image_location(path: str) -> Optional[str]:
     if not gps_coords:
         return None
     # use geopy to get the location name from the gps coords
-    from geopy.geocoders import Nominatim
-    geolocator = Nominatim(user_agent="abhi-agent")
-    location = geolocator.reverse(gps_coords)
+    location = get_geocoder().reverse(gps_coords)
     if not location:
         return None
     return location.address
 
 
-def gen_text_embedding(text: str) -> list[float]:
-    embeddings = model.get_embeddings(
+@stage("embedding.text")
+def gen_text_embedding(text: str, dimension: int = VECTOR_DIMENSION) -> list[float]:
+    embeddings = get_embedding_client().get_embeddings(
         contextual_text=text,
-        dimension=VECTOR_DIMENSION,
+        dimension=dimension,
     )
     return embeddings.text_embedding
 
 
 def exists_in_index(path: str, namespace: str) -> bool:
-    index = pc.Index(PHOTOS_INDEX_NAME)
+    index = get_vector_index()
     return bool(index.fetch(
         ids=[path], namespace=namespace
     ).vectors)
 
 
+@stage("vector.fetch")
 def exists_in_index_by_photo_id(photo_id: str) -> bool:
     """Check if vector exists in Pinecone index using PostgreSQL photo ID."""
-    index = pc.Index(PHOTOS_INDEX_NAME)
+    index = get_vector_index()
     return bool(index.fetch(
         ids=[photo_id], namespace=PHOTOS_NAMESPACE
     ).vectors)
 
 
 def update_index(path: str, embedding: list[float], namespace: str):
-    index = pc.Index(PHOTOS_INDEX_NAME)
+    index = get_vector_index()
     index.upsert(
         vectors=[
             {
@@ -194,15 +202,39 @@ def update_index(path: str, embedding: list[float], namespace: str):
     )
 
 
-def update_index_with_photo_id(photo_id: str, embedding: list[float]):
+def to_epoch_seconds(timestamp: datetime) -> int:
+    """Seconds since the epoch; naive datetimes are treated as UTC."""
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return calendar.timegm(timestamp.timetuple())
+
+
+def photo_vector_metadata(
+    photo_id,
+    timestamp: Optional[datetime] = None,
+    location: Optional[str] = None,
+    gps_coords: Optional[tuple[float, float]] = None,
+) -> dict:
+    """Vector metadata used to push time and location filters down into the vector query."""
+    metadata = {"photo_id": str(photo_id)}
+    if timestamp is not None:
+        metadata["timestamp"] = to_epoch_seconds(timestamp)
+    if location:
+        metadata["location"] = location
+    if gps_coords:
+        metadata["lat"], metadata["lon"] = gps_coords
+    return metadata
+
+
+def update_index_with_photo_id(photo_id: str, embedding: list[float], metadata: Optional[dict] = None):
     """Store vector in Pinecone using PostgreSQL photo ID as vector identifier."""
-    index = pc.Index(PHOTOS_INDEX_NAME)
+    index = get_vector_index()
     index.upsert(
         vectors=[
             {
                 "id": photo_id,
                 "values": embedding,
-                "metadata": {
+                "metadata": metadata or {
                     "photo_id": photo_id,
                 },
             },
@@ -211,58 +243,623 @@ def update_index_with_photo_id(photo_id: str, embedding: list[float]):
     )
 
 
-def gen_caption_embedding(path: str) -> Optional[list[float]]:
+def sync_vector_metadata(batch_size: int = 500) -> int:
+    """Copy timestamp/location/coordinates from PostgreSQL onto existing vectors (for photos indexed before filters existed)."""
+    index = get_vector_index()
+    updated = 0
+    rows = db.session.query(Photo.id, Photo.timestamp, Photo.location, Photo.latitude, Photo.longitude).yield_per(batch_size)
+    for photo_id, timestamp, location, latitude, longitude in rows:
+        gps_coords = (latitude, longitude) if latitude is not None and longitude is not None else None
+        try:
+            index.update(
+                id=str(photo_id),
+                set_metadata=photo_vector_metadata(photo_id, timestamp, location, gps_coords),
+                namespace=PHOTOS_NAMESPACE,
+            )
+            updated += 1
+        except Exception as e:
+            logger.warning(f"Could not update vector metadata for photo ID {photo_id}: {e}")
+    return updated
+
+
+def backfill_coordinates(batch_size: int = 500) -> int:
+    """Fill in latitude/longitude/geohash from the GPS EXIF of original files still on disk. Returns how many photos were updated."""
+    updated = 0
+    last_id = 0
+    while True:
+        rows = (
+            db.session.query(Photo.id, Photo.path)
+            .filter(Photo.latitude.is_(None), Photo.id > last_id)
+            .order_by(Photo.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        updates = []
+        for photo_id, path in rows:
+            gps_coords = get_gps_coords_from_image(path) if path and os.path.isfile(path) else None
+            if gps_coords:
+                updates.append({"id": photo_id, **Photo.coordinate_columns(gps_coords)})
+        if updates:
+            db.session.execute(update(Photo), updates)
+            db.session.commit()
+            updated += len(updates)
+    return updated
+
+
+def upsert_coarse_vectors(vectors: List[dict]):
+    """Store COARSE_VECTOR_DIMENSION image vectors (same IDs and metadata as the full ones)."""
+    upsert_vectors(vectors, PHOTOS_NAMESPACE, index=get_coarse_vector_index())
+
+
+def backfill_coarse_embeddings(batch_size: int = 100) -> int:
+    """Embed photos that have no coarse vector yet at COARSE_VECTOR_DIMENSION, from the stored image data."""
+    coarse_index = get_coarse_vector_index()
+    stored = 0
+    rows = db.session.query(Photo.id, Photo.data, Photo.timestamp, Photo.location).yield_per(batch_size)
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            stored += _backfill_coarse_batch(coarse_index, batch)
+            batch = []
+    if batch:
+        stored += _backfill_coarse_batch(coarse_index, batch)
+    return stored
+
+
+def _backfill_coarse_batch(coarse_index, rows) -> int:
+    existing = coarse_index.fetch(ids=[str(row.id) for row in rows], namespace=PHOTOS_NAMESPACE).vectors
+    vectors = []
+    for photo_id, data, timestamp, location in rows:
+        if str(photo_id) in existing:
+            continue
+        try:
+            image_bytes = prepare_image(decode_base64_payload(data))
+            vectors.append({
+                "id": str(photo_id),
+                "values": gen_image_embedding_from_prepared(image_bytes, COARSE_VECTOR_DIMENSION),
+                "metadata": photo_vector_metadata(photo_id, timestamp, location),
+            })
+        except Exception as e:
+            logger.warning(f"Could not create coarse embedding for photo ID {photo_id}: {e}")
+    upsert_coarse_vectors(vectors)
+    return len(vectors)
+
+
+def caption_text(location: Optional[str]) -> Optional[str]:
+    """Text embedded into LOCATION_NAMESPACE for a photo."""
     # At the moment, we're just using the location as the caption
-    location = get_image_location(path)
-    if not location:
+    return location or None
+
+
+def gen_caption_embedding(path: str) -> Optional[list[float]]:
+    text = caption_text(get_image_location(path))
+    if not text:
         return None
-    return gen_text_embedding(location)
+    return gen_text_embedding(text)
 
 
-def search_photos(query: str, threshold: float = 0.1) -> List[Photo]:
-    """Search for photos using text query and return complete Photo objects from PostgreSQL"""
-    try:
-        # Generate embedding for search query
-        query_embedding = gen_text_embedding(query)
+def run_embedding_calls(calls: List[Callable[[], object]]) -> List[tuple[object, Optional[str]]]:
+    """
+    Run embedding calls on a thread pool as large as the embedding client's concurrency
+    maximum, so its AIMD limiter (not the caller) decides how many are in flight.
+    Returns (result, error) per call, in order.
+    """
+    if not calls:
+        return []
+
+    def attempt(call):
+        try:
+            return call(), None
+        except Exception as e:
+            return None, str(e)
+
+    workers = min(len(calls), get_embedding_client().limiter.maximum)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embedding") as executor:
+        return list(executor.map(propagate(attempt), calls))
+
+
+def embed_photos(images: List[bytes], captions: List[Optional[str]]) -> List[tuple[dict, Optional[str]]]:
+    """
+    Embeddings of prepared photos, by outbox kind: image, coarse (with COARSE_SEARCH) and
+    location (photos with a caption; one call per distinct caption), all computed
+    concurrently. Returns, per photo, the embeddings that succeeded and the first error;
+    the outbox drainer computes the rest.
+    """
+    image_kinds = [("image", VECTOR_DIMENSION)] + ([("coarse", COARSE_VECTOR_DIMENSION)] if COARSE_SEARCH else [])
+    distinct_captions = list(dict.fromkeys(caption for caption in captions if caption))
+    calls = [partial(gen_text_embedding, caption) for caption in distinct_captions]
+    calls += [
+        partial(gen_image_embedding_from_prepared, image_bytes, dimension)
+        for image_bytes in images
+        for _, dimension in image_kinds
+    ]
+    outcomes = iter(run_embedding_calls(calls))
+    location_outcomes = {caption: next(outcomes) for caption in distinct_captions}
+
+    results = []
+    for caption in captions:
+        embeddings = {}
+        errors = []
+        for kind, _ in image_kinds:
+            embedding, error = next(outcomes)
+            if error:
+                errors.append(error)
+            else:
+                embeddings[kind] = embedding
+        if caption:
+            embedding, error = location_outcomes[caption]
+            if error:
+                errors.append(error)
+            else:
+                embeddings["location"] = embedding
+        results.append((embeddings, errors[0] if errors else None))
+    return results
+
+
+def embedding_kinds(caption: Optional[str]) -> List[str]:
+    """Outbox kinds a photo needs."""
+    return ["image"] + (["coarse"] if COARSE_SEARCH else []) + (["location"] if caption else [])
+
+
+@stage("vector.upsert")
+def upsert_vectors(vectors: List[dict], namespace: str, batch_size: int = 100, index=None):
+    """Write many vectors with as few index requests as possible."""
+    if not vectors:
+        return
+    index = index or get_vector_index()
+    for start in range(0, len(vectors), batch_size):
+        index.upsert(vectors=vectors[start:start + batch_size], namespace=namespace)
+
+
+# Pinecone accepts at most 1000 IDs per delete request
+VECTOR_DELETE_BATCH_SIZE = 1000
+
+
+@stage("vector.delete")
+def delete_vectors(photo_ids: List[int], batch_size: int = VECTOR_DELETE_BATCH_SIZE) -> int:
+    """Delete the vectors of these photos from every namespace (and the coarse index). Returns the IDs sent per namespace."""
+    if not photo_ids:
+        return 0
+    ids = [str(photo_id) for photo_id in photo_ids]
+    targets = [(get_vector_index(), PHOTOS_NAMESPACE), (get_vector_index(), LOCATION_NAMESPACE)]
+    if COARSE_SEARCH or get_coarse_vector_index.is_initialized():
+        targets.append((get_coarse_vector_index(), PHOTOS_NAMESPACE))
+    for index, namespace in targets:
+        for start in range(0, len(ids), batch_size):
+            index.delete(ids=ids[start:start + batch_size], namespace=namespace)
+    return len(ids)
+
+
+@dataclass(frozen=True)
+class SearchFilters:
+    """
+    Structured filters for search_photos.
+
+    start is inclusive and end exclusive. location is a case-insensitive substring of
+    photos.location. bbox is (min_lat, min_lon, max_lat, max_lon), with min_lon > max_lon
+    for a box across the antimeridian, and only matches photos with coordinates.
+    """
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+    location: Optional[str] = None
+    bbox: Optional[tuple[float, float, float, float]] = None
+
+    def is_empty(self) -> bool:
+        return not (self.start or self.end or self.location or self.bbox)
+
+    def apply_sql(self, query):
+        """Add the SQL-expressible predicates to a Photo query."""
+        if self.start:
+            query = query.filter(Photo.timestamp >= _naive_utc(self.start))
+        if self.end:
+            query = query.filter(Photo.timestamp < _naive_utc(self.end))
+        if self.location:
+            escaped = self.location.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            query = query.filter(Photo.location.ilike(f"%{escaped}%", escape='\\'))
+        if self.bbox:
+            query = filter_bbox(query, *self.bbox)
+        return query
+
+    def to_vector_filter(self) -> Optional[dict]:
+        """Pinecone metadata filter for the predicates the vector index can evaluate."""
+        clauses = []
+        if self.start or self.end:
+            timestamp_range = {}
+            if self.start:
+                timestamp_range["$gte"] = to_epoch_seconds(self.start)
+            if self.end:
+                timestamp_range["$lt"] = to_epoch_seconds(self.end)
+            clauses.append({"timestamp": timestamp_range})
+        if self.bbox:
+            min_lat, min_lon, max_lat, max_lon = self.bbox
+            clauses.append({"lat": {"$gte": min_lat, "$lte": max_lat}})
+            if min_lon <= max_lon:
+                clauses.append({"lon": {"$gte": min_lon, "$lte": max_lon}})
+            else:
+                clauses.append({"$or": [{"lon": {"$gte": min_lon}}, {"lon": {"$lte": max_lon}}]})
+        if not clauses:
+            return None
+        return clauses[0] if len(clauses) == 1 else {"$and": clauses}
 
-        # Search pinecone index
-        index = pc.Index(PHOTOS_INDEX_NAME)
-        search_results = index.query(
-            vector=query_embedding, top_k=5, namespace=PHOTOS_NAMESPACE
+
+def filter_bbox(query, min_lat: float, min_lon: float, max_lat: float, max_lon: float):
+    """
+    Restrict a Photo query to a bbox: geohash range scans over the cells covering it
+    (photos.geohash index), then the exact latitude/longitude bounds.
+    """
+    intervals = split_antimeridian(min_lon, max_lon)
+    cell_ranges = []
+    for west, east in intervals:
+        for cell in cover_bbox(min_lat, west, max_lat, east):
+            low, high = prefix_range(cell)
+            cell_ranges.append(Photo.geohash >= low if high is None else and_(Photo.geohash >= low, Photo.geohash < high))
+    return query.filter(
+        or_(*cell_ranges),
+        Photo.latitude.between(min_lat, max_lat),
+        or_(*[Photo.longitude.between(west, east) for west, east in intervals]),
+    )
+
+
+def _naive_utc(timestamp: datetime) -> datetime:
+    if timestamp.tzinfo is None:
+        return timestamp
+    return timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _parse_matches(matches) -> List[tuple[int, float]]:
+    scored_ids = []
+    for match in matches:
+        # The vector ID should be the PostgreSQL photo ID (string)
+        try:
+            scored_ids.append((int(match.id), match.score))  # Convert string ID back to integer
+        except ValueError:
+            # Log warning for invalid photo ID format
+            logger.warning(f"Invalid photo ID format in Pinecone: {match.id}")
+    return scored_ids
+
+
+@stage("vector.query")
+def query_namespace(
+    query_embedding: list[float],
+    top_k: int,
+    namespace: str = PHOTOS_NAMESPACE,
+    vector_filter: Optional[dict] = None,
+) -> List[tuple[int, float]]:
+    """Nearest-neighbour query against one namespace."""
+    index = get_vector_index()
+    search_results = index.query(
+        vector=query_embedding, top_k=top_k, namespace=namespace, filter=vector_filter
+    )
+    return _parse_matches(search_results.matches)
+
+
+@stage("vector.score_candidates")
+def score_candidates(
+    query_embedding: list[float],
+    photo_ids: List[int],
+    top_k: int,
+    namespace: str = PHOTOS_NAMESPACE,
+    fetch_batch_size: int = VECTOR_FETCH_BATCH_SIZE,
+) -> List[tuple[int, float]]:
+    """
+    Exact cosine scoring of a small candidate set. The local index scores its stored
+    vectors in place; from Pinecone the vectors are fetched by ID and scored here.
+    """
+    index = get_vector_index()
+    if hasattr(index, "score"):
+        return _parse_matches(index.score(vector=query_embedding, ids=[str(i) for i in photo_ids], top_k=top_k, namespace=namespace).matches)
+    ids, vectors = [], []
+    for start in range(0, len(photo_ids), fetch_batch_size):
+        batch = [str(photo_id) for photo_id in photo_ids[start:start + fetch_batch_size]]
+        for vector_id, vector in index.fetch(ids=batch, namespace=namespace).vectors.items():
+            ids.append(int(vector_id))
+            vectors.append(vector.values)
+    if not ids:
+        return []
+
+    matrix = np.asarray(vectors, dtype=np.float32)
+    query = np.asarray(query_embedding, dtype=np.float32)
+    scores = matrix @ query / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query) + 1e-12)
+    best = np.argsort(-scores)[:top_k]
+    return [(ids[i], float(scores[i])) for i in best]
+
+
+@stage("vector.coarse_to_fine")
+def coarse_to_fine_search(
+    query_embedding: list[float],
+    coarse_query_embedding: list[float],
+    top_k: int,
+    vector_filter: Optional[dict] = None,
+    candidates: int = COARSE_CANDIDATES,
+) -> List[tuple[int, float]]:
+    """Scan the low-dimensional vectors for `candidates` photos, then re-rank them with the full vectors."""
+    coarse = get_coarse_vector_index().query(
+        vector=coarse_query_embedding, top_k=max(candidates, top_k), namespace=PHOTOS_NAMESPACE, filter=vector_filter
+    )
+    candidate_ids = [photo_id for photo_id, _ in _parse_matches(coarse.matches)]
+    if not candidate_ids:
+        return []
+    return score_candidates(query_embedding, candidate_ids, top_k)
+
+
+def reciprocal_rank_fusion(ranked_lists: List[List[tuple[int, float]]], top_k: int, k: int = RRF_K) -> List[tuple[int, float]]:
+    """Merge ranked (photo_id, score) lists; each photo scores sum(1 / (k + rank))."""
+    fused = {}
+    for ranked in ranked_lists:
+        for rank, (photo_id, _) in enumerate(ranked, start=1):
+            fused[photo_id] = fused.get(photo_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+
+@stage("search")
+def search_photo_ids(
+    query: str,
+    top_k: int = 5,
+    threshold: float = 0.1,
+    filters: Optional[SearchFilters] = None,
+) -> List[tuple[int, float]]:
+    """
+    Multi-vector search for a text query, returning (photo_id, fused_score) pairs best first.
+
+    The query embedding is matched against image vectors and location/caption text
+    vectors concurrently, alongside a keyword query over location and caption text
+    (see lexical_search), and the rankings are merged with reciprocal-rank fusion.
+    With filters, the plan depends on selectivity: if PostgreSQL (photos.timestamp
+    index) narrows the library to PREFILTER_MAX_CANDIDATES photos or fewer, those
+    candidates are scored exactly. Otherwise the time/bbox predicates are pushed into
+    the vector queries, over-fetching when a location substring still has to be
+    checked in SQL afterwards. With COARSE_SEARCH, the image namespace is searched
+    coarse-to-fine (see coarse_to_fine_search). Results are cached.
+    """
+    if filters is not None and filters.is_empty():
+        filters = None
+
+    cache_key = search_cache.make_key(query, top_k, threshold, filters)
+    generation = search_cache.generation()
+    cached = search_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    # Generate embedding for search query (and its coarse counterpart alongside)
+    coarse_future = _search_executor.submit(propagate(gen_text_embedding), query, COARSE_VECTOR_DIMENSION) if COARSE_SEARCH else None
+    query_embedding = gen_text_embedding(query)
+    coarse_query_embedding = coarse_future.result() if coarse_future else None
+
+    candidates = None
+    candidate_ids = None
+    vector_filter = None
+    post_filter = False
+    if filters is not None:
+        candidates = filters.apply_sql(db.session.query(Photo.id))
+        candidate_count = candidates.count()
+        if candidate_count == 0:
+            search_cache.put(cache_key, [], generation)
+            return []
+        if candidate_count <= PREFILTER_MAX_CANDIDATES:
+            logger.info(f"Prefiltering search to {candidate_count} candidate photos")
+            candidate_ids = [photo_id for (photo_id,) in candidates]
+        vector_filter = filters.to_vector_filter()
+        post_filter = candidate_ids is None and bool(filters.location)
+
+    fetch_k = top_k * POSTFILTER_OVERSAMPLE if post_filter else top_k
+
+    def search_namespace(namespace: str) -> List[tuple[int, float]]:
+        if candidate_ids is not None:
+            return score_candidates(query_embedding, candidate_ids, fetch_k, namespace)
+        if coarse_query_embedding is not None and namespace == PHOTOS_NAMESPACE:
+            return coarse_to_fine_search(query_embedding, coarse_query_embedding, fetch_k, vector_filter)
+        return query_namespace(query_embedding, fetch_k, namespace, vector_filter)
+
+    # Both namespaces are queried at once so the second one adds no serial round trip,
+    # and the keyword query runs on this thread meanwhile
+    vector_results = _search_executor.map(propagate(search_namespace), SEARCH_NAMESPACES)
+    lexical_ranked = safe_lexical_search(query, fetch_k, filters) if LEXICAL_SEARCH else None
+    ranked_lists = [
+        [(photo_id, score) for photo_id, score in ranked if score >= threshold]
+        for ranked in vector_results
+    ]
+
+    if post_filter:
+        matched_ids = {photo_id for ranked in ranked_lists for photo_id, _ in ranked}
+        allowed = {photo_id for (photo_id,) in candidates.filter(Photo.id.in_(matched_ids))} if matched_ids else set()
+        ranked_lists = [[(photo_id, score) for photo_id, score in ranked if photo_id in allowed] for ranked in ranked_lists]
+
+    # Keyword matches were filtered in SQL already
+    if lexical_ranked:
+        ranked_lists.append(lexical_ranked)
+
+    scored_ids = reciprocal_rank_fusion(ranked_lists, top_k)
+    search_cache.put(cache_key, scored_ids, generation)
+    return scored_ids
+
+
+@dataclass
+class SearchHit:
+    """One ranked search result. Image data is not loaded until asked for (see load_images)."""
+    id: int
+    score: float
+    timestamp: Optional[datetime] = None
+    location: Optional[str] = None
+    file_type: Optional[str] = None
+    caption: Optional[str] = None
+    tags: List[str] = field(default_factory=list)
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    # Set by coordinate queries: distance from the query point
+    distance_km: Optional[float] = None
+    images: dict = field(default_factory=dict, repr=False, compare=False)
+
+    def image_data_url(self, rendition: str = "preview") -> Optional[str]:
+        """Data URL of the image in the given rendition, loading it on first use."""
+        if rendition not in self.images:
+            load_images([self], rendition)
+        return self.images.get(rendition)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'score': self.score,
+            'timestamp': self.timestamp.isoformat() if self.timestamp else None,
+            'location': self.location,
+            'file_type': self.file_type,
+            'caption': self.caption,
+            'tags': self.tags,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'distance_km': self.distance_km,
+        }
+
+    @classmethod
+    def from_row(cls, row, score: float = 0.0) -> 'SearchHit':
+        return cls(
+            id=row.id,
+            score=score,
+            timestamp=row.timestamp,
+            location=row.location,
+            file_type=row.file_type,
+            caption=row.caption,
+            tags=row.tags or [],
+            latitude=row.latitude,
+            longitude=row.longitude,
         )
 
-        # Extract photo IDs from Pinecone results
-        photo_ids = []
-        for match in search_results.matches:
-            if match.score < threshold:
-                continue
-
-            # The vector ID should be the PostgreSQL photo ID (string)
-            try:
-                photo_id = int(match.id)  # Convert string ID back to integer
-                photo_ids.append(photo_id)
-            except ValueError:
-                # Log warning for invalid photo ID format
-                logger.warning(f"Invalid photo ID format in Pinecone: {match.id}")
-                continue
 
+# Columns a SearchHit is built from; everything except the image data
+HIT_COLUMNS = (
+    Photo.id, Photo.timestamp, Photo.location, Photo.file_type, Photo.caption, Photo.tags, Photo.latitude, Photo.longitude,
+)
+
+
+def get_photo_hits(photo_ids: List[int]) -> List[SearchHit]:
+    """SearchHits (score 0) for specific photos, in the order given."""
+    rows = {row.id: row for row in db.session.query(*HIT_COLUMNS).filter(Photo.id.in_(photo_ids))}
+    return [SearchHit.from_row(rows[photo_id]) for photo_id in photo_ids if photo_id in rows]
+
+
+def _rendition_data_url(data: str, file_type: str, size: Optional[int]) -> str:
+    if size is None:
+        return data_url(data, file_type)
+    image_bytes = prepare_image(decode_base64_payload(data), size)
+    return data_url(base64.b64encode(image_bytes).decode('utf-8'), prepared_file_type())
+
+
+@stage("images.load")
+def load_images(hits: List[SearchHit], rendition: str = "preview") -> List[SearchHit]:
+    """Load one rendition for every hit that doesn't have it yet, with a single query for the image data."""
+    if rendition not in IMAGE_RENDITIONS:
+        raise ValueError(f"Unknown image rendition '{rendition}'")
+    missing = {hit.id: hit for hit in hits if rendition not in hit.images}
+    if not missing:
+        return hits
+
+    rows = db.session.query(Photo.id, Photo.data, Photo.file_type).filter(Photo.id.in_(list(missing)))
+    for photo_id, data, file_type in rows:
+        try:
+            with stage("images.encode"):
+                missing[photo_id].images[rendition] = _rendition_data_url(data, file_type, IMAGE_RENDITIONS[rendition])
+        except Exception as e:
+            # Fall back to the stored image rather than dropping the photo
+            logger.warning(f"Could not create {rendition} rendition for photo ID {photo_id}: {e}")
+            missing[photo_id].images[rendition] = data_url(data, file_type)
+    return hits
+
+
+def search_photo_hits(
+    query: str,
+    threshold: float = 0.1,
+    top_k: int = 5,
+    filters: Optional[SearchFilters] = None,
+) -> List[SearchHit]:
+    """Search for photos using text query; returns scored hits in rank order without image data"""
+    try:
+        scored_ids = search_photo_ids(query, top_k, threshold, filters)
+        if not scored_ids:
+            return []
+
+        # Only the small columns; the base64 image data stays in the database
+        with stage("db.load_hits"):
+            rows = db.session.query(*HIT_COLUMNS).filter(Photo.id.in_([photo_id for photo_id, _ in scored_ids]))
+            by_id = {row.id: row for row in rows}
+
+        # Photos deleted since they were indexed are skipped
+        return [SearchHit.from_row(by_id[photo_id], score) for photo_id, score in scored_ids if photo_id in by_id]
+
+    except Exception as e:
+        logger.error(f"Error searching photos: {str(e)}")
+        raise Exception(f"Error searching photos: {str(e)}")
+
+
+def search_photos(
+    query: str,
+    threshold: float = 0.1,
+    top_k: int = 5,
+    filters: Optional[SearchFilters] = None,
+) -> List[Photo]:
+    """Search for photos using text query and return complete Photo objects from PostgreSQL, best match first"""
+    try:
+        photo_ids = [photo_id for photo_id, _ in search_photo_ids(query, top_k, threshold, filters)]
         if not photo_ids:
             return []
 
-        # Fetch Photo objects from PostgreSQL using the extracted IDs
-        photos = Photo.query.filter(Photo.id.in_(photo_ids)).all()
-        return photos
+        # Fetch Photo objects from PostgreSQL using the extracted IDs, then restore rank order
+        photos = {photo.id: photo for photo in Photo.query.filter(Photo.id.in_(photo_ids))}
+        return [photos[photo_id] for photo_id in photo_ids if photo_id in photos]
 
-        
     except Exception as e:
         logger.error(f"Error searching photos: {str(e)}")
         raise Exception(f"Error searching photos: {str(e)}")
 
 
+def photos_in_bbox(
+    min_lat: float, min_lon: float, max_lat: float, max_lon: float, limit: Optional[int] = 100,
+) -> List[SearchHit]:
+    """Photos inside a bbox (min_lon > max_lon wraps across the antimeridian), newest first."""
+    query = filter_bbox(db.session.query(*HIT_COLUMNS), min_lat, min_lon, max_lat, max_lon)
+    query = query.order_by(Photo.timestamp.desc(), Photo.id.desc())
+    if limit is not None:
+        query = query.limit(limit)
+    return [SearchHit.from_row(row) for row in query]
+
+
+def photos_within_radius(lat: float, lon: float, radius_km: float, limit: Optional[int] = 100) -> List[SearchHit]:
+    """Photos within radius_km of a point, nearest first, with distance_km set."""
+    min_lat, min_lon, max_lat, max_lon = radius_bbox(lat, lon, radius_km)
+    hits = []
+    # The bounding box comes from the index; the circle is checked exactly here
+    for row in filter_bbox(db.session.query(*HIT_COLUMNS), min_lat, min_lon, max_lat, max_lon):
+        distance = haversine_km(lat, lon, row.latitude, row.longitude)
+        if distance <= radius_km:
+            hit = SearchHit.from_row(row)
+            hit.distance_km = distance
+            hits.append(hit)
+    hits.sort(key=lambda hit: (hit.distance_km, hit.id))
+    return hits if limit is None else hits[:limit]
+
+
+def nearest_photos(lat: float, lon: float, k: int = 10, max_radius_km: float = MAX_DISTANCE_KM) -> List[SearchHit]:
+    """
+    The k photos nearest to a point (within max_radius_km), nearest first.
+
+    Searches a small radius first and widens it until k photos are inside, so dense
+    areas cost one small index scan and sparse ones a few.
+    """
+    radius_km = min(NEAREST_START_RADIUS_KM, max_radius_km)
+    while True:
+        hits = photos_within_radius(lat, lon, radius_km, limit=None)
+        if len(hits) >= k or radius_km >= max_radius_km:
+            return hits[:k]
+        radius_km = min(radius_km * 4, max_radius_km)
+
+
 def get_vector_count_in_namespace():
     """Get the count of vectors in the PHOTOS_NAMESPACE in Pinecone index."""
     try:
-        index = pc.Index(PHOTOS_INDEX_NAME)
+        index = get_vector_index()
         
         # Get current vector count
         index_stats = index.describe_index_stats()
@@ -279,14 +876,25 @@ def get_vector_count_in_namespace():
 
 
 def delete_all_vectors_from_namespace():
-    """Delete all vectors from the PHOTOS_NAMESPACE in Pinecone index."""
+    """Delete all vectors from the PHOTOS_NAMESPACE (and the secondary LOCATION_NAMESPACE) in Pinecone index."""
     try:
-        index = pc.Index(PHOTOS_INDEX_NAME)
+        index = get_vector_index()
         
         # Delete all vectors in the namespace
         index.delete(delete_all=True, namespace=PHOTOS_NAMESPACE)
         logger.info(f"Successfully deleted all vectors from namespace '{PHOTOS_NAMESPACE}'")
         
+        # The location namespace may not exist yet; failing to clear it is not fatal
+        try:
+            index.delete(delete_all=True, namespace=LOCATION_NAMESPACE)
+            logger.info(f"Successfully deleted all vectors from namespace '{LOCATION_NAMESPACE}'")
+        except Exception as e:
+            logger.warning(f"Could not delete vectors from namespace '{LOCATION_NAMESPACE}': {str(e)}")
+        
+        if COARSE_SEARCH or get_coarse_vector_index.is_initialized():
+            get_coarse_vector_index().delete(delete_all=True, namespace=PHOTOS_NAMESPACE)
+            logger.info("Successfully deleted all coarse vectors")
+        
         return True, "Success"
         
     except Exception as e:
@@ -5,104 +5,81 @@ from main import create_app
 import base64
 from datetime import datetime
 from models import Photo
-from geopy.geocoders import Nominatim
+from database import db
 
-from PIL.ExifTags import GPSTAGS
-from PIL.ExifTags import TAGS
 from PIL import Image as PILImage
-from io import BytesIO
 import os
 from pathlib import Path
 from typing import List, Optional
 import argparse
+from contextlib import nullcontext
 from tqdm import tqdm
-import vertexai
-from vertexai.vision_models import Image as VertexImage, MultiModalEmbeddingModel
-from pinecone import Pinecone
-from constants import LOCATION_NAMESPACE, PHOTOS_INDEX_NAME, PHOTOS_NAMESPACE, VECTOR_DIMENSION
+from clients import get_embedding_client, get_geocoder, get_vector_index
+from image_prep import EMBED_IMAGE_SIZE, exif_gps_coords, exif_timestamp, prepare_image, prepared_file_type
+from photo_service import (
+    PHOTO_EXTENSIONS,
+    backfill_coarse_embeddings,
+    backfill_coordinates,
+    caption_text,
+    embed_photos,
+    embedding_kinds,
+    photo_vector_metadata,
+    sync_vector_metadata,
+)
+from search_cache import invalidate_search_cache
+from captioning import CAPTION_ON_UPLOAD, caption_pending_photos
+from events import rebuild_event_index, update_event_index
+from vector_outbox import drain_outbox, enqueue_vector_writes, outbox_row, revive_dead_letters
+from ingest_pool import INGEST_WORKERS, PreparedPhoto, make_ingest_pool, preprocess_path, preprocess_paths
+from constants import COARSE_VECTOR_DIMENSION, PHOTOS_NAMESPACE, VECTOR_DIMENSION
+
+
+# Number of photos written to the database per multi-row INSERT
+UPLOAD_BATCH_SIZE = 32
 
 
-vertexai.init(project=os.getenv("GCP_PROJECT_ID"), location="us-central1")
-model = MultiModalEmbeddingModel.from_pretrained("multimodalembedding@001")
-pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
-
 
 def find_photos_in_dir(dir: str) -> List[str]:
     photo_files = []
     for root, _, files in os.walk(dir):
         for file in files:
-            if file.lower().endswith("png"):
+            if file.lower().endswith(PHOTO_EXTENSIONS):
                 photo_files.append(str((Path(root) / file).absolute()))
     return photo_files
 
 
 def get_resized_image_bytes(path: str) -> bytes:
     """Resize image to 512x512 regardless of aspect ratio and return as bytes."""
-    with PILImage.open(path) as img:
-        # Resize to fixed 512x512 size
-        resized_img = img.resize((512, 512), PILImage.Resampling.LANCZOS)
-
-        # Convert to bytes
-        img_byte_arr = BytesIO()
-        resized_img.save(img_byte_arr, format=img.format)
-        return img_byte_arr.getvalue()
+    return prepare_image(path, EMBED_IMAGE_SIZE)
 
 
-def gen_image_embedding(image: bytes):
+def gen_image_embedding(image: bytes, dimension: int = VECTOR_DIMENSION):
+    from vertexai.vision_models import Image as VertexImage
     image = VertexImage(image_bytes=image)
-    embeddings = model.get_embeddings(
+    embeddings = get_embedding_client().get_embeddings(
         image=image,
-        dimension=VECTOR_DIMENSION,
+        dimension=dimension,
     )
     return embeddings.image_embedding
 
 
 def get_gps_coords_from_image(path: str) -> Optional[tuple[float, float]]:
     try:
-        
         with PILImage.open(path) as img:
-            # Get EXIF data
-            exif = img._getexif()
-            if not exif:
-                return None
-                
-            # Get GPS info
-            for tag_id in exif:
-                tag = TAGS.get(tag_id, tag_id)
-                if tag == "GPSInfo":
-                    gps_data = {}
-                    for gps_tag in exif[tag_id]:
-                        gps_data[GPSTAGS.get(gps_tag, gps_tag)] = exif[tag_id][gps_tag]
-                    
-                    if "GPSLatitude" in gps_data and "GPSLongitude" in gps_data:
-                        # Get direction indicators
-                        lat_ref = gps_data.get("GPSLatitudeRef", "N")
-                        lon_ref = gps_data.get("GPSLongitudeRef", "E")
-                        
-                        # Calculate decimal degrees
-                        latitude = gps_data["GPSLatitude"][0] + gps_data["GPSLatitude"][1] / 60.0 + gps_data["GPSLatitude"][2] / 3600.0
-                        longitude = gps_data["GPSLongitude"][0] + gps_data["GPSLongitude"][1] / 60.0 + gps_data["GPSLongitude"][2] / 3600.0
-                        
-                        # Apply direction
-                        if lat_ref == "S":
-                            latitude = -latitude
-                        if lon_ref == "W":
-                            longitude = -longitude
-                            
-                        return (latitude, longitude)
-            
-            return None
+            return exif_gps_coords(img._getexif())
     except:
         return None
     
 
 
 def get_image_location(path: str) -> Optional[str]:
-    gps_coords = get_gps_coords_from_image(path)
+    return get_location_from_coords(get_gps_coords_from_image(path))
+
+
+def get_location_from_coords(gps_coords: Optional[tuple[float, float]]) -> Optional[str]:
     if not gps_coords:
         return None
-    geolocator = Nominatim(user_agent="abhi-agent")
-    location = geolocator.reverse(f"{gps_coords[0]}, {gps_coords[1]}")
+    location = get_geocoder().reverse(f"{gps_coords[0]}, {gps_coords[1]}")
     if not location:
         return None
     return location.address
@@ -111,46 +88,33 @@ def get_image_timestamp(path: str) -> Optional[datetime]:
     """Extract timestamp from image EXIF data"""
     try:
         with PILImage.open(path) as img:
-            # Get EXIF data
-            exif = img._getexif()
-            if not exif:
-                return None
-                
-            # Look for DateTimeOriginal or DateTime tags
-            for tag_id in exif:
-                tag = TAGS.get(tag_id, tag_id)
-                if tag in ["DateTimeOriginal", "DateTime"]:
-                    # EXIF datetime format: "YYYY:MM:DD HH:MM:SS"
-                    date_str = exif[tag_id]
-                    return datetime.strptime(date_str, "%Y:%m:%d %H:%M:%S")
-                    
-            return None
+            return exif_timestamp(img._getexif())
     except:
         return None
 
 
 def gen_text_embedding(text: str) -> list[float]:
-    embeddings = model.get_embeddings(
+    embeddings = get_embedding_client().get_embeddings(
         contextual_text=text,
         dimension=VECTOR_DIMENSION,
     )
     return embeddings.text_embedding
 
 def exists_in_index(id: int, type: str) -> bool:
-    index = pc.Index(PHOTOS_INDEX_NAME)
+    index = get_vector_index()
     return bool(index.fetch(
         ids=[f"{type}:{id}"], namespace=PHOTOS_NAMESPACE
     ).vectors)
 
 
-def update_index(id: int, embedding: list[float], namespace: str):
-    index = pc.Index(PHOTOS_INDEX_NAME)
+def update_index(id: int, embedding: list[float], namespace: str, metadata: Optional[dict] = None):
+    index = get_vector_index()
     index.upsert(
         vectors=[
             {
                 "id": str(id),
                 "values": embedding,
-                "metadata": {
+                "metadata": metadata or {
                 },
             },
         ],
@@ -164,46 +128,121 @@ def gen_caption_embedding(path: str) -> Optional[list[float]]:
         return None
     return gen_text_embedding(location)
 
-def upload_photos(dir: str):
-    for path in tqdm(find_photos_in_dir(dir), desc="Processing photos"):
-        try:
-            # First check to see if the image  is already in the database
-            photo = Photo.query.filter_by(path=path).first()
-            if photo:
+def find_new_photos(paths: List[str], chunk_size: int = 1000) -> List[str]:
+    """Drop paths that are already in the database, one lookup per chunk of paths."""
+    new_paths = []
+    for start in range(0, len(paths), chunk_size):
+        chunk = paths[start:start + chunk_size]
+        existing = {
+            path for (path,) in Photo.query.with_entities(Photo.path).filter(Photo.path.in_(chunk))
+        }
+        for path in chunk:
+            if path in existing:
                 print(f"Photo {path} already exists in the database")
-                continue
-        
-
-            # Convert resized bytes to base64
-            image_bytes = get_resized_image_bytes(path)
-            photo_data = base64.b64encode(image_bytes).decode('utf-8')
-            file_type = path.split('.')[-1].lower()
-
-
-            # Resize image and get location
-            location = get_image_location(path)
-            timestamp = get_image_timestamp(path)
-            photo_row = Photo.create_photo(
-                data=photo_data,
-                file_type=file_type,
-                path=path,
-                location=location,
-                timestamp=timestamp
-            )
+            else:
+                new_paths.append(path)
+    return new_paths
+
+
+def upload_photo_batch(prepared_photos: List[PreparedPhoto], seen_hashes: set):
+    """Insert a batch of preprocessed photos with one INSERT and index their embeddings."""
+    rows = []
+    images = []
+    coords = []
+    for prepared in prepared_photos:
+        if prepared.error:
+            print(f"Error processing photo {prepared.source}: {prepared.error}")
+            continue
+        if prepared.sha256 in seen_hashes:
+            print(f"Photo {prepared.source} is a duplicate of an already uploaded photo")
+            continue
+        seen_hashes.add(prepared.sha256)
 
-            image_embedding = gen_image_embedding(image_bytes)
-            update_index(id=photo_row.id, embedding=image_embedding, namespace=PHOTOS_NAMESPACE)
+        try:
+            rows.append({
+                "data": base64.b64encode(prepared.image_bytes).decode('utf-8'),
+                "file_type": prepared_file_type(),
+                "path": prepared.source,
+                "location": get_location_from_coords(prepared.gps_coords),
+                "timestamp": prepared.timestamp,
+                **Photo.coordinate_columns(prepared.gps_coords),
+            })
+            images.append(prepared.image_bytes)
+            coords.append(prepared.gps_coords)
         except Exception as e:
-            print(f"Error processing photo {path}: {e}")
+            print(f"Error processing photo {prepared.source}: {e}")
             continue
 
+    if not rows:
+        return
+
+    # Embed before the INSERT so the transaction only covers the insert and the outbox rows
+    captions = [caption_text(row["location"]) for row in rows]
+    embedded = embed_photos(images, captions)
+
+    photo_ids, errors = Photo.bulk_create(rows)
+
+    # Vector writes go into the outbox in the photos' transaction, so a failed upsert is retried
+    # instead of leaving photos that find_new_photos skips but search never returns
+    outbox_rows = []
+    for row, caption, gps_coords, (embeddings, embed_error), photo_id, error in zip(
+        rows, captions, coords, embedded, photo_ids, errors
+    ):
+        if error:
+            print(f"Error processing photo {row['path']}: {error}")
+            continue
+        if embed_error:
+            # The drainer computes the missing embeddings from the stored photo
+            print(f"Error embedding photo {row['path']}, retrying from the outbox: {embed_error}")
+        metadata = photo_vector_metadata(photo_id, row["timestamp"], row["location"], gps_coords)
+        outbox_rows.extend(outbox_row(photo_id, kind, embeddings.get(kind), metadata) for kind in embedding_kinds(caption))
+
+    enqueue_vector_writes(outbox_rows)
+    db.session.commit()
+
+    # One batched upsert per namespace; failures stay queued with backoff
+    delivered, failed = drain_all_outbox(revive=False)
+    if failed:
+        print(f"{failed} vectors could not be stored yet; run --drain-outbox or let the server retry them")
+
+    # Tell every process on this host (including the API server) that search results changed
+    invalidate_search_cache()
+
+
+def upload_photos(dir: str, batch_size: int = UPLOAD_BATCH_SIZE, workers: int = INGEST_WORKERS):
+    paths = find_new_photos(find_photos_in_dir(dir))
+    seen_hashes = set()
+    batch = []
+
+    # Decode/EXIF/resize/hash run in worker processes while this process geocodes, inserts and embeds
+    pool = make_ingest_pool(workers) if workers > 1 else nullcontext()
+    with pool, tqdm(total=len(paths), desc="Processing photos") as progress:
+        # Without a pool of its own the script works inline rather than start the API's shared pool
+        prepared_photos = preprocess_paths(paths, pool=pool, workers=workers) if workers > 1 else map(preprocess_path, paths)
+        for prepared in prepared_photos:
+            batch.append(prepared)
+            if len(batch) < batch_size:
+                continue
+            upload_photo_batch(batch, seen_hashes)
+            progress.update(len(batch))
+            batch = []
+            stats = get_embedding_client().stats()
+            progress.set_postfix(
+                embeds_per_s=f"{stats['throughput_per_second']:.1f}",
+                concurrency=stats["concurrency_limit"],
+                throttled=stats["throttled"],
+            )
+        if batch:
+            upload_photo_batch(batch, seen_hashes)
+            progress.update(len(batch))
+
 
 def find_photos(query: str):
     # Generate embedding for search query
     query_embedding = gen_text_embedding(query)
 
     # Search pinecone index
-    index = pc.Index(PHOTOS_INDEX_NAME)
+    index = get_vector_index()
     search_results = index.query(
         vector=query_embedding, top_k=20, namespace=PHOTOS_NAMESPACE
     )
@@ -216,6 +255,21 @@ def find_photos(query: str):
     return matches
 
 
+def drain_all_outbox(revive: bool = True) -> tuple[int, int]:
+    """Deliver every due outbox row (and dead letters, with `revive`); rows that fail again wait for the server's retries."""
+    if revive:
+        revived = revive_dead_letters()
+        if revived:
+            print(f"Retrying {revived} vectors that had run out of attempts")
+    delivered = failed = 0
+    while True:
+        batch_delivered, batch_failed = drain_outbox()
+        delivered += batch_delivered
+        failed += batch_failed
+        if not batch_delivered and not batch_failed:
+            return delivered, failed
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Process and store photos in vector database"
@@ -224,6 +278,42 @@ def main():
         "--upload", type=str, help="Directory containing photos to process"
     )
     parser.add_argument("--find", type=str, help="Search query to find matching photos")
+    parser.add_argument(
+        "--batch-size", type=int, default=UPLOAD_BATCH_SIZE, help="Photos inserted per database round trip"
+    )
+    parser.add_argument(
+        "--sync-metadata",
+        action="store_true",
+        help="Copy timestamp/location onto vectors indexed before search filters existed",
+    )
+    parser.add_argument(
+        "--caption",
+        action="store_true",
+        help="Caption photos that have no caption yet",
+    )
+    parser.add_argument(
+        "--backfill-coarse",
+        action="store_true",
+        help=f"Store {COARSE_VECTOR_DIMENSION}-d embeddings for photos indexed before coarse-to-fine search was enabled",
+    )
+    parser.add_argument(
+        "--backfill-coordinates",
+        action="store_true",
+        help="Read GPS coordinates from the original files of photos that have none stored",
+    )
+    parser.add_argument(
+        "--rebuild-events",
+        action="store_true",
+        help="Regroup every photo into trips/events (after changing EVENT_GAP_HOURS or backfilling coordinates)",
+    )
+    parser.add_argument(
+        "--drain-outbox",
+        action="store_true",
+        help="Deliver queued vector writes now, including ones that ran out of retries",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=INGEST_WORKERS, help="Processes used to decode and resize photos"
+    )
 
     args = parser.parse_args()
 
@@ -231,9 +321,25 @@ def main():
     with app.app_context():
         try:
             if args.upload:
-                upload_photos(args.upload)
+                upload_photos(args.upload, batch_size=args.batch_size, workers=args.workers)
+                print(f"Added {update_event_index()} photos to the event index")
+                if CAPTION_ON_UPLOAD:
+                    print(f"Captioned {caption_pending_photos()} photos")
             elif args.find:
                 print(find_photos(args.find))
+            elif args.sync_metadata:
+                print(f"Updated metadata for {sync_vector_metadata()} vectors")
+            elif args.caption:
+                print(f"Captioned {caption_pending_photos()} photos")
+            elif args.backfill_coarse:
+                print(f"Stored {backfill_coarse_embeddings()} coarse vectors")
+            elif args.backfill_coordinates:
+                print(f"Filled in coordinates for {backfill_coordinates()} photos")
+            elif args.rebuild_events:
+                print(f"Grouped {rebuild_event_index()} photos into events")
+            elif args.drain_outbox:
+                delivered, failed = drain_all_outbox()
+                print(f"Delivered {delivered} queued vectors, {failed} failed")
         except Exception as e:
             print(f"Error: {e}")
 
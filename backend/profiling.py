@@ -0,0 +1,247 @@
+"""
+On-demand per-request profiling for the live API.
+
+Off until switched on through POST /admin/profiling. While on, a PROFILE_SAMPLE_RATE
+fraction of requests (optionally only some endpoints) is profiled. The settings live
+in PROFILE_DIR/settings.json, so a change made through one gunicorn worker applies to
+all of them; each request checks the file with one os.stat(). A request with
+an X-Profile: 1 header and a valid admin token is always profiled. Each profiled
+request leaves one artifact in PROFILE_DIR:
+
+- mode "sample" (default): a sampler thread records the request thread's stack
+  every PROFILE_INTERVAL_MS and writes collapsed stacks (`frame;frame;frame count`
+  lines, *.folded), ready for flamegraph.pl or speedscope. The cost is small and
+  does not depend on how many functions run.
+- mode "cprofile": cProfile for the request, written as *.pstats (snakeviz,
+  `python -m pstats`, gprof2dot). Exact call counts, but it slows the request down,
+  and only one cProfile can run per process: requests picked while one is running
+  are not profiled.
+
+Only the request thread is profiled; work it hands to thread pools shows up as
+time waiting on futures.
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import tempfile
+import threading
+import cProfile
+from collections import Counter
+from datetime import datetime, timezone
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "lyfe-profiles"))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0.01"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+# Oldest artifacts are deleted beyond this many
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))
+
+PROFILE_MODES = ("sample", "cprofile")
+
+# Written by configure(), read by every server process
+PROFILE_SETTINGS_FILE = os.path.join(PROFILE_DIR, "settings.json")
+
+_settings_lock = threading.Lock()
+# Held while a cProfile runs (Python allows one active profiler)
+_cprofile_lock = threading.Lock()
+DEFAULT_SETTINGS = {
+    "enabled": False,
+    "sample_rate": PROFILE_SAMPLE_RATE,
+    "mode": "sample",
+    # None: every endpoint
+    "endpoints": None,
+}
+# (file identity, settings) of the last read
+_cached = (None, dict(DEFAULT_SETTINGS))
+
+
+def _file_identity():
+    try:
+        stat = os.stat(PROFILE_SETTINGS_FILE)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def get_settings() -> dict:
+    """The live settings, re-read when another process has changed them."""
+    global _cached
+    identity = _file_identity()
+    with _settings_lock:
+        if identity != _cached[0]:
+            settings = dict(DEFAULT_SETTINGS)
+            if identity is not None:
+                try:
+                    with open(PROFILE_SETTINGS_FILE) as f:
+                        settings.update(json.load(f))
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Could not read profiling settings {PROFILE_SETTINGS_FILE}: {e}")
+            _cached = (identity, settings)
+        return dict(_cached[1])
+
+
+def configure(enabled: Optional[bool] = None, sample_rate: Optional[float] = None, mode: Optional[str] = None,
+              endpoints: Optional[List[str]] = None, all_endpoints: bool = False) -> dict:
+    """Change the live profiling settings of every server process; returns them. Raises ValueError for bad values."""
+    if sample_rate is not None and not 0.0 <= sample_rate <= 1.0:
+        raise ValueError("sample_rate must be between 0 and 1")
+    if mode is not None and mode not in PROFILE_MODES:
+        raise ValueError(f"mode must be one of {', '.join(PROFILE_MODES)}")
+    settings = get_settings()
+    if enabled is not None:
+        settings["enabled"] = bool(enabled)
+    if sample_rate is not None:
+        settings["sample_rate"] = sample_rate
+    if mode is not None:
+        settings["mode"] = mode
+    if all_endpoints:
+        settings["endpoints"] = None
+    elif endpoints is not None:
+        settings["endpoints"] = list(endpoints)
+    # Replace the file so other processes never read it half written
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    tmp_path = f"{PROFILE_SETTINGS_FILE}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(settings, f)
+    os.replace(tmp_path, PROFILE_SETTINGS_FILE)
+    logger.info(f"Profiling settings: {settings}")
+    return get_settings()
+
+
+class StackSampler:
+    """Samples one thread's stack on a background thread and counts the collapsed stacks."""
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(names))] += 1
+            self.samples += 1
+
+    def write(self, path: str):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class RequestProfile:
+    """Profiler of one request, from start_request_profile to finish()."""
+
+    def __init__(self, endpoint: str, mode: str, label: Optional[str] = None):
+        self.endpoint = endpoint
+        self.mode = mode
+        self.label = label
+        self.started = time.perf_counter()
+        if mode == "cprofile":
+            self._profiler = cProfile.Profile()
+            try:
+                self._profiler.enable()
+            except ValueError:
+                # Another profiler (e.g. a debugger) is active
+                _cprofile_lock.release()
+                raise
+        else:
+            self._profiler = StackSampler(threading.get_ident(), PROFILE_INTERVAL_MS / 1000)
+            self._profiler.start()
+
+    def finish(self) -> Optional[str]:
+        """Stop profiling and write the artifact. Returns its file name."""
+        duration_ms = (time.perf_counter() - self.started) * 1000
+        if self.mode == "cprofile":
+            self._profiler.disable()
+            _cprofile_lock.release()
+        else:
+            self._profiler.stop()
+            if not self._profiler.samples:
+                # Shorter than one sampling interval
+                return None
+
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+        suffix = "pstats" if self.mode == "cprofile" else "folded"
+        name = f"{stamp}-{self.endpoint}-{int(duration_ms)}ms{'-' + self.label if self.label else ''}.{suffix}"
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            path = os.path.join(PROFILE_DIR, name)
+            if self.mode == "cprofile":
+                self._profiler.dump_stats(path)
+            else:
+                self._profiler.write(path)
+            _prune()
+        except OSError as e:
+            logger.warning(f"Could not write profile {name}: {e}")
+            return None
+        return name
+
+
+def start_request_profile(endpoint: str, forced: bool = False, label: Optional[str] = None) -> Optional[RequestProfile]:
+    """Profile this request if it is forced or sampled under the live settings; None otherwise."""
+    settings = get_settings()
+    if not forced:
+        if not settings["enabled"]:
+            return None
+        if settings["endpoints"] is not None and endpoint not in settings["endpoints"]:
+            return None
+        if random.random() >= settings["sample_rate"]:
+            return None
+    if settings["mode"] == "cprofile" and not _cprofile_lock.acquire(blocking=False):
+        return None
+    try:
+        return RequestProfile(endpoint, settings["mode"], label)
+    except ValueError as e:
+        logger.warning(f"Could not profile {endpoint}: {e}")
+        return None
+
+
+def list_profiles() -> List[dict]:
+    """Artifacts in PROFILE_DIR, newest first."""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = []
+    for name in os.listdir(PROFILE_DIR):
+        if name.endswith((".folded", ".pstats")):
+            stat = os.stat(os.path.join(PROFILE_DIR, name))
+            profiles.append({"name": name, "bytes": stat.st_size, "created": datetime.fromtimestamp(stat.st_mtime, timezone.utc).isoformat()})
+    return sorted(profiles, key=lambda profile: profile["name"], reverse=True)
+
+
+def profile_path(name: str) -> Optional[str]:
+    """Path of an artifact by file name, or None if there is no such artifact."""
+    if os.path.basename(name) != name or not name.endswith((".folded", ".pstats")):
+        return None
+    path = os.path.join(PROFILE_DIR, name)
+    return path if os.path.isfile(path) else None
+
+
+def _prune():
+    profiles = list_profiles()
+    for profile in profiles[PROFILE_MAX_FILES:]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, profile["name"]))
+        except OSError:
+            pass
@@ -1,23 +1,194 @@
-from flask import request, jsonify
+from flask import Response, current_app, g, request, jsonify, send_file
 import os
 import base64
+import hmac
+import time
+from functools import wraps
 from datetime import datetime
-from photo_service import search_photos, gen_image_embedding_from_base64, update_index_with_photo_id, exists_in_index_by_photo_id, get_vector_count_in_namespace, delete_all_vectors_from_namespace
-from models import Photo
+from clients import get_embedding_client
+from photo_service import search_photos, caption_text, embed_photos, embedding_kinds, photo_vector_metadata, get_vector_count_in_namespace, delete_all_vectors_from_namespace
+from models import Photo, VectorOutbox
 from database import db
+from image_prep import decode_base64_payload, detect_image_type
+from ingest_pool import preprocess_payloads
+from search_cache import invalidate_search_cache
 from chat import run_chat, Message, TextInput
+from captioning import CAPTION_ON_UPLOAD, request_captioning
+from bulk_delete import delete_photos, filter_from_dict
+from vector_outbox import enqueue_vector_writes, outbox_row, request_outbox_drain
+from events import clear_event_index, day_counts, find_events, place_counts, request_event_indexing
+from metrics import HTTP_REQUEST_SECONDS, REGISTRY, Counter, stage
+from tracing import finish_trace, get_trace, recent_traces, start_trace
+from profiling import PROFILE_MODES, configure as configure_profiling, get_settings as get_profiling_settings, list_profiles, profile_path, start_request_profile
 import logging
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Shared secret for the /admin endpoints, sent as the X-Admin-Token header; unset disables them
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# Endpoints that are not traced or profiled themselves
+UNTRACED_ENDPOINTS = {'metrics', 'admin_traces', 'admin_trace', 'admin_profiling', 'admin_profiles', 'admin_profile'}
+
+UPLOADED_PHOTOS = Counter("lyfe_uploaded_photos", "Photos received by /upload_photos by outcome", ("outcome",))
+
 
 def health_check():
     """Health check endpoint"""
     return jsonify({"status": "healthy", "service": "lyfe-backend"})
 
 
+def embedding_stats_endpoint():
+    """Live throughput and throttling stats for the shared embedding client"""
+    return jsonify({"success": True, "stats": get_embedding_client().stats()})
+
+
+def metrics_endpoint():
+    """Stage timings, counters, cache hit ratios and queue depths in the Prometheus text format"""
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
+def _is_admin() -> bool:
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN)
+
+
+def admin_required(view):
+    """Only serve the view to requests carrying X-Admin-Token: ADMIN_TOKEN"""
+    @wraps(view)
+    def guarded(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            return jsonify({"error": "Admin endpoints are disabled; set ADMIN_TOKEN"}), 403
+        if not _is_admin():
+            return jsonify({"error": "Invalid admin token"}), 403
+        return view(*args, **kwargs)
+    return guarded
+
+
+def _start_request():
+    g.request_started = time.perf_counter()
+    if request.endpoint not in UNTRACED_ENDPOINTS:
+        # X-Trace: 1 traces this request whatever the sample rate, but only for admins
+        g.trace = start_trace(
+            request.endpoint or "unknown", force=request.headers.get('X-Trace') == '1' and _is_admin(),
+            method=request.method, path=request.path,
+        )
+        # X-Profile: 1 profiles this request, but only for admins: profiling slows it down
+        trace = g.get('trace')
+        g.profile = start_request_profile(
+            request.endpoint or "unknown", forced=request.headers.get('X-Profile') == '1' and _is_admin(),
+            label=trace[0].id if trace is not None else None,
+        )
+
+
+def _record_request(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        HTTP_REQUEST_SECONDS.labels(
+            request.endpoint or "unknown", request.method, response.status_code
+        ).observe(time.perf_counter() - started)
+    trace = g.get('trace')
+    if trace is not None:
+        response.headers['X-Trace-Id'] = trace[0].id
+        g.response_status = response.status_code
+    profile = g.pop('profile', None)
+    if profile is not None:
+        name = profile.finish()
+        if name:
+            response.headers['X-Profile-Name'] = name
+    return response
+
+
+def _finish_request(error):
+    # Requests that failed before after_request ran
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profile.finish()
+    finish_trace(
+        g.pop('trace', None),
+        error=f"{type(error).__name__}: {error}" if error else None,
+        status=g.get('response_status'),
+    )
+
+
+@admin_required
+def admin_traces_endpoint():
+    """
+    Recent request traces, newest first.
+    Query parameters: name (endpoint, e.g. chat), min_ms, limit
+    """
+    limit = request.args.get('limit', 50, type=int)
+    min_ms = request.args.get('min_ms', 0.0, type=float)
+    traces = recent_traces(request.args.get('name'), min_ms, limit)
+    summaries = []
+    for trace in traces:
+        totals = trace["totals"]
+        summaries.append({
+            **{key: value for key, value in trace.items() if key not in ("totals", "root")},
+            "llm_calls": totals["llm_calls"],
+            "input_tokens": totals["input_tokens"],
+            "output_tokens": totals["output_tokens"],
+        })
+    return jsonify({"success": True, "traces": summaries})
+
+
+@admin_required
+def admin_trace_endpoint(trace_id):
+    """One trace with its span tree and per-span-name totals"""
+    trace = get_trace(trace_id)
+    if trace is None:
+        return jsonify({"error": f"Trace {trace_id} not found (it may have left the buffer)"}), 404
+    return jsonify({"success": True, "trace": trace})
+
+
+@admin_required
+def admin_profiling_endpoint():
+    """
+    GET: the live profiling settings.
+    POST {"enabled": true, "sample_rate": 0.05, "mode": "sample" | "cprofile", "endpoints": ["chat"] | null}
+    switches sampled profiling on or off; omitted fields are left as they are.
+    """
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        endpoints = data.get('endpoints')
+        if endpoints is not None and (not isinstance(endpoints, list) or not all(isinstance(e, str) for e in endpoints)):
+            return jsonify({"error": "endpoints must be a list of endpoint names or null"}), 400
+        try:
+            sample_rate = float(data['sample_rate']) if data.get('sample_rate') is not None else None
+            settings = configure_profiling(
+                enabled=data.get('enabled'),
+                sample_rate=sample_rate,
+                mode=data.get('mode'),
+                endpoints=endpoints,
+                all_endpoints='endpoints' in data and endpoints is None,
+            )
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
+        except OSError as e:
+            return jsonify({"error": f"Could not save profiling settings: {e}"}), 500
+    else:
+        settings = get_profiling_settings()
+    return jsonify({"success": True, "settings": settings, "modes": list(PROFILE_MODES)})
+
+
+@admin_required
+def admin_profiles_endpoint():
+    """Profile artifacts written so far, newest first. Query parameters: limit"""
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify({"success": True, "profiles": list_profiles()[:limit]})
+
+
+@admin_required
+def admin_profile_endpoint(name):
+    """Download one artifact: collapsed stacks (*.folded) or cProfile stats (*.pstats)"""
+    path = profile_path(name)
+    if path is None:
+        return jsonify({"error": f"Profile {name} not found"}), 404
+    mimetype = "text/plain" if name.endswith(".folded") else "application/octet-stream"
+    return send_file(path, mimetype=mimetype, as_attachment=True, download_name=name)
+
+
 def upload_photos_batch():
     """
     Upload a batch of photos to the database
@@ -26,7 +197,8 @@ def upload_photos_batch():
             {
                 "data": "base64_encoded_image_data",
                 "location": "location_string",
-                "timestamp": "2024-01-01T12:00:00Z"
+                "timestamp": "2024-01-01T12:00:00Z",
+                "path": "optional/original/path.jpg"
             }
         ]
     }
@@ -47,100 +219,132 @@ def upload_photos_batch():
         errors = []
         vector_processing_errors = []
         
+        # Validate the whole batch before touching the database
+        pending = []
         for i, photo_data in enumerate(photos):
-            try:
-                # Validate required fields
-                if not isinstance(photo_data, dict):
-                    errors.append(f"Photo {i}: Must be an object")
-                    continue
-                
-                if 'data' not in photo_data:
-                    errors.append(f"Photo {i}: Missing 'data' field")
-                    continue
-                
-                if 'location' not in photo_data:
-                    errors.append(f"Photo {i}: Missing 'location' field")
-                    continue
-                    
-                if 'timestamp' not in photo_data:
-                    errors.append(f"Photo {i}: Missing 'timestamp' field")
-                    continue
-                
-                base64_data = photo_data['data']
-                location = photo_data['location']
-                timestamp_str = photo_data['timestamp']
-                
-                # Parse timestamp
-                try:
-                    timestamp = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
-                except ValueError:
-                    errors.append(f"Photo {i}: Invalid timestamp format. Use ISO format (e.g., '2024-01-01T12:00:00Z')")
-                    continue
-                
-                # Detect file type from base64 data
-                file_type = detect_file_type(base64_data)
-                if not file_type:
-                    errors.append(f"Photo {i}: Unable to detect file type from base64 data")
-                    continue
-                
-                # Create photo record in PostgreSQL first
-                photo = Photo(
-                    data=base64_data,
-                    file_type=file_type,
-                    location=location,
-                    created_at=timestamp,
-                    updated_at=timestamp
-                )
-                
-                db.session.add(photo)
-                db.session.flush()  # Flush to get the photo ID without committing
-                
-                # Now we have the photo ID, attempt vector processing
-                try:
-                    # Check if vector already exists for this photo ID
-                    if not exists_in_index_by_photo_id(str(photo.id)):
-                        # Generate embedding from base64 data
-                        image_embedding = gen_image_embedding_from_base64(base64_data)
-                        logger.info(f"Successfully generated embedding for photo ID {photo.id}")
-                        
-                        # Store vector in Pinecone using photo ID
-                        update_index_with_photo_id(
-                            photo_id=str(photo.id), 
-                            embedding=image_embedding
-                        )
-                        logger.info(f"Successfully stored vector in Pinecone for photo ID {photo.id}")
-                    else:
-                        logger.info(f"Vector already exists in Pinecone for photo ID {photo.id}, skipping")
-                    
-                except Exception as vector_error:
-                    # Log vector processing error but don't fail the photo upload
-                    error_msg = f"Photo {i} (ID: {photo.id}): Vector processing failed - {str(vector_error)}"
-                    vector_processing_errors.append(error_msg)
-                    logger.error(error_msg)
-                
-                created_photos.append({
-                    'index': i,
-                    'id': photo.id,
-                    'location': location,
-                    'timestamp': timestamp_str,
-                    'file_type': file_type
-                })
+            # Validate required fields
+            if not isinstance(photo_data, dict):
+                errors.append(f"Photo {i}: Must be an object")
+                continue
+            
+            if 'data' not in photo_data:
+                errors.append(f"Photo {i}: Missing 'data' field")
+                continue
+            
+            if 'location' not in photo_data:
+                errors.append(f"Photo {i}: Missing 'location' field")
+                continue
                 
-            except Exception as e:
-                errors.append(f"Photo {i}: {str(e)}")
-                db.session.rollback()
+            if 'timestamp' not in photo_data:
+                errors.append(f"Photo {i}: Missing 'timestamp' field")
                 continue
-        
-        # Commit all successful photos
+            
+            base64_data = photo_data['data']
+            location = photo_data['location']
+            timestamp_str = photo_data['timestamp']
+            
+            # Parse timestamp
+            try:
+                timestamp = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
+            except (ValueError, AttributeError):
+                errors.append(f"Photo {i}: Invalid timestamp format. Use ISO format (e.g., '2024-01-01T12:00:00Z')")
+                continue
+            
+            # Decode once; the raw bytes are shared by type detection and embedding
+            try:
+                with stage("upload.decode"):
+                    image_bytes = decode_base64_payload(base64_data)
+            except (ValueError, TypeError, AttributeError):
+                errors.append(f"Photo {i}: Invalid base64 image data")
+                continue
+            
+            # Detect file type from base64 data
+            with stage("upload.detect_type"):
+                file_type = detect_file_type(base64_data, image_bytes)
+            if not file_type:
+                errors.append(f"Photo {i}: Unable to detect file type from base64 data")
+                continue
+            
+            pending.append((i, timestamp_str, image_bytes, {
+                'data': base64_data,
+                'file_type': file_type,
+                'path': photo_data.get('path') or 'uploaded_via_web',
+                'location': location,
+                'timestamp': timestamp
+            }))
+        
+        # Decode and resize for embedding, in worker processes when the batch is large.
+        # This also reads the GPS coordinates stored with each row.
+        with stage("upload.prepare"):
+            prepared_photos = preprocess_payloads([image_bytes for _, _, image_bytes, _ in pending])
+        valid = []
+        for (i, timestamp_str, _, row), prepared in zip(pending, prepared_photos):
+            # The outbox drainer could not embed these either; reject them instead of storing them
+            if prepared.error:
+                errors.append(f"Photo {i}: Unable to prepare image - {prepared.error}")
+                continue
+            row.update(Photo.coordinate_columns(prepared.gps_coords))
+            valid.append((i, timestamp_str, row, prepared))
+        
+        # Embed before the INSERT so the transaction only covers the insert and the outbox rows
+        with stage("upload.embed"):
+            embedded = embed_photos(
+                [prepared.image_bytes for _, _, _, prepared in valid],
+                [caption_text(row['location']) for _, _, row, _ in valid],
+            )
+        
+        # Insert all valid photos in one round trip; bad rows are isolated by savepoints
+        with stage("upload.db_insert"):
+            photo_ids, insert_errors = Photo.bulk_create([row for _, _, row, _ in valid])
+        
+        # Vector writes go into the outbox in the photos' transaction and are delivered in the background
+        outbox_rows = []
+        for (i, timestamp_str, row, prepared), (embeddings, embed_error), photo_id, insert_error in zip(
+            valid, embedded, photo_ids, insert_errors
+        ):
+            if insert_error:
+                errors.append(f"Photo {i}: {insert_error}")
+                continue
+            if embed_error:
+                # The photo is still stored; the outbox drainer computes the missing embeddings
+                error_msg = f"Photo {i} (ID: {photo_id}): Embedding failed, retrying in the background - {embed_error}"
+                vector_processing_errors.append(error_msg)
+                logger.warning(error_msg)
+            metadata = photo_vector_metadata(photo_id, row['timestamp'], row['location'], prepared.gps_coords)
+            kinds = embedding_kinds(caption_text(row['location']))
+            outbox_rows.extend(outbox_row(photo_id, kind, embeddings.get(kind), metadata) for kind in kinds)
+            created_photos.append({
+                'index': i,
+                'id': photo_id,
+                'location': row['location'],
+                'timestamp': timestamp_str,
+                'file_type': row['file_type']
+            })
+        
+        # Commit all successful photos together with their vector writes
         if created_photos:
-            db.session.commit()
+            with stage("upload.outbox"):
+                enqueue_vector_writes(outbox_rows)
+            with stage("upload.db_commit"):
+                db.session.commit()
+            invalidate_search_cache()
+            request_outbox_drain(current_app._get_current_object())
             logger.info(f"Successfully uploaded {len(created_photos)} photos to PostgreSQL")
+            request_event_indexing(current_app._get_current_object())
+            if CAPTION_ON_UPLOAD:
+                request_captioning(current_app._get_current_object())
+        
+        UPLOADED_PHOTOS.labels("created").inc(len(created_photos))
+        UPLOADED_PHOTOS.labels("rejected").inc(len(errors))
+        UPLOADED_PHOTOS.labels("vector_error").inc(len(vector_processing_errors))
         
         response = {
             "success": len(created_photos) > 0,
             "created_count": len(created_photos),
             "error_count": len(errors),
             "vector_processing_error_count": len(vector_processing_errors),
+            # Searchable once the outbox drainer has written them to the index
+            "vectors_queued": len(outbox_rows) if created_photos else 0,
             "created_photos": created_photos
         }
         
@@ -159,8 +363,8 @@ def upload_photos_batch():
         return jsonify({"error": f"Failed to upload photos: {str(e)}"}), 500
 
 
-def detect_file_type(base64_data):
-    """Detect file type from base64 encoded data"""
+def detect_file_type(base64_data, image_bytes=None):
+    """Detect file type from base64 encoded data, reusing already decoded bytes if given"""
     try:
         # Remove data URL prefix if present
         if base64_data.startswith('data:'):
@@ -170,23 +374,11 @@ def detect_file_type(base64_data):
                 file_type = header.split('image/')[1].split(';')[0]
                 return file_type.lower()
         
-        # Decode first few bytes to check magic numbers
-        decoded_data = base64.b64decode(base64_data[:100])  # Just first few bytes
+        if image_bytes is None:
+            image_bytes = base64.b64decode(base64_data[:100])  # Just first few bytes
         
         # Check magic numbers for common image formats
-        if decoded_data.startswith(b'\xff\xd8\xff'):
-            return 'jpg'
-        elif decoded_data.startswith(b'\x89PNG\r\n\x1a\n'):
-            return 'png'
-        elif decoded_data.startswith(b'GIF8'):
-            return 'gif'
-        elif decoded_data.startswith(b'RIFF') and b'WEBP' in decoded_data[:20]:
-            return 'webp'
-        elif decoded_data.startswith(b'BM'):
-            return 'bmp'
-        else:
-            # Default to jpg if unknown
-            return 'jpg'
+        return detect_image_type(image_bytes[:20])
             
     except Exception:
         return 'jpg'  # Default fallback
@@ -258,6 +450,60 @@ def get_photos_endpoint():
         return jsonify({"error": f"Failed to get photos: {str(e)}"}), 500
 
 
+def _date_arg(name):
+    """Optional ISO date/datetime query parameter; raises ValueError if malformed"""
+    value = request.args.get(name)
+    return datetime.fromisoformat(value) if value else None
+
+
+def get_events_endpoint():
+    """
+    Trips/events in chronological order
+    Query parameters: start, end (ISO dates, end exclusive), location (substring), limit
+    """
+    try:
+        limit = request.args.get('limit', 20, type=int)
+        if limit < 1 or limit > 1000:
+            return jsonify({"error": "Limit must be between 1 and 1000"}), 400
+        try:
+            start, end = _date_arg('start'), _date_arg('end')
+        except ValueError:
+            return jsonify({"error": "Invalid date format. Use ISO format (e.g., '2024-01-01')"}), 400
+        
+        total, events = find_events(start, end, request.args.get('location'), limit=limit)
+        return jsonify({
+            "success": True,
+            "events": [event.to_dict() for event in events],
+            "total": total
+        })
+        
+    except Exception as e:
+        return jsonify({"error": f"Failed to get events: {str(e)}"}), 500
+
+
+def get_timeline_endpoint():
+    """
+    Photo counts per day and per place
+    Query parameters: start, end (ISO dates, end exclusive), place (substring, per-day counts only)
+    """
+    try:
+        try:
+            start, end = _date_arg('start'), _date_arg('end')
+        except ValueError:
+            return jsonify({"error": "Invalid date format. Use ISO format (e.g., '2024-01-01')"}), 400
+        start = start.date() if start else None
+        end = end.date() if end else None
+        
+        return jsonify({
+            "success": True,
+            "days": [{"day": day.isoformat(), "count": count} for day, count in day_counts(start, end, request.args.get('place'))],
+            "places": [{"place": place, "count": count} for place, count in place_counts(start, end)]
+        })
+        
+    except Exception as e:
+        return jsonify({"error": f"Failed to get timeline: {str(e)}"}), 500
+
+
 def delete_all_data_endpoint():
     """
     Delete all photos from PostgreSQL database and all vectors from Pinecone namespace
@@ -313,7 +559,10 @@ def delete_all_data_endpoint():
         # Delete photos from PostgreSQL
         logger.info("Deleting photos from PostgreSQL...")
         try:
+            # Queued vector writes would bring the deleted photos back into the index
+            VectorOutbox.query.delete()
             deleted_count = Photo.query.delete()
+            clear_event_index()
             db.session.commit()
             deletion_results["postgresql"]["deleted"] = deleted_count
             deletion_results["postgresql"]["success"] = True
@@ -323,6 +572,9 @@ def delete_all_data_endpoint():
             deletion_results["postgresql"]["error"] = str(e)
             logger.error(f"PostgreSQL deletion failed: {str(e)}")
         
+        # Even a partial deletion makes cached search results stale
+        invalidate_search_cache()
+        
         # Verify deletions
         photo_count_after = Photo.query.count()
         
@@ -350,6 +602,45 @@ def delete_all_data_endpoint():
         }), 500
 
 
+def bulk_delete_endpoint():
+    """
+    Delete the photos matching a filter, with their vectors and event index entries
+    Body: ids, path_prefix, start, end (ISO, end exclusive), location, bbox; at least one is required.
+    Without {'confirmed': true} only counts the matching photos.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        try:
+            filters = filter_from_dict(data)
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": f"Invalid filter: {str(e)}"}), 400
+        if filters.is_empty():
+            return jsonify({"error": "At least one filter is required; use /delete_all_data to delete everything"}), 400
+
+        confirmed = data.get('confirmed', False)
+        result = delete_photos(filters, dry_run=not confirmed)
+        if not confirmed:
+            return jsonify({
+                "success": False,
+                "message": "Confirmation required. This will delete the matching photos permanently.",
+                "data_to_delete": result.to_dict(),
+                "confirmation_required": True,
+                "note": "Send the same filter with {'confirmed': true} to proceed"
+            }), 200
+
+        logger.info(f"Bulk delete removed {result.deleted_photos}/{result.matched} photos")
+        response = {"success": result.error is None, "results": result.to_dict()}
+        return jsonify(response), 200 if result.error is None else 207
+
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Failed to delete photos: {str(e)}")
+        return jsonify({
+            "success": False,
+            "error": f"Failed to delete photos: {str(e)}"
+        }), 500
+
+
 def chat_endpoint():
     logger.info("Chat endpoint called")
     try:
@@ -399,9 +690,22 @@ def chat_endpoint():
 
 def register_routes(app):
     """Register all routes with the Flask app"""
+    app.before_request(_start_request)
+    app.after_request(_record_request)
+    app.teardown_request(_finish_request)
     app.add_url_rule('/health', 'health_check', health_check, methods=['GET'])
+    app.add_url_rule('/metrics', 'metrics', metrics_endpoint, methods=['GET'])
+    app.add_url_rule('/admin/traces', 'admin_traces', admin_traces_endpoint, methods=['GET'])
+    app.add_url_rule('/admin/traces/<trace_id>', 'admin_trace', admin_trace_endpoint, methods=['GET'])
+    app.add_url_rule('/admin/profiling', 'admin_profiling', admin_profiling_endpoint, methods=['GET', 'POST'])
+    app.add_url_rule('/admin/profiles', 'admin_profiles', admin_profiles_endpoint, methods=['GET'])
+    app.add_url_rule('/admin/profiles/<name>', 'admin_profile', admin_profile_endpoint, methods=['GET'])
+    app.add_url_rule('/stats/embeddings', 'embedding_stats', embedding_stats_endpoint, methods=['GET'])
     app.add_url_rule('/upload_photos', 'upload_photos_batch', upload_photos_batch, methods=['POST'])
     app.add_url_rule('/photos', 'get_photos', get_photos_endpoint, methods=['GET'])
+    app.add_url_rule('/events', 'get_events', get_events_endpoint, methods=['GET'])
+    app.add_url_rule('/timeline', 'get_timeline', get_timeline_endpoint, methods=['GET'])
     # app.add_url_rule('/search', 'search_photos', search_photos_endpoint, methods=['POST'])
     app.add_url_rule('/delete_all_data', 'delete_all_data', delete_all_data_endpoint, methods=['POST', 'DELETE'])
+    app.add_url_rule('/photos/delete', 'bulk_delete', bulk_delete_endpoint, methods=['POST'])
     app.add_url_rule('/chat', 'chat', chat_endpoint, methods=['POST']) 
\ No newline at end of file
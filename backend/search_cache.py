@@ -0,0 +1,143 @@
+"""
+In-process cache for search results (scored photo IDs).
+
+Entries are keyed on (normalized query, top_k, threshold, filters) and evicted by
+TTL and LRU size bound. Every write path (API upload, delete, uploader script)
+bumps a generation; a lookup under a newer generation drops the whole cache so
+stale results are never served. The generation lives partly in a marker file so
+that writes from other processes on the same host (e.g. the uploader script) are
+seen by the API server too. Checking it costs one os.stat().
+"""
+import os
+import time
+import tempfile
+import threading
+import logging
+from collections import OrderedDict
+from typing import Hashable, List, Optional, Tuple
+from metrics import register_collector
+
+logger = logging.getLogger(__name__)
+
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "1024"))
+SEARCH_CACHE_TTL_SECONDS = float(os.getenv("SEARCH_CACHE_TTL_SECONDS", "300"))
+SEARCH_CACHE_GENERATION_FILE = os.getenv(
+    "SEARCH_CACHE_GENERATION_FILE",
+    os.path.join(tempfile.gettempdir(), "lyfe-search-cache.generation"),
+)
+
+ScoredIds = List[Tuple[int, float]]
+
+
+def normalize_query(query: str) -> str:
+    """Case- and whitespace-insensitive form of a query string."""
+    return " ".join(query.lower().split())
+
+
+class SearchCache:
+    """Thread-safe TTL + LRU cache invalidated by a generation counter."""
+
+    def __init__(
+        self,
+        max_entries: int = SEARCH_CACHE_MAX_ENTRIES,
+        ttl_seconds: float = SEARCH_CACHE_TTL_SECONDS,
+        generation_file: Optional[str] = SEARCH_CACHE_GENERATION_FILE,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.generation_file = generation_file
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._local_generation = 0
+        self._seen_generation = self.generation()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(query: str, top_k: int, threshold: float, filters: Hashable = None) -> tuple:
+        return (normalize_query(query), top_k, threshold, filters)
+
+    def generation(self) -> tuple:
+        """Current generation: local writes plus the shared marker file's identity."""
+        file_generation = None
+        if self.generation_file:
+            try:
+                stat = os.stat(self.generation_file)
+                file_generation = (stat.st_ino, stat.st_mtime_ns)
+            except OSError:
+                pass
+        return (self._local_generation, file_generation)
+
+    def bump_generation(self):
+        """Invalidate every cached result, in this process and in others sharing the marker file."""
+        with self._lock:
+            self._local_generation += 1
+            self._entries.clear()
+        if self.generation_file:
+            try:
+                # Replace (not rewrite) the file so its inode changes even on coarse-mtime filesystems
+                tmp_path = f"{self.generation_file}.{os.getpid()}.tmp"
+                with open(tmp_path, "w") as f:
+                    f.write(str(time.time_ns()))
+                os.replace(tmp_path, self.generation_file)
+            except OSError as e:
+                logger.warning(f"Could not update search cache generation file: {e}")
+
+    def get(self, key: tuple) -> Optional[ScoredIds]:
+        generation = self.generation()
+        now = time.monotonic()
+        with self._lock:
+            if generation != self._seen_generation:
+                self._entries.clear()
+                self._seen_generation = generation
+
+            entry = self._entries.get(key)
+            if entry is None or now - entry[0] > self.ttl_seconds:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(entry[1])
+
+    def put(self, key: tuple, value: ScoredIds, generation: tuple):
+        """Store a result computed under `generation` (read before the search started)."""
+        # A write happened while we were searching; the result may already be stale
+        if generation != self.generation():
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), tuple(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+
+# Shared by every search in this process
+search_cache = SearchCache()
+
+
+def _search_cache_metrics():
+    stats = search_cache.stats()
+    yield ("lyfe_search_cache_lookups_total", "counter", "Search cache lookups by result",
+           [({"result": "hit"}, stats["hits"]), ({"result": "miss"}, stats["misses"])])
+    yield ("lyfe_search_cache_entries", "gauge", "Cached search results", [({}, stats["entries"])])
+
+
+register_collector(_search_cache_metrics)
+
+
+def invalidate_search_cache():
+    """Call after any write to photos or vectors."""
+    search_cache.bump_generation()
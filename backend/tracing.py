@@ -0,0 +1,309 @@
+"""
+Request-scoped traces: a tree of timed spans per API request.
+
+public_api starts a trace for each request (TRACE_SAMPLE_RATE of them) and every
+metrics.stage() inside it opens a span, so a /chat trace shows each LLM call (with
+token counts), embedding, vector query, DB fetch and image encode in order and
+nested. Finished traces are kept in an in-memory ring buffer (TRACE_BUFFER_SIZE)
+and appended as JSON lines to TRACE_FILE if set. /admin/traces reads TRACE_FILE when
+there is one, so under gunicorn it shows the traces of every worker rather than those
+of the worker that answers; the file is rotated to TRACE_FILE.1 at TRACE_FILE_MAX_BYTES.
+
+Outside a trace, span() does nothing. Work handed to a thread pool is traced when
+submitted through propagate(), which carries the current span over.
+"""
+import os
+import json
+import time
+import fcntl
+import uuid
+import random
+import logging
+import threading
+from collections import deque
+from contextvars import ContextVar, copy_context
+from itertools import islice
+from datetime import datetime, timezone
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+TRACING = os.getenv("TRACING", "true").lower() == "true"
+# Fraction of requests traced; admins can force one with X-Trace: 1
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "200"))
+TRACE_FILE = os.getenv("TRACE_FILE")
+TRACE_FILE_MAX_BYTES = int(os.getenv("TRACE_FILE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Traces read back from TRACE_FILE (newest first) when looking one up or listing
+TRACE_FILE_MAX_SCAN = 10000
+
+# Spans beyond this are counted but not kept (e.g. one embedding span per photo of a huge upload)
+MAX_SPANS_PER_TRACE = 2000
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+class Span:
+    """One timed operation; `attributes` holds details such as token counts."""
+    __slots__ = ("trace", "name", "started", "duration", "attributes", "children", "error")
+
+    def __init__(self, trace: "Trace", name: str, attributes: dict):
+        self.trace = trace
+        self.name = name
+        self.started = time.perf_counter()
+        self.duration = None
+        self.attributes = attributes
+        self.children: List[Span] = []
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> dict:
+        data = {
+            "name": self.name,
+            "start_ms": round((self.started - self.trace.root.started) * 1000, 3),
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+        }
+        if self.attributes:
+            data["attributes"] = self.attributes
+        if self.error:
+            data["error"] = self.error
+        if self.children:
+            data["children"] = [child.to_dict() for child in list(self.children)]
+        return data
+
+
+class Trace:
+    def __init__(self, name: str, attributes: dict):
+        self.id = uuid.uuid4().hex[:16]
+        self.started_at = datetime.now(timezone.utc)
+        self.root = Span(self, name, attributes)
+        self.span_count = 1
+        self.dropped_spans = 0
+        self._lock = threading.Lock()
+
+    def _add(self, parent: Span, span: Span) -> bool:
+        with self._lock:
+            if self.span_count >= MAX_SPANS_PER_TRACE:
+                self.dropped_spans += 1
+                return False
+            self.span_count += 1
+            parent.children.append(span)
+            return True
+
+    def _walk(self):
+        stack = [self.root]
+        while stack:
+            span = stack.pop()
+            yield span
+            stack.extend(span.children)
+
+    def totals(self) -> dict:
+        """Token counts summed over the LLM spans, and time per span name."""
+        totals = {"input_tokens": 0, "output_tokens": 0, "llm_calls": 0}
+        by_name = {}
+        for span in self._walk():
+            if "input_tokens" in span.attributes or "output_tokens" in span.attributes:
+                totals["llm_calls"] += 1
+                totals["input_tokens"] += span.attributes.get("input_tokens") or 0
+                totals["output_tokens"] += span.attributes.get("output_tokens") or 0
+            if span is not self.root and span.duration is not None:
+                entry = by_name.setdefault(span.name, {"count": 0, "total_ms": 0.0})
+                entry["count"] += 1
+                entry["total_ms"] = round(entry["total_ms"] + span.duration * 1000, 3)
+        totals["spans"] = by_name
+        return totals
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.root.name,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": round(self.root.duration * 1000, 3) if self.root.duration is not None else None,
+            "attributes": self.root.attributes,
+            "error": self.root.error,
+            "span_count": self.span_count,
+            "dropped_spans": self.dropped_spans,
+        }
+
+    def to_dict(self) -> dict:
+        return {**self.summary(), "totals": self.totals(), "root": self.root.to_dict()}
+
+
+class _NoSpan:
+    """Stands in for a span outside a trace."""
+    __slots__ = ()
+
+    def set(self, **attributes):
+        pass
+
+
+NO_SPAN = _NoSpan()
+
+_buffer = deque(maxlen=TRACE_BUFFER_SIZE)
+_buffer_lock = threading.Lock()
+_file_lock = threading.Lock()
+
+
+def start_trace(name: str, force: bool = False, **attributes):
+    """
+    Start a trace in the current context, sampled at TRACE_SAMPLE_RATE unless `force`.
+    Returns (trace, token) for finish_trace, or None if this request isn't traced.
+    """
+    if not TRACING or (not force and random.random() >= TRACE_SAMPLE_RATE):
+        return None
+    trace = Trace(name, attributes)
+    return trace, _current_span.set(trace.root)
+
+
+def finish_trace(started, error: Optional[str] = None, **attributes) -> Optional[Trace]:
+    """End a trace from start_trace: store it in the ring buffer (and TRACE_FILE)."""
+    if started is None:
+        return None
+    trace, token = started
+    trace.root.duration = time.perf_counter() - trace.root.started
+    trace.root.attributes.update(attributes)
+    trace.root.error = error
+    _current_span.reset(token)
+    with _buffer_lock:
+        _buffer.append(trace)
+    if TRACE_FILE:
+        try:
+            _append_to_file((json.dumps(trace.to_dict(), default=str) + "\n").encode())
+        except OSError as e:
+            logger.warning(f"Could not write trace to {TRACE_FILE}: {e}")
+    return trace
+
+
+def _append_to_file(line: bytes):
+    # Every server process appends to the same file: rotate under an exclusive lock, and
+    # write each line with a single unbuffered write so lines never interleave
+    with _file_lock, open(f"{TRACE_FILE}.lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if os.path.exists(TRACE_FILE) and os.path.getsize(TRACE_FILE) >= TRACE_FILE_MAX_BYTES:
+                os.replace(TRACE_FILE, f"{TRACE_FILE}.1")
+            with open(TRACE_FILE, "ab", buffering=0) as f:
+                f.write(line)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _lines_backwards(path: str, block_size: int = 1 << 16):
+    """Lines of a file, last first, read a block at a time from the end."""
+    with open(path, "rb") as f:
+        position = f.seek(0, os.SEEK_END)
+        partial = b""
+        while position > 0:
+            size = min(block_size, position)
+            position -= size
+            f.seek(position)
+            lines = (f.read(size) + partial).split(b"\n")
+            partial = lines.pop(0)
+            for line in reversed(lines):
+                if line:
+                    yield line
+        if partial:
+            yield partial
+
+
+def _file_traces():
+    """Traces in TRACE_FILE and its rotated predecessor as dicts, newest first."""
+    scanned = 0
+    for path in (TRACE_FILE, f"{TRACE_FILE}.1"):
+        try:
+            for line in _lines_backwards(path):
+                if scanned >= TRACE_FILE_MAX_SCAN:
+                    return
+                scanned += 1
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+        except FileNotFoundError:
+            continue
+
+
+def current_trace() -> Optional[Trace]:
+    span = _current_span.get()
+    return span.trace if span is not None else None
+
+
+def enter_span(name: str, **attributes):
+    """Open a child of the current span. Returns (span, token) for exit_span, or None outside a trace."""
+    parent = _current_span.get()
+    if parent is None:
+        return None
+    span = Span(parent.trace, name, attributes)
+    if not parent.trace._add(parent, span):
+        return None
+    return span, _current_span.set(span)
+
+
+def exit_span(entered, error: Optional[BaseException] = None):
+    if entered is None:
+        return
+    span, token = entered
+    span.duration = time.perf_counter() - span.started
+    if error is not None:
+        span.error = f"{type(error).__name__}: {error}"
+    _current_span.reset(token)
+
+
+class span:
+    """`with span("name", key=value) as s: ... s.set(tokens=...)` (a no-op outside a trace)."""
+
+    def __init__(self, name: str, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self._entered = None
+
+    def __enter__(self):
+        self._entered = enter_span(self.name, **self.attributes)
+        return self._entered[0] if self._entered else NO_SPAN
+
+    def __exit__(self, exc_type, exc, tb):
+        exit_span(self._entered, exc)
+        return False
+
+
+def propagate(fn: Callable) -> Callable:
+    """Wrap `fn` so it runs under the caller's current span, e.g. on a thread pool."""
+    if _current_span.get() is None:
+        return fn
+    context = copy_context()
+
+    def run(*args, **kwargs):
+        # Each call gets its own copy: a context can only be entered by one thread at a time
+        return context.copy().run(fn, *args, **kwargs)
+
+    return run
+
+
+def recent_traces(name: Optional[str] = None, min_duration_ms: float = 0.0, limit: int = 50) -> List[dict]:
+    """Finished traces (Trace.to_dict()), newest first: from TRACE_FILE if set, else this process's buffer."""
+    if TRACE_FILE:
+        matching = (
+            trace for trace in _file_traces()
+            if (name is None or trace["name"] == name) and (trace["duration_ms"] or 0) >= min_duration_ms
+        )
+        return list(islice(matching, limit))
+    with _buffer_lock:
+        traces = list(_buffer)
+    matching = [
+        trace for trace in reversed(traces)
+        if (name is None or trace.root.name == name) and (trace.root.duration or 0) * 1000 >= min_duration_ms
+    ]
+    return [trace.to_dict() for trace in matching[:limit]]
+
+
+def get_trace(trace_id: str) -> Optional[dict]:
+    with _buffer_lock:
+        trace = next((trace for trace in _buffer if trace.id == trace_id), None)
+    if trace is not None:
+        return trace.to_dict()
+    if TRACE_FILE:
+        # Traced by another worker
+        return next((trace for trace in _file_traces() if trace["id"] == trace_id), None)
+    return None
@@ -0,0 +1,964 @@
+"""
+Local compressed vector index: IVF partitioning with int8 or product-quantized codes.
+
+LocalVectorIndex implements the part of the Pinecone Index API the service uses
+(upsert, query, fetch, update, delete, describe_index_stats) and is selected with
+VECTOR_BACKEND=ivf. Vectors are L2-normalised, so inner product is cosine similarity.
+
+The float32 originals stay on disk. What lives in RAM per 512-d vector is its
+code (512 bytes with int8, 64 bytes with 64 PQ sub-quantizers), 8 bytes of list
+bookkeeping, its id and slot, and its metadata as compact JSON: about 270 bytes
+for photo metadata. Against 2 KB of float32 that is ~2.4x smaller with int8 and
+~4.7x with PQ (python -m benchmarks.vector_index; memory_bytes itemises it). Queries score
+the codes of the `nprobe` nearest IVF lists and re-rank the best candidates exactly
+against the float32 originals, which are memory-mapped from disk. Until a namespace
+holds VECTOR_INDEX_TRAIN_MIN vectors it is searched exactly.
+
+Writes go to an append-only log next to a snapshot, so an upsert costs O(batch)
+I/O. Other processes (e.g. the uploader script) see new writes on their next read.
+Training (first at VECTOR_INDEX_TRAIN_MIN vectors, again after RETRAIN_GROWTH x growth)
+runs on a background thread without the namespace lock; searches use the previous
+state until the new centroids and codes are swapped in.
+"""
+import os
+import sys
+import json
+import time
+import fcntl
+import logging
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Set
+import numpy as np
+from constants import VECTOR_DIMENSION
+
+logger = logging.getLogger(__name__)
+
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", os.path.join("instance", "vector_index"))
+# Always-local index of the low-dimensional vectors used by coarse-to-fine search
+COARSE_VECTOR_INDEX_DIR = os.getenv("COARSE_VECTOR_INDEX_DIR", os.path.join("instance", "coarse_vector_index"))
+# "int8" (1 byte per dimension) or "pq" (VECTOR_INDEX_PQ_SUBVECTORS bytes per vector)
+VECTOR_INDEX_QUANTIZATION = os.getenv("VECTOR_INDEX_QUANTIZATION", "int8").lower()
+VECTOR_INDEX_PQ_SUBVECTORS = int(os.getenv("VECTOR_INDEX_PQ_SUBVECTORS", "64"))
+# IVF lists; 0 picks ~4 * sqrt(n) when the namespace is trained
+VECTOR_INDEX_NLIST = int(os.getenv("VECTOR_INDEX_NLIST", "0"))
+VECTOR_INDEX_NPROBE = int(os.getenv("VECTOR_INDEX_NPROBE", "16"))
+# Candidates re-ranked exactly per query, as a multiple of top_k
+VECTOR_INDEX_RERANK_FACTOR = int(os.getenv("VECTOR_INDEX_RERANK_FACTOR", "8"))
+# Below this many vectors a namespace is scanned exactly and not trained
+VECTOR_INDEX_TRAIN_MIN = int(os.getenv("VECTOR_INDEX_TRAIN_MIN", "5000"))
+
+# Re-rank at least this many candidates, however small top_k is
+MIN_RERANK_CANDIDATES = 64
+
+# Retrain the coarse quantizer once a namespace has grown this much since training
+RETRAIN_GROWTH = 4
+
+# Rewrite the snapshot once the log holds this many records (or half the index, if larger)
+COMPACT_MIN_RECORDS = 10000
+
+KMEANS_ITERATIONS = 20
+# Training uses at most this many vectors per centroid
+KMEANS_SAMPLE_PER_CENTROID = 64
+
+PQ_CENTROIDS = 256
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def nearest_centroid(data: np.ndarray, centroids: np.ndarray, chunk_size: int = 4096) -> np.ndarray:
+    """Index of the nearest centroid (L2) for every row of data."""
+    centroid_norms = (centroids * centroids).sum(axis=1)
+    assignment = np.empty(len(data), dtype=np.int32)
+    for start in range(0, len(data), chunk_size):
+        chunk = data[start:start + chunk_size]
+        # ||x - c||^2 without the ||x||^2 term, which doesn't change the argmin
+        assignment[start:start + chunk_size] = np.argmin(centroid_norms - 2 * chunk @ centroids.T, axis=1)
+    return assignment
+
+
+def kmeans(data: np.ndarray, k: int, iterations: int = KMEANS_ITERATIONS, seed: int = 0, spherical: bool = False) -> np.ndarray:
+    """Lloyd's k-means. spherical=True keeps centroids unit length (cosine clustering)."""
+    rng = np.random.default_rng(seed)
+    data = np.asarray(data, dtype=np.float32)
+    k = min(k, len(data))
+    centroids = data[rng.choice(len(data), k, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = nearest_centroid(data, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, data)
+        counts = np.bincount(assignment, minlength=k)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        # Empty clusters are re-seeded from random points
+        if not filled.all():
+            centroids[~filled] = data[rng.choice(len(data), int((~filled).sum()))]
+        if spherical:
+            centroids = normalize(centroids)
+    return centroids
+
+
+class Int8Quantizer:
+    """Per-dimension scalar quantization to int8."""
+    kind = "int8"
+
+    def __init__(self, dimension: int, scale: Optional[np.ndarray] = None):
+        self.dimension = dimension
+        self.scale = scale
+        self.code_size = dimension
+        self.dtype = np.int8
+
+    def train(self, data: np.ndarray):
+        # Clip the 0.1% largest magnitudes so outliers don't waste resolution
+        self.scale = (np.maximum(np.quantile(np.abs(data), 0.999, axis=0), 1e-6) / 127).astype(np.float32)
+
+    def encode(self, data: np.ndarray) -> np.ndarray:
+        return np.clip(np.rint(data / self.scale), -127, 127).astype(np.int8)
+
+    def scores(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Approximate inner products of query with the encoded vectors."""
+        return codes.astype(np.float32) @ (query * self.scale)
+
+    def state(self) -> dict:
+        return {"scale": self.scale}
+
+
+class PQQuantizer:
+    """Product quantization: each of `subvectors` slices is coded as one of 256 centroids (one byte)."""
+    kind = "pq"
+
+    def __init__(self, dimension: int, subvectors: int = VECTOR_INDEX_PQ_SUBVECTORS, codebooks: Optional[np.ndarray] = None):
+        if dimension % subvectors:
+            raise ValueError(f"Dimension {dimension} is not divisible by {subvectors} PQ subvectors")
+        self.dimension = dimension
+        self.subvectors = subvectors
+        self.sub_dimension = dimension // subvectors
+        self.codebooks = codebooks
+        self.code_size = subvectors
+        self.dtype = np.uint8
+
+    def _slices(self, data: np.ndarray) -> np.ndarray:
+        return data.reshape(len(data), self.subvectors, self.sub_dimension)
+
+    def train(self, data: np.ndarray):
+        sliced = self._slices(data)
+        codebooks = np.zeros((self.subvectors, PQ_CENTROIDS, self.sub_dimension), dtype=np.float32)
+        for m in range(self.subvectors):
+            centroids = kmeans(sliced[:, m], PQ_CENTROIDS, seed=m)
+            codebooks[m, :len(centroids)] = centroids
+            # Tiny training sets: pad with copies so every code is valid
+            codebooks[m, len(centroids):] = centroids[0]
+        self.codebooks = codebooks
+
+    def encode(self, data: np.ndarray) -> np.ndarray:
+        sliced = self._slices(data)
+        codes = np.empty((len(data), self.subvectors), dtype=np.uint8)
+        for m in range(self.subvectors):
+            codes[:, m] = nearest_centroid(sliced[:, m], self.codebooks[m])
+        return codes
+
+    def scores(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Asymmetric distance computation: one lookup table per subvector, then gather and sum."""
+        tables = np.einsum('mkd,md->mk', self.codebooks, query.reshape(self.subvectors, self.sub_dimension))
+        return tables[np.arange(self.subvectors), codes].sum(axis=1)
+
+    def state(self) -> dict:
+        return {"codebooks": self.codebooks}
+
+
+def make_quantizer(kind: str, dimension: int, pq_subvectors: int = VECTOR_INDEX_PQ_SUBVECTORS):
+    if kind == "int8":
+        return Int8Quantizer(dimension)
+    if kind == "pq":
+        return PQQuantizer(dimension, pq_subvectors)
+    raise ValueError(f"Unknown vector quantization '{kind}' (expected 'int8' or 'pq')")
+
+
+class VectorFile:
+    """Float32 rows addressed by slot; memory-mapped from `path`, or held in RAM when path is None."""
+
+    def __init__(self, dimension: int, path: Optional[str] = None, capacity: int = 1024):
+        self.dimension = dimension
+        self.path = path
+        self.rows = None
+        self.capacity = 0
+        existing = os.path.getsize(path) // (4 * dimension) if path and os.path.exists(path) else 0
+        self._open(max(capacity, existing))
+
+    def _open(self, capacity: int):
+        if self.path is None:
+            rows = np.zeros((capacity, self.dimension), dtype=np.float32)
+            if self.rows is not None:
+                rows[:self.capacity] = self.rows[:self.capacity]
+            self.rows = rows
+        else:
+            with open(self.path, 'ab'):
+                pass
+            if os.path.getsize(self.path) < capacity * 4 * self.dimension:
+                os.truncate(self.path, capacity * 4 * self.dimension)
+            self.rows = np.memmap(self.path, dtype=np.float32, mode='r+', shape=(capacity, self.dimension))
+        self.capacity = capacity
+
+    def ensure(self, rows: int):
+        if rows > self.capacity:
+            self._open(max(rows, 2 * self.capacity))
+
+    def write(self, slots: List[int], values: np.ndarray):
+        self.ensure(max(slots) + 1)
+        self.rows[slots] = values
+
+    def read(self, slots) -> np.ndarray:
+        return np.asarray(self.rows[slots])
+
+    def flush(self):
+        if isinstance(self.rows, np.memmap):
+            self.rows.flush()
+
+
+def compile_filter(spec: Optional[dict]) -> Optional[Callable[[dict], bool]]:
+    """Turn a Pinecone-style metadata filter into a predicate over metadata dicts."""
+    if not spec:
+        return None
+
+    comparisons = {
+        "$eq": lambda value, arg: value == arg,
+        "$ne": lambda value, arg: value != arg,
+        "$gt": lambda value, arg: value is not None and value > arg,
+        "$gte": lambda value, arg: value is not None and value >= arg,
+        "$lt": lambda value, arg: value is not None and value < arg,
+        "$lte": lambda value, arg: value is not None and value <= arg,
+        "$in": lambda value, arg: value in arg,
+        "$nin": lambda value, arg: value not in arg,
+    }
+
+    def build(node: dict) -> Callable[[dict], bool]:
+        predicates = []
+        for key, condition in node.items():
+            if key == "$and":
+                parts = [build(part) for part in condition]
+                predicates.append(lambda meta, parts=parts: all(p(meta) for p in parts))
+            elif key == "$or":
+                parts = [build(part) for part in condition]
+                predicates.append(lambda meta, parts=parts: any(p(meta) for p in parts))
+            elif isinstance(condition, dict):
+                for op, arg in condition.items():
+                    if op not in comparisons:
+                        raise ValueError(f"Unsupported filter operator '{op}'")
+                    compare = comparisons[op]
+                    predicates.append(lambda meta, key=key, compare=compare, arg=arg: compare(meta.get(key), arg))
+            else:
+                predicates.append(lambda meta, key=key, arg=condition: meta.get(key) == arg)
+        return lambda meta: all(p(meta) for p in predicates)
+
+    return build(spec)
+
+
+class IVFIndex:
+    """
+    Inverted-file index over compressed codes with exact re-ranking.
+
+    Vectors occupy slots in a VectorFile; freed slots are reused. The coarse
+    quantizer and codes exist only once the index is trained.
+    """
+
+    def __init__(
+        self,
+        dimension: int = VECTOR_DIMENSION,
+        quantization: str = VECTOR_INDEX_QUANTIZATION,
+        nlist: int = VECTOR_INDEX_NLIST,
+        nprobe: int = VECTOR_INDEX_NPROBE,
+        rerank_factor: int = VECTOR_INDEX_RERANK_FACTOR,
+        train_min: int = VECTOR_INDEX_TRAIN_MIN,
+        pq_subvectors: int = VECTOR_INDEX_PQ_SUBVECTORS,
+        vectors_path: Optional[str] = None,
+    ):
+        self.dimension = dimension
+        self.quantization = quantization
+        self.nlist_setting = nlist
+        self.nprobe = nprobe
+        self.rerank_factor = rerank_factor
+        self.train_min = train_min
+        self.pq_subvectors = pq_subvectors
+        self.vectors = VectorFile(dimension, vectors_path)
+
+        self.ids: List[Optional[str]] = []
+        self.slots: Dict[str, int] = {}
+        # Compact JSON per vector (a dict per vector costs several times more); empty metadata is not stored
+        self.metadata: Dict[str, bytes] = {}
+        self.free: Set[int] = set()
+
+        self.centroids: Optional[np.ndarray] = None
+        self.quantizer = None
+        self.codes: Optional[np.ndarray] = None
+        self.assignment = np.full(0, -1, dtype=np.int32)
+        # Slots sorted by list plus list offsets, rebuilt lazily after writes
+        self._inverted: Optional[tuple[np.ndarray, np.ndarray]] = None
+        self.trained_count = 0
+        # Slots written since training started (None: not training); install() re-encodes them
+        self._dirty: Optional[Set[int]] = None
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def allocate(self, vector_id: str) -> int:
+        """Slot for vector_id: its current one, a freed one, or a new one."""
+        if vector_id in self.slots:
+            return self.slots[vector_id]
+        if self.free:
+            return self.free.pop()
+        self.ids.append(None)
+        return len(self.ids) - 1
+
+    def upsert(self, ids: List[str], vectors, metadata: List[Optional[dict]]) -> List[int]:
+        """Insert or replace vectors; returns the slots written."""
+        slots = []
+        for vector_id in ids:
+            slot = self.allocate(vector_id)
+            # Claim the slot now so a duplicate id later in the batch reuses it
+            self.slots[vector_id] = slot
+            self.ids[slot] = vector_id
+            slots.append(slot)
+        self.vectors.write(slots, normalize(vectors))
+        self.place(ids, slots, metadata)
+        return slots
+
+    def place(self, ids: List[str], slots: List[int], metadata: List[Optional[dict]]):
+        """Index vectors already written to their slots (also used to replay the log)."""
+        for vector_id, slot, meta in zip(ids, slots, metadata):
+            old_slot = self.slots.get(vector_id)
+            if old_slot is not None and old_slot != slot:
+                self._unlist(old_slot)
+                self.ids[old_slot] = None
+                self.free.add(old_slot)
+            while len(self.ids) <= slot:
+                self.free.add(len(self.ids))
+                self.ids.append(None)
+            self.free.discard(slot)
+            self.slots[vector_id] = slot
+            self.ids[slot] = vector_id
+            self.set_metadata(vector_id, meta)
+
+        if self._dirty is not None:
+            self._dirty.update(slots)
+        if self.is_trained:
+            self._encode(slots)
+
+    def get_metadata(self, vector_id: str) -> dict:
+        encoded = self.metadata.get(vector_id)
+        return json.loads(encoded) if encoded else {}
+
+    def set_metadata(self, vector_id: str, meta: Optional[dict]):
+        if meta:
+            self.metadata[vector_id] = json.dumps(meta, separators=(',', ':')).encode()
+        else:
+            self.metadata.pop(vector_id, None)
+
+    def delete(self, ids: List[str]) -> List[str]:
+        """Remove vectors; returns the ids that existed."""
+        deleted = []
+        for vector_id in ids:
+            slot = self.slots.pop(vector_id, None)
+            if slot is None:
+                continue
+            self._unlist(slot)
+            self.ids[slot] = None
+            self.free.add(slot)
+            self.metadata.pop(vector_id, None)
+            deleted.append(vector_id)
+        return deleted
+
+    def clear(self):
+        self.delete(list(self.slots))
+
+    @property
+    def is_training(self) -> bool:
+        return self._dirty is not None
+
+    def needs_training(self) -> bool:
+        if self.is_training:
+            return False
+        if not self.is_trained:
+            return len(self) >= self.train_min
+        return len(self) >= RETRAIN_GROWTH * max(1, self.trained_count)
+
+    def train(self, seed: int = 0):
+        """(Re)build the coarse quantizer and codes from every live vector, in one go."""
+        live_slots = self.begin_training()
+        self.install(live_slots, self.fit(live_slots, seed))
+
+    def begin_training(self) -> np.ndarray:
+        """Start tracking writes and return the live slots to train on. Call with the index locked."""
+        self._dirty = set()
+        return np.fromiter(self.slots.values(), dtype=np.int64, count=len(self.slots))
+
+    def fit(self, live_slots: np.ndarray, seed: int = 0) -> Optional[tuple]:
+        """
+        Train the coarse quantizer and codes for `live_slots` without touching the index, so it
+        runs without the lock while searches and writes continue. Returns what install() takes.
+        """
+        if len(live_slots) == 0:
+            return None
+        started = time.monotonic()
+        nlist = self.nlist_setting or int(4 * np.sqrt(len(live_slots)))
+        nlist = max(1, min(nlist, len(live_slots)))
+
+        rng = np.random.default_rng(seed)
+        sample_size = min(len(live_slots), max(nlist * KMEANS_SAMPLE_PER_CENTROID, PQ_CENTROIDS * 40))
+        sample = self.vectors.read(np.sort(rng.choice(live_slots, sample_size, replace=False)))
+
+        centroids = kmeans(sample, nlist, seed=seed, spherical=True)
+        quantizer = make_quantizer(self.quantization, self.dimension, self.pq_subvectors)
+        quantizer.train(sample)
+        codes, assignment = self._encode_with(centroids, quantizer, live_slots)
+        logger.info(
+            f"Trained IVF index ({self.quantization}, {len(centroids)} lists) on {sample_size} of "
+            f"{len(live_slots)} vectors in {time.monotonic() - started:.2f}s"
+        )
+        return centroids, quantizer, codes, assignment
+
+    def install(self, live_slots: np.ndarray, trained: Optional[tuple]) -> bool:
+        """
+        Swap in the result of fit(). Call with the index locked. Slots written during training
+        are re-encoded; False if training was abandoned (the index was reloaded meanwhile).
+        """
+        dirty, self._dirty = self._dirty, None
+        if dirty is None or trained is None:
+            return False
+        centroids, quantizer, trained_codes, trained_assignment = trained
+        codes = np.zeros((len(self.ids), quantizer.code_size), dtype=quantizer.dtype)
+        assignment = np.full(len(self.ids), -1, dtype=np.int32)
+        codes[live_slots] = trained_codes
+        assignment[live_slots] = trained_assignment
+        self.centroids, self.quantizer, self.codes, self.assignment = centroids, quantizer, codes, assignment
+        # Slots deleted during training leave their lists; slots written during training are encoded again
+        self.assignment[[slot for slot in live_slots.tolist() if self.ids[slot] is None]] = -1
+        rewritten = [slot for slot in dirty if self.ids[slot] is not None]
+        self._inverted = None
+        if rewritten:
+            self._encode(rewritten)
+        self.trained_count = len(self.slots)
+        return True
+
+    def _encode_with(self, centroids: np.ndarray, quantizer, slots: np.ndarray, chunk_size: int = 8192):
+        codes = np.empty((len(slots), quantizer.code_size), dtype=quantizer.dtype)
+        assignment = np.empty(len(slots), dtype=np.int32)
+        for start in range(0, len(slots), chunk_size):
+            vectors = self.vectors.read(slots[start:start + chunk_size])
+            assignment[start:start + chunk_size] = np.argmax(vectors @ centroids.T, axis=1)
+            codes[start:start + chunk_size] = quantizer.encode(vectors)
+        return codes, assignment
+
+    def _encode(self, slots: List[int], chunk_size: int = 8192):
+        if len(self.ids) > len(self.assignment):
+            capacity = max(len(self.ids), 2 * len(self.assignment))
+            codes = np.zeros((capacity, self.quantizer.code_size), dtype=self.quantizer.dtype)
+            codes[:len(self.codes)] = self.codes
+            assignment = np.full(capacity, -1, dtype=np.int32)
+            assignment[:len(self.assignment)] = self.assignment
+            self.codes, self.assignment = codes, assignment
+
+        slots = np.asarray(slots, dtype=np.int64)
+        codes, assignment = self._encode_with(self.centroids, self.quantizer, slots, chunk_size)
+        self.codes[slots] = codes
+        self.assignment[slots] = assignment
+        self._inverted = None
+
+    def _unlist(self, slot: int):
+        if self.is_trained and slot < len(self.assignment):
+            self.assignment[slot] = -1
+            self._inverted = None
+
+    def _inverted_lists(self) -> tuple[np.ndarray, np.ndarray]:
+        """Slots grouped by list (one int32 per vector) and where each list starts."""
+        if self._inverted is None:
+            assignment = self.assignment[:len(self.ids)]
+            order = np.argsort(assignment, kind="stable").astype(np.int32)
+            # Unassigned (-1) slots sort first and are skipped by the offsets
+            counts = np.bincount(assignment[assignment >= 0], minlength=len(self.centroids))
+            offsets = np.concatenate(([0], np.cumsum(counts))) + int((assignment < 0).sum())
+            self._inverted = (order, offsets)
+        return self._inverted
+
+    def _exact(self, query: np.ndarray, slots: np.ndarray) -> np.ndarray:
+        return self.vectors.read(slots) @ query
+
+    def _best(self, slots: np.ndarray, scores: np.ndarray, limit: int, predicate) -> np.ndarray:
+        """Positions of the best `limit` scores, best first, whose slots pass the metadata predicate."""
+        if predicate is None:
+            if len(scores) > limit:
+                best = np.argpartition(-scores, limit - 1)[:limit]
+                return best[np.argsort(-scores[best])]
+            return np.argsort(-scores)
+
+        # Metadata is only checked for as many candidates as it takes to fill the limit
+        taken = []
+        for position in np.argsort(-scores).tolist():
+            if predicate(self.get_metadata(self.ids[slots[position]])):
+                taken.append(position)
+                if len(taken) >= limit:
+                    break
+        return np.asarray(taken, dtype=np.int64)
+
+    def exact_search(self, query, top_k: int, predicate: Optional[Callable[[dict], bool]] = None) -> List[tuple[str, float]]:
+        """Brute-force search over the float32 originals."""
+        query = normalize(query)
+        slots = np.fromiter(self.slots.values(), dtype=np.int64, count=len(self.slots))
+        if len(slots) == 0:
+            return []
+        scores = self._exact(query, slots)
+        return [(self.ids[slots[i]], float(scores[i])) for i in self._best(slots, scores, top_k, predicate)]
+
+    def score(self, query, ids: List[str], top_k: int) -> List[tuple[str, float]]:
+        """Exact scores of the given ids (unknown ones are skipped) against the float32 originals, best first."""
+        slots = np.fromiter((self.slots[i] for i in ids if i in self.slots), dtype=np.int64)
+        if len(slots) == 0:
+            return []
+        scores = self._exact(normalize(query), slots)
+        return [(self.ids[slots[i]], float(scores[i])) for i in self._best(slots, scores, top_k, None)]
+
+    def search(
+        self,
+        query,
+        top_k: int,
+        predicate: Optional[Callable[[dict], bool]] = None,
+        nprobe: Optional[int] = None,
+        rerank_factor: Optional[int] = None,
+    ) -> List[tuple[str, float]]:
+        """Approximate search: scan codes of the nprobe nearest lists, re-rank the best exactly."""
+        if not self.is_trained:
+            return self.exact_search(query, top_k, predicate)
+
+        query = normalize(query)
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        probe = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        order, offsets = self._inverted_lists()
+        slots = np.concatenate([order[offsets[list_no]:offsets[list_no + 1]] for list_no in probe])
+        if len(slots) == 0:
+            return []
+
+        approximate = self.quantizer.scores(query, self.codes[slots])
+        candidates = max(top_k * (rerank_factor or self.rerank_factor), MIN_RERANK_CANDIDATES)
+        shortlist = slots[self._best(slots, approximate, candidates, predicate)]
+        if len(shortlist) == 0:
+            return []
+
+        exact = self._exact(query, shortlist)
+        order = np.argsort(-exact)[:top_k]
+        return [(self.ids[shortlist[i]], float(exact[i])) for i in order]
+
+    def memory_bytes(self) -> dict:
+        """
+        Resident bytes of everything held per vector (codes, lists, ids, slot map, metadata),
+        next to what flat float32 storage would need for the vectors alone.
+        """
+        n = len(self)
+        code_bytes = n * self.quantizer.code_size * np.dtype(self.quantizer.dtype).itemsize if self.is_trained else 0
+        centroid_bytes = self.centroids.nbytes if self.is_trained else 0
+        quantizer_bytes = sum(np.asarray(v).nbytes for v in self.quantizer.state().values()) if self.is_trained else 0
+        # List assignment and the inverted lists: two int32 per vector
+        list_bytes = n * 8 if self.is_trained else 0
+        # The id strings are shared by `ids` and `slots`; slot numbers above 256 are int objects
+        id_bytes = (
+            sys.getsizeof(self.ids) + sys.getsizeof(self.slots) + sys.getsizeof(self.free)
+            + sum(sys.getsizeof(vector_id) for vector_id in self.slots)
+            + sum(sys.getsizeof(slot) for slot in self.slots.values() if slot > 256)
+        )
+        metadata_bytes = sys.getsizeof(self.metadata) + sum(sys.getsizeof(encoded) for encoded in self.metadata.values())
+        return {
+            "vectors": n,
+            "code_bytes": code_bytes + centroid_bytes + quantizer_bytes + list_bytes,
+            "id_bytes": id_bytes,
+            "metadata_bytes": metadata_bytes,
+            "index_bytes": code_bytes + centroid_bytes + quantizer_bytes + list_bytes + id_bytes + metadata_bytes,
+            "flat_float32_bytes": n * self.dimension * 4,
+        }
+
+    # Persistence of everything except the float32 originals (which live in the VectorFile)
+
+    def snapshot_state(self) -> dict:
+        manifest = {
+            "dimension": self.dimension,
+            "quantization": self.quantization,
+            "pq_subvectors": self.pq_subvectors,
+            "trained_count": self.trained_count,
+            "ids": self.ids,
+            "metadata": {vector_id: encoded.decode() for vector_id, encoded in self.metadata.items()},
+        }
+        state = {"manifest": np.array(json.dumps(manifest))}
+        if self.is_trained:
+            state.update(
+                centroids=self.centroids,
+                codes=self.codes[:len(self.ids)],
+                assignment=self.assignment[:len(self.ids)],
+                **{f"quantizer_{key}": value for key, value in self.quantizer.state().items()},
+            )
+        return state
+
+    def load_state(self, state):
+        manifest = json.loads(str(state["manifest"]))
+        self.quantization = manifest["quantization"]
+        self.pq_subvectors = manifest["pq_subvectors"]
+        self.trained_count = manifest["trained_count"]
+        self.ids = manifest["ids"]
+        # Older snapshots hold metadata dicts, newer ones their JSON
+        self.metadata = {
+            vector_id: (meta if isinstance(meta, str) else json.dumps(meta, separators=(',', ':'))).encode()
+            for vector_id, meta in manifest["metadata"].items() if meta
+        }
+        self.slots = {vector_id: slot for slot, vector_id in enumerate(self.ids) if vector_id is not None}
+        self.free = {slot for slot, vector_id in enumerate(self.ids) if vector_id is None}
+        self.vectors.ensure(len(self.ids))
+
+        self.centroids = None
+        self.quantizer = None
+        self.codes = None
+        self.assignment = np.full(0, -1, dtype=np.int32)
+        self._inverted = None
+        # A training run in progress started from the state being replaced
+        self._dirty = None
+        if "centroids" in state:
+            self.centroids = state["centroids"]
+            self.quantizer = make_quantizer(self.quantization, self.dimension, self.pq_subvectors)
+            if self.quantization == "int8":
+                self.quantizer.scale = state["quantizer_scale"]
+            else:
+                self.quantizer.codebooks = state["quantizer_codebooks"]
+            self.codes = np.array(state["codes"])
+            self.assignment = np.array(state["assignment"])
+
+
+@dataclass
+class Match:
+    id: str
+    score: float
+    metadata: dict = field(default_factory=dict)
+    values: List[float] = field(default_factory=list)
+
+
+@dataclass
+class QueryResponse:
+    matches: List[Match]
+    namespace: str = ""
+
+
+@dataclass
+class FetchedVector:
+    id: str
+    values: List[float]
+    metadata: dict = field(default_factory=dict)
+
+
+@dataclass
+class FetchResponse:
+    vectors: Dict[str, FetchedVector]
+    namespace: str = ""
+
+
+@dataclass
+class NamespaceStats:
+    vector_count: int
+
+
+@dataclass
+class IndexStats:
+    namespaces: Dict[str, NamespaceStats]
+    dimension: int
+    total_vector_count: int
+
+
+class _Namespace:
+    """One IVFIndex persisted as vectors.f32 + snapshot.npz + log.jsonl in its own directory."""
+
+    def __init__(self, directory: str, dimension: int, index_options: dict):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.snapshot_path = os.path.join(directory, "snapshot.npz")
+        self.log_path = os.path.join(directory, "log.jsonl")
+        self.lock_path = os.path.join(directory, "lock")
+        self.index = IVFIndex(dimension, vectors_path=os.path.join(directory, "vectors.f32"), **index_options)
+        self.log_offset = 0
+        self.log_records = 0
+        self.snapshot_id = None
+        # Guards the in-memory index; searches in different namespaces run in parallel
+        self.lock = threading.RLock()
+        with self.file_lock(fcntl.LOCK_SH):
+            self._load()
+
+    @contextmanager
+    def file_lock(self, mode: int):
+        """Serialise writers across processes (readers take a shared lock while catching up)."""
+        with open(self.lock_path, 'a') as f:
+            fcntl.flock(f, mode)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _stat_snapshot(self):
+        try:
+            stat = os.stat(self.snapshot_path)
+            return (stat.st_ino, stat.st_mtime_ns)
+        except OSError:
+            return None
+
+    def _log_size(self) -> int:
+        try:
+            return os.path.getsize(self.log_path)
+        except OSError:
+            return 0
+
+    def _load(self):
+        self.snapshot_id = self._stat_snapshot()
+        if self.snapshot_id is not None:
+            with np.load(self.snapshot_path) as state:
+                self.index.load_state(state)
+        else:
+            self.index.load_state({"manifest": np.array(json.dumps({
+                "quantization": self.index.quantization, "pq_subvectors": self.index.pq_subvectors,
+                "trained_count": 0, "ids": [], "metadata": {},
+            }))})
+        self.log_offset = 0
+        self.log_records = 0
+        self._replay()
+
+    def _replay(self):
+        """Apply log records written since log_offset."""
+        if self._log_size() <= self.log_offset:
+            return
+        puts = []
+        with open(self.log_path, 'rb') as f:
+            f.seek(self.log_offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # partially written record
+                self.log_offset += len(line)
+                self.log_records += 1
+                record = json.loads(line)
+                if record["op"] == "put":
+                    puts.append(record)
+                    continue
+                self._apply_puts(puts)
+                puts = []
+                if record["op"] == "delete":
+                    self.index.delete(record["ids"])
+                elif record["op"] == "clear":
+                    self.index.clear()
+        self._apply_puts(puts)
+
+    def _apply_puts(self, puts: List[dict]):
+        if not puts:
+            return
+        self.index.vectors.ensure(max(record["slot"] for record in puts) + 1)
+        self.index.place(
+            [record["id"] for record in puts],
+            [record["slot"] for record in puts],
+            [record.get("metadata") for record in puts],
+        )
+
+    def refresh(self):
+        """Catch up with writes from other processes."""
+        if self._stat_snapshot() == self.snapshot_id and self._log_size() <= self.log_offset:
+            return
+        with self.file_lock(fcntl.LOCK_SH):
+            if self._stat_snapshot() != self.snapshot_id:
+                self._load()
+            else:
+                self._replay()
+
+    def append(self, records: List[dict]):
+        self.index.vectors.flush()
+        data = "".join(json.dumps(record) + "\n" for record in records).encode()
+        with open(self.log_path, 'ab') as f:
+            f.write(data)
+        self.log_offset += len(data)
+        self.log_records += len(records)
+
+    def maybe_compact(self, force: bool = False):
+        if force or self.log_records >= max(COMPACT_MIN_RECORDS, len(self.index) // 2):
+            tmp_path = f"{self.snapshot_path}.{os.getpid()}.tmp.npz"
+            np.savez(tmp_path, **self.index.snapshot_state())
+            os.replace(tmp_path, self.snapshot_path)
+            if os.path.exists(self.log_path):
+                os.truncate(self.log_path, 0)
+            self.snapshot_id = self._stat_snapshot()
+            self.log_offset = 0
+            self.log_records = 0
+
+
+class LocalVectorIndex:
+    """Pinecone-compatible index handle backed by one persisted IVFIndex per namespace."""
+
+    def __init__(self, directory: str = VECTOR_INDEX_DIR, dimension: int = VECTOR_DIMENSION, **index_options):
+        self.directory = directory
+        self.dimension = dimension
+        self.index_options = index_options
+        self._namespaces: Dict[str, _Namespace] = {}
+        self._trainers: Dict[str, threading.Thread] = {}
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _namespace(self, name: str) -> _Namespace:
+        with self._lock:
+            namespace = self._namespaces.get(name)
+            if namespace is None:
+                namespace = _Namespace(os.path.join(self.directory, name or "__default__"), self.dimension, self.index_options)
+                self._namespaces[name] = namespace
+            return namespace
+
+    @contextmanager
+    def _writing(self, name: str):
+        namespace = self._namespace(name)
+        with namespace.lock, namespace.file_lock(fcntl.LOCK_EX):
+            namespace.refresh()
+            yield namespace
+
+    @contextmanager
+    def _reading(self, name: str):
+        namespace = self._namespace(name)
+        with namespace.lock:
+            namespace.refresh()
+            yield namespace.index
+
+    def upsert(self, vectors: List, namespace: str = "", batch_size: Optional[int] = None, **kwargs):
+        """Insert or replace vectors given as dicts ({id, values, metadata}) or (id, values[, metadata]) tuples."""
+        items = [v if isinstance(v, dict) else dict(zip(("id", "values", "metadata"), v)) for v in vectors]
+        if not items:
+            return {"upserted_count": 0}
+        with self._writing(namespace) as ns:
+            ids = [str(item["id"]) for item in items]
+            metadata = [item.get("metadata") or {} for item in items]
+            slots = ns.index.upsert(ids, np.asarray([item["values"] for item in items], dtype=np.float32), metadata)
+            ns.append([{"op": "put", "id": i, "slot": s, "metadata": m} for i, s, m in zip(ids, slots, metadata)])
+            ns.maybe_compact()
+            if ns.index.needs_training():
+                live_slots = ns.index.begin_training()
+                trainer = threading.Thread(target=self._train, args=(namespace, live_slots), name="vector-index-train", daemon=True)
+                self._trainers[namespace] = trainer
+                trainer.start()
+        return {"upserted_count": len(items)}
+
+    def _train(self, name: str, live_slots: np.ndarray):
+        """
+        Train a namespace in the background: k-means and encoding run without any lock, so
+        searches and writes carry on against the previous state. Only the swap is locked.
+        """
+        namespace = self._namespace(name)
+        try:
+            trained = namespace.index.fit(live_slots)
+        except Exception as e:
+            logger.error(f"Training vector index namespace '{name}' failed: {e}")
+            trained = None
+        with self._writing(name) as ns:
+            if ns.index.install(live_slots, trained):
+                # Other processes load the trained state from the snapshot
+                ns.maybe_compact(force=True)
+
+    def wait_for_training(self, timeout: Optional[float] = None) -> bool:
+        """Wait for background training threads; False if one is still running after `timeout` seconds."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for trainer in list(self._trainers.values()):
+            trainer.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+            if trainer.is_alive():
+                return False
+        return True
+
+    def query(
+        self,
+        vector: List[float],
+        top_k: int = 10,
+        namespace: str = "",
+        filter: Optional[dict] = None,
+        include_values: bool = False,
+        include_metadata: bool = False,
+        **kwargs,
+    ) -> QueryResponse:
+        with self._reading(namespace) as index:
+            results = index.search(vector, top_k, compile_filter(filter))
+            matches = [
+                Match(
+                    id=vector_id,
+                    score=score,
+                    metadata=index.get_metadata(vector_id) if include_metadata else {},
+                    values=index.vectors.read([index.slots[vector_id]])[0].tolist() if include_values else [],
+                )
+                for vector_id, score in results
+            ]
+        return QueryResponse(matches=matches, namespace=namespace)
+
+    def score(self, vector: List[float], ids: List[str], top_k: int = 10, namespace: str = "") -> QueryResponse:
+        """
+        The best top_k of these ids by exact similarity, computed in place. Not part of the
+        Pinecone API: it lets callers re-rank candidates without fetching their vectors.
+        """
+        with self._reading(namespace) as index:
+            results = index.score(vector, list(map(str, ids)), top_k)
+        return QueryResponse(matches=[Match(id=vector_id, score=score) for vector_id, score in results], namespace=namespace)
+
+    def fetch(self, ids: List[str], namespace: str = "", **kwargs) -> FetchResponse:
+        """Stored vectors by id. Values come back unit-normalised."""
+        with self._reading(namespace) as index:
+            found = [vector_id for vector_id in map(str, ids) if vector_id in index.slots]
+            values = index.vectors.read([index.slots[vector_id] for vector_id in found]) if found else []
+            vectors = {
+                vector_id: FetchedVector(id=vector_id, values=row.tolist(), metadata=index.get_metadata(vector_id))
+                for vector_id, row in zip(found, values)
+            }
+        return FetchResponse(vectors=vectors, namespace=namespace)
+
+    def update(self, id: str, values: Optional[List[float]] = None, set_metadata: Optional[dict] = None, namespace: str = "", **kwargs):
+        with self._writing(namespace) as ns:
+            vector_id = str(id)
+            if vector_id not in ns.index.slots:
+                return {}
+            metadata = {**ns.index.get_metadata(vector_id), **(set_metadata or {})}
+            if values is not None:
+                slot = ns.index.upsert([vector_id], np.asarray([values], dtype=np.float32), [metadata])[0]
+            else:
+                slot = ns.index.slots[vector_id]
+                ns.index.set_metadata(vector_id, metadata)
+            ns.append([{"op": "put", "id": vector_id, "slot": slot, "metadata": metadata}])
+            ns.maybe_compact()
+        return {}
+
+    def delete(self, ids: Optional[List[str]] = None, delete_all: bool = False, namespace: str = "", filter: Optional[dict] = None, **kwargs):
+        with self._writing(namespace) as ns:
+            if delete_all:
+                ns.index.clear()
+                ns.append([{"op": "clear"}])
+            else:
+                if filter:
+                    predicate = compile_filter(filter)
+                    ids = [vector_id for vector_id in ns.index.slots if predicate(ns.index.get_metadata(vector_id))]
+                deleted = ns.index.delete([str(vector_id) for vector_id in ids or []])
+                if deleted:
+                    ns.append([{"op": "delete", "ids": deleted}])
+            ns.maybe_compact()
+        return {}
+
+    def describe_index_stats(self, **kwargs) -> IndexStats:
+        namespaces = {}
+        for entry in os.scandir(self.directory):
+            if not entry.is_dir():
+                continue
+            name = "" if entry.name == "__default__" else entry.name
+            with self._reading(name) as index:
+                if len(index):
+                    namespaces[name] = NamespaceStats(vector_count=len(index))
+        return IndexStats(
+            namespaces=namespaces,
+            dimension=self.dimension,
+            total_vector_count=sum(ns.vector_count for ns in namespaces.values()),
+        )
+
+    def memory_bytes(self) -> dict:
+        """Index memory per loaded namespace (see IVFIndex.memory_bytes)."""
+        return {name: ns.index.memory_bytes() for name, ns in list(self._namespaces.items())}
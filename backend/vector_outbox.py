@@ -0,0 +1,317 @@
+"""
+Transactional outbox for vector writes.
+
+/upload_photos inserts one vector_outbox row per vector (image, location text and,
+with COARSE_SEARCH, coarse image) in the same transaction as the photos, so a photo
+is never committed without a record of the vectors it needs. A background thread
+delivers the rows to the index in batches of up to OUTBOX_BATCH_SIZE, grouped into
+one upsert stream per index and namespace, and deletes them once written.
+
+Failed batches are retried with exponential backoff (OUTBOX_RETRY_BASE_SECONDS,
+doubling per attempt up to OUTBOX_RETRY_MAX_SECONDS). Rows still failing after
+OUTBOX_MAX_ATTEMPTS are kept as dead letters, counted in the metrics and
+retried by `photo_uploader_script.py --drain-outbox`.
+Rows whose embedding could not be computed at upload carry no embedding and are
+embedded here from the stored photo, OUTBOX_EMBED_BATCH_SIZE at a time. Those rows
+are leased rather than locked while the embedding calls run (their next_attempt_at
+is pushed OUTBOX_EMBED_LEASE_SECONDS ahead and committed), so a bulk delete or another
+drainer never waits on the embedding service. Delivery is idempotent: vector IDs are
+photo IDs, so a batch delivered twice (e.g. after a crash before the delete) just
+overwrites the same vectors.
+"""
+import os
+import logging
+from collections import defaultdict
+from datetime import timedelta
+from functools import partial
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from sqlalchemy import bindparam, func, insert, update
+from sqlalchemy.orm import defer
+from background import BackgroundPass
+from clients import get_coarse_vector_index, get_vector_index
+from constants import COARSE_VECTOR_DIMENSION, LOCATION_NAMESPACE, PHOTOS_NAMESPACE
+from database import db
+from image_prep import decode_base64_payload, prepare_image
+from metrics import Counter, register_collector, stage
+from models import Photo, VectorOutbox, utc_now
+from search_cache import invalidate_search_cache
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "500"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "10"))
+OUTBOX_RETRY_BASE_SECONDS = float(os.getenv("OUTBOX_RETRY_BASE_SECONDS", "5"))
+OUTBOX_RETRY_MAX_SECONDS = float(os.getenv("OUTBOX_RETRY_MAX_SECONDS", "600"))
+# Rows without an embedding computed per pass, and how long they stay claimed meanwhile
+OUTBOX_EMBED_BATCH_SIZE = int(os.getenv("OUTBOX_EMBED_BATCH_SIZE", "16"))
+OUTBOX_EMBED_LEASE_SECONDS = float(os.getenv("OUTBOX_EMBED_LEASE_SECONDS", "300"))
+
+# Vector kinds and where they go: (index getter, namespace)
+TARGETS = {
+    "image": (get_vector_index, PHOTOS_NAMESPACE),
+    "location": (get_vector_index, LOCATION_NAMESPACE),
+    "coarse": (get_coarse_vector_index, PHOTOS_NAMESPACE),
+}
+
+OUTBOX_VECTORS = Counter("lyfe_vector_outbox_vectors", "Outbox vectors by delivery outcome", ("outcome",))
+
+
+def outbox_row(photo_id: int, kind: str, embedding: Optional[list], metadata: Optional[dict]) -> dict:
+    """Column values of one outbox row; embedding None means the drainer computes it."""
+    return {
+        "photo_id": photo_id,
+        "kind": kind,
+        "embedding": np.asarray(embedding, dtype=np.float32).tobytes() if embedding is not None else None,
+        "vector_metadata": metadata,
+    }
+
+
+def enqueue_vector_writes(rows: List[dict]):
+    """Add outbox rows to the current transaction (one executemany); the caller commits."""
+    if rows:
+        db.session.execute(insert(VectorOutbox), rows)
+
+
+def _retry_delay(attempts: int) -> float:
+    return min(OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1), OUTBOX_RETRY_MAX_SECONDS)
+
+
+def _embed(kind: str, data: str, location: Optional[str]) -> Optional[list]:
+    """Compute an embedding that failed at upload, from the stored photo."""
+    from photo_service import caption_text, gen_image_embedding_from_prepared, gen_text_embedding
+
+    if kind == "location":
+        text = caption_text(location)
+        return gen_text_embedding(text) if text else None
+    image_bytes = prepare_image(decode_base64_payload(data))
+    if kind == "coarse":
+        return gen_image_embedding_from_prepared(image_bytes, COARSE_VECTOR_DIMENSION)
+    return gen_image_embedding_from_prepared(image_bytes)
+
+
+def _vector(entry: VectorOutbox, photo: Photo) -> dict:
+    from photo_service import photo_vector_metadata
+
+    metadata = entry.vector_metadata
+    if metadata is None:
+        coords = (photo.latitude, photo.longitude) if photo.latitude is not None else None
+        metadata = photo_vector_metadata(photo.id, photo.timestamp, photo.location, coords)
+    return {"id": str(photo.id), "values": np.frombuffer(entry.embedding, dtype=np.float32).tolist(), "metadata": metadata}
+
+
+def _due():
+    return (VectorOutbox.next_attempt_at <= utc_now(), VectorOutbox.attempts < OUTBOX_MAX_ATTEMPTS)
+
+
+def _give_up(row_id: int, photo_id: int, kind: str, error: str):
+    logger.error(f"Giving up on outbox row {row_id} (photo {photo_id}, {kind}): {error}")
+
+
+@stage("outbox.embed")
+def embed_missing(limit: int = OUTBOX_EMBED_BATCH_SIZE) -> Tuple[int, int]:
+    """
+    Compute the embeddings of up to `limit` due rows that have none and store them on the
+    rows for delivery. Returns (embedded, failed) row counts.
+    """
+    from photo_service import run_embedding_calls
+
+    entries = (
+        VectorOutbox.query
+        .filter(VectorOutbox.embedding.is_(None), *_due())
+        .order_by(VectorOutbox.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    if not entries:
+        db.session.commit()
+        return 0, 0
+
+    photos = {
+        photo_id: (data, location)
+        for photo_id, data, location in db.session.query(Photo.id, Photo.data, Photo.location)
+        .filter(Photo.id.in_({entry.photo_id for entry in entries}))
+    }
+    claimed = [(entry.id, entry.photo_id, entry.kind, entry.attempts) for entry in entries]
+    # Lease the rows and release their locks before calling the embedding service
+    lease_until = utc_now() + timedelta(seconds=OUTBOX_EMBED_LEASE_SECONDS)
+    for entry in entries:
+        entry.next_attempt_at = lease_until
+    db.session.commit()
+
+    # Rows of photos deleted since are dropped; the rest are embedded concurrently
+    dropped = [row_id for row_id, photo_id, _, _ in claimed if photo_id not in photos]
+    claimed = [row for row in claimed if row[1] in photos]
+    outcomes = run_embedding_calls([partial(_embed, kind, *photos[photo_id]) for _, photo_id, kind, _ in claimed])
+
+    embedded = []
+    failed = []
+    for (row_id, photo_id, kind, attempts), (values, error) in zip(claimed, outcomes):
+        if error:
+            failed.append((row_id, photo_id, kind, attempts + 1, f"Embedding failed: {error}"[:1000]))
+        elif values is None:
+            dropped.append(row_id)
+        else:
+            embedded.append((row_id, np.asarray(values, dtype=np.float32).tobytes()))
+
+    # Rows a bulk delete removed meanwhile are simply not updated
+    now = utc_now()
+    table = VectorOutbox.__table__
+    if embedded:
+        db.session.execute(
+            table.update().where(table.c.id == bindparam("row_id")).values(
+                embedding=bindparam("embedding"), next_attempt_at=now
+            ),
+            [{"row_id": row_id, "embedding": embedding} for row_id, embedding in embedded],
+        )
+    if failed:
+        db.session.execute(
+            table.update().where(table.c.id == bindparam("row_id")).values(
+                attempts=bindparam("attempts"), last_error=bindparam("error"), next_attempt_at=bindparam("due")
+            ),
+            [
+                {"row_id": row_id, "attempts": attempts, "error": error, "due": now + timedelta(seconds=_retry_delay(attempts))}
+                for row_id, _, _, attempts, error in failed
+            ],
+        )
+        for row_id, photo_id, kind, attempts, error in failed:
+            if attempts >= OUTBOX_MAX_ATTEMPTS:
+                _give_up(row_id, photo_id, kind, error)
+    if dropped:
+        VectorOutbox.query.filter(VectorOutbox.id.in_(dropped)).delete(synchronize_session=False)
+    db.session.commit()
+
+    OUTBOX_VECTORS.labels("embedded").inc(len(embedded))
+    OUTBOX_VECTORS.labels("failed").inc(len(failed))
+    if failed:
+        logger.warning(f"{len(failed)} outbox embeddings failed; first error: {failed[0][4]}")
+    return len(embedded), len(failed)
+
+
+@stage("outbox.drain")
+def drain_outbox(limit: int = OUTBOX_BATCH_SIZE) -> Tuple[int, int]:
+    """Embed what is missing, then deliver up to `limit` due outbox rows. Returns (delivered, failed) vector counts."""
+    from photo_service import upsert_vectors
+
+    _, embed_failed = embed_missing()
+
+    # Several server processes may drain at once; each claims different rows (PostgreSQL)
+    entries = (
+        VectorOutbox.query
+        .filter(VectorOutbox.embedding.isnot(None), *_due())
+        .order_by(VectorOutbox.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    if not entries:
+        db.session.commit()
+        return 0, embed_failed
+
+    photos = {
+        photo.id: photo
+        for photo in Photo.query.options(defer(Photo.data)).filter(Photo.id.in_({entry.photo_id for entry in entries}))
+    }
+    groups: Dict[str, List[Tuple[VectorOutbox, dict]]] = defaultdict(list)
+    done: List[int] = []
+    failures: Dict[int, str] = {}
+    for entry in entries:
+        photo = photos.get(entry.photo_id)
+        if photo is None:
+            # Photo deleted since: writing its vector would resurrect it in search
+            done.append(entry.id)
+            continue
+        groups[entry.kind].append((entry, _vector(entry, photo)))
+
+    delivered = 0
+    for kind, items in groups.items():
+        get_index, namespace = TARGETS[kind]
+        try:
+            upsert_vectors([vector for _, vector in items], namespace, index=get_index())
+        except Exception as e:
+            for entry, _ in items:
+                failures[entry.id] = f"Upsert to {kind} failed: {e}"
+            continue
+        done.extend(entry.id for entry, _ in items)
+        delivered += len(items)
+
+    if done:
+        VectorOutbox.query.filter(VectorOutbox.id.in_(done)).delete(synchronize_session=False)
+    now = utc_now()
+    for entry in entries:
+        if entry.id in failures:
+            entry.attempts += 1
+            entry.last_error = failures[entry.id][:1000]
+            entry.next_attempt_at = now + timedelta(seconds=_retry_delay(entry.attempts))
+            if entry.attempts >= OUTBOX_MAX_ATTEMPTS:
+                _give_up(entry.id, entry.photo_id, entry.kind, entry.last_error)
+    db.session.commit()
+
+    OUTBOX_VECTORS.labels("delivered").inc(delivered)
+    OUTBOX_VECTORS.labels("failed").inc(len(failures))
+    if delivered:
+        # The new vectors change search results
+        invalidate_search_cache()
+        logger.info(f"Delivered {delivered} vectors from the outbox")
+    if failures:
+        logger.warning(f"{len(failures)} outbox vectors failed; first error: {next(iter(failures.values()))}")
+    return delivered, len(failures) + embed_failed
+
+
+def next_retry_in() -> Optional[float]:
+    """Seconds until the earliest pending retry, or None if nothing is pending."""
+    earliest = db.session.query(func.min(VectorOutbox.next_attempt_at)).filter(
+        VectorOutbox.attempts < OUTBOX_MAX_ATTEMPTS
+    ).scalar()
+    if earliest is None:
+        return None
+    return max((earliest - utc_now()).total_seconds(), 0.0)
+
+
+def revive_dead_letters() -> int:
+    """Make rows that ran out of attempts due again; returns how many."""
+    result = db.session.execute(
+        update(VectorOutbox)
+        .where(VectorOutbox.attempts >= OUTBOX_MAX_ATTEMPTS)
+        .values(attempts=0, next_attempt_at=utc_now())
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def _drain_pass() -> Optional[float]:
+    delivered, failed = drain_outbox()
+    # A full batch may have left more behind; otherwise sleep until the next retry
+    return 0.0 if delivered or failed else next_retry_in()
+
+
+# New uploads wake the drainer early; it stays up while retries are scheduled
+_drainer = BackgroundPass("vector-outbox", _drain_pass, error_delay=OUTBOX_RETRY_BASE_SECONDS)
+
+
+def request_outbox_drain(app):
+    """Deliver pending vectors on a background thread, which stays up while retries are scheduled."""
+    _drainer.request(app)
+
+
+def stop_outbox_drainer(timeout: float) -> bool:
+    """Let the drainer finish its current batch and exit; False if it is still busy after `timeout` seconds."""
+    return _drainer.stop(timeout)
+
+
+def _outbox_metrics():
+    # Read at scrape time, inside the /metrics request's app context
+    pending, dead, oldest = db.session.query(
+        func.count(VectorOutbox.id).filter(VectorOutbox.attempts < OUTBOX_MAX_ATTEMPTS),
+        func.count(VectorOutbox.id).filter(VectorOutbox.attempts >= OUTBOX_MAX_ATTEMPTS),
+        func.min(VectorOutbox.created_at),
+    ).one()
+    yield ("lyfe_vector_outbox_pending", "gauge", "Vectors waiting for delivery to the index", [({}, pending)])
+    yield ("lyfe_vector_outbox_dead", "gauge", "Vectors that ran out of delivery attempts", [({}, dead)])
+    age = (utc_now() - oldest).total_seconds() if oldest else 0
+    yield ("lyfe_vector_outbox_oldest_seconds", "gauge", "Age of the oldest undelivered vector", [({}, age)])
+
+
+# Database counts: the same whichever worker is scraped
+register_collector(_outbox_metrics, shared=True)